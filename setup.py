@@ -86,6 +86,7 @@ setup(
         'docutils',
         'six',
         'qrcode',
+        'scandir; python_version < "3.5"',
     ],
     extras_require={
         # eg: 'rst': ['docutils>=0.11'],
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""Writes a presentation as a zip archive: ``index.html``, the assets it uses
+under ``assets/`` (named after a hash of their contents) and a
+``manifest.json``. The archive can be extracted or served as-is.
+
+Assets are streamed from disk into the archive; only stylesheets are read in
+memory, to point their ``url()`` references to the bundled files.
+"""
+import hashlib
+import json
+import os
+import posixpath
+import re
+import time
+import zipfile
+
+from six.moves.urllib.parse import unquote
+
+from . import __version__
+from .manifest import file_hash
+
+ASSETS_DIR = 'assets'
+# already compressed, deflating them again is a waste of time
+STORED_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.webp', '.woff', '.woff2', '.zip', '.gz', '.mp4', '.webm')
+
+_file_url_re = re.compile(r'''(?<=["'(])file://([^"'()<>]+)''')
+_css_url_re = re.compile(r'''url\(\s*(['"]?)([^'")]+?)\1\s*\)''')
+
+
+def split_url(url):
+    """ Splits the ``?query`` or ``#fragment`` suffix off an url.
+    """
+    match = re.search(r'[?#]', url)
+    return (url[:match.start()], url[match.start():]) if match else (url, '')
+
+
+class Bundle(object):
+    """ A zip archive being written, with the assets added so far.
+    """
+
+    def __init__(self, destination, encoding='utf8', logger=None):
+        self.destination = destination
+        self.encoding = encoding
+        self.logger = logger
+        self.archive = None
+        self.assets = {}
+        self.manifest = {}
+
+    def log(self, message, type='notice'):
+        if self.logger:
+            self.logger(message, type)
+
+    def add_asset(self, path):
+        """ Adds a local file to the archive (once) and returns its name in the
+            archive, or ``None`` if there's no such file.
+        """
+        path = os.path.abspath(path)
+        if path in self.assets:
+            return self.assets[path]
+        if not os.path.isfile(path):
+            self.log(u"Failed to bundle %s: no such file" % path, 'warning')
+            return None
+
+        name = os.path.basename(path)
+        if path.endswith('.css'):
+            with open(path, 'rb') as fh:
+                data = self.rewrite_css(fh.read().decode(self.encoding), os.path.dirname(path)).encode('utf-8')
+            digest = hashlib.sha1(data).hexdigest()
+        else:
+            data = None
+            digest = file_hash(path)
+        arcname = posixpath.join(ASSETS_DIR, '%s-%s' % (digest[:12], name))
+        compression = zipfile.ZIP_STORED if name.lower().endswith(STORED_EXTENSIONS) else zipfile.ZIP_DEFLATED
+        if data is None:
+            self.archive.write(path, arcname, compression)
+            size = os.path.getsize(path)
+        else:
+            self.archive.writestr(self.zip_info(arcname, compression), data)
+            size = len(data)
+        self.assets[path] = arcname
+        self.manifest[arcname] = {'name': name, 'sha1': digest, 'size': size}
+        return arcname
+
+    def rewrite_css(self, css, css_dir):
+        """ Bundles the files referenced by a stylesheet and points its
+            ``url()`` to them (relatively to the stylesheet, in ``assets/``).
+        """
+        def replace(match):
+            url = match.group(2)
+            if url.startswith(('data:', 'http://', 'https://', '//', '#')):
+                return match.group(0)
+            path, suffix = split_url(url[len('file://'):] if url.startswith('file://') else url)
+            arcname = self.add_asset(os.path.join(css_dir, unquote(path)))
+            if not arcname:
+                return match.group(0)
+            return 'url(%s%s%s%s)' % (match.group(1), posixpath.basename(arcname), suffix, match.group(1))
+
+        return _css_url_re.sub(replace, css)
+
+    def rewrite_html(self, html):
+        """ Bundles the local files referenced by the html (with ``file://``
+            urls) and points the html to them.
+        """
+        def replace(match):
+            path, suffix = split_url(match.group(1))
+            arcname = self.add_asset(unquote(path))
+            return arcname + suffix if arcname else match.group(0)
+
+        return _file_url_re.sub(replace, html)
+
+    def zip_info(self, name, compression=zipfile.ZIP_DEFLATED):
+        info = zipfile.ZipInfo(name, time.localtime()[:6])
+        info.compress_type = compression
+        info.external_attr = 0o644 << 16
+        return info
+
+    def write(self, html):
+        """ Writes the archive for the given rendered html.
+        """
+        dirname = os.path.dirname(self.destination)
+        if dirname and not os.path.exists(dirname):
+            os.makedirs(dirname)
+        with zipfile.ZipFile(self.destination, 'w', zipfile.ZIP_DEFLATED) as self.archive:
+            html = self.rewrite_html(html).encode('utf-8')
+            self.archive.writestr(self.zip_info('index.html'), html)
+            self.archive.writestr(self.zip_info('manifest.json'), json.dumps({
+                'version': __version__,
+                'index': 'index.html',
+                'assets': self.manifest,
+            }, indent=2, sort_keys=True))
+        self.archive = None
+        self.log(u"Bundled  %d assets and %d bytes of html into %s (%d bytes)"
+                 % (len(self.assets), len(html), self.destination, os.path.getsize(self.destination)))
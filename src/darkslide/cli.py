@@ -3,18 +3,45 @@
 import sys
 from optparse import OptionParser
 
+from six import string_types
+
 from . import __version__
 from . import generator
+from .parser import SUPPORTED_FORMATS
 
 
 def _parse_options():
     """Parses landslide's command line options"""
 
     parser = OptionParser(
-        usage="%prog [options] input.md ...",
+        usage="%prog [options] input.md ...\n       %prog serve-api [options]",
         description="Generates a HTML5 slideshow from Markdown or other formats.",
         version="%prog " + __version__)
 
+    parser.add_option(
+        "--bundle",
+        dest="bundle",
+        help="Write the presentation and its assets to a zip archive (index.html, assets/ and manifest.json) "
+             "instead of the destination file.",
+        metavar="ZIP",
+        default=None)
+
+    parser.add_option(
+        "--cache-dir",
+        dest="cache_dir",
+        help="Where to cache the remote assets downloaded for embedding. "
+             "Default: $XDG_CACHE_HOME/darkslide or ~/.cache/darkslide.",
+        metavar="DIR",
+        default=None)
+
+    parser.add_option(
+        "--check",
+        action="store_true",
+        dest="check",
+        help="Only tell if the presentations are up to date (from the manifest of their last build, without "
+             "rendering them): exit with status 0 if they are, 1 otherwise.",
+        default=False)
+
     parser.add_option(
         "-c", "--copy-theme",
         action="store_true",
@@ -22,6 +49,15 @@ def _parse_options():
         help="Copy theme directory into current presentation source directory.",
         default=False)
 
+    parser.add_option(
+        "--critical-css",
+        action="store_true",
+        dest="critical_css",
+        help="Inline the css the first slide needs and load the stylesheets without blocking the first paint, "
+             "with preload hints for the fonts and the images of the first slides (see --lazy-images). Ignored "
+             "with --embed.",
+        default=False)
+
     parser.add_option(
         "-b", "--debug",
         action="store_true",
@@ -32,9 +68,10 @@ def _parse_options():
     parser.add_option(
         "-d", "--destination",
         dest="destination_file",
-        help="The path to the to the destination html file. Default: presentation.html.",
+        help="The path to the to the destination html file. Default: presentation.html "
+             "(presentation.ndjson with --format=ndjson).",
         metavar="FILE",
-        default="presentation.html")
+        default=None)
 
     parser.add_option(
         "-e", "--encoding",
@@ -43,6 +80,30 @@ def _parse_options():
         metavar="ENCODING",
         default="utf8")
 
+    parser.add_option(
+        "-f", "--input-format",
+        type="choice",
+        choices=sorted(SUPPORTED_FORMATS),
+        dest="input_format",
+        help="The format of the presentation read from stdin (when the input is -). Default: markdown.",
+        default="markdown")
+
+    parser.add_option(
+        "--force",
+        action="store_true",
+        dest="force",
+        help="Generate the presentations even if they are up to date.",
+        default=False)
+
+    parser.add_option(
+        "--format",
+        type="choice",
+        choices=["html", "ndjson"],
+        dest="output_format",
+        help="The output format: html (the presentation, default) or ndjson (the slides as JSON objects, one "
+             "per line, streamed as they are processed).",
+        default="html")
+
     parser.add_option(
         "-i", "--embed",
         action="store_true",
@@ -51,6 +112,31 @@ def _parse_options():
              "standalone document.",
         default=False)
 
+    parser.add_option(
+        "--embed-max-bytes",
+        dest="embed_max_bytes",
+        help="With --embed, copy the images and fonts larger than SIZE (eg: 200k) to a directory next to the "
+             "presentation (named after it, eg: presentation-assets) instead of embedding them.",
+        metavar="SIZE",
+        default=None)
+
+    parser.add_option(
+        "--guess-lang",
+        dest="guess_lang",
+        help="Guess the language of the code blocks that don't give one, among these comma-separated pygments "
+             "lexers (eg: python,javascript,bash). Only the first lines of each block are read.",
+        metavar="LEXERS",
+        default=None)
+
+    parser.add_option(
+        "--lazy-images",
+        type="int",
+        dest="lazy_images",
+        help="Lazy-load the images of the slides after the first N ones, and set the width and height of the "
+             "local images from their files so the slides don't reflow. Ignored with --embed.",
+        metavar="N",
+        default=None)
+
     parser.add_option(
         "-l", "--linenos",
         type="choice",
@@ -63,6 +149,21 @@ def _parse_options():
         default="inline",
     )
 
+    parser.add_option(
+        "--max-asset-size",
+        dest="max_asset_size",
+        help="Size budget of each asset embedded in the presentation (eg: 2M). See --size-budget.",
+        metavar="SIZE",
+        default=None)
+
+    parser.add_option(
+        "--max-size",
+        dest="max_size",
+        help="Size budget of the generated presentation (eg: 50M, units are powers of 1024). "
+             "See --size-budget.",
+        metavar="SIZE",
+        default=None)
+
     parser.add_option(
         "-m", "--max-toc-level",
         type="int",
@@ -70,6 +171,13 @@ def _parse_options():
         help="Limits the TOC level generation to a specific level.",
         default=2)
 
+    parser.add_option(
+        "--minify",
+        action="store_true",
+        dest="minify",
+        help="Minify the html, and the stylesheets and javascript embedded with --embed.",
+        default=False)
+
     parser.add_option(
         "-o", "--direct-output",
         action="store_true",
@@ -101,6 +209,30 @@ def _parse_options():
         default=False,
     )
 
+    parser.add_option(
+        "-S", "--search-index",
+        action="store_true",
+        dest="search_index",
+        help="Embed a full-text search index of the slides (press / to search).",
+        default=False)
+
+    parser.add_option(
+        "--size-budget",
+        type="choice",
+        choices=["fail", "warn"],
+        dest="size_budget",
+        help="What to do when the presentation or one of its assets exceeds its size budget: "
+             "fail the build (default), or warn.",
+        default="fail")
+
+    parser.add_option(
+        "--size-report",
+        action="store_true",
+        dest="size_report",
+        help="Show how the size of the presentation breaks down into slides, embedded assets, "
+             "highlighted code and theme files.",
+        default=False)
+
     parser.add_option(
         "-t", "--theme",
         dest="theme",
@@ -125,17 +257,28 @@ def _parse_options():
         "-w", "--watch",
         action="store_true",
         dest="watch",
-        help="Watch source directory for changes and regenerate slides.",
+        help="Watch the sources and the files they use (images, includes, stylesheets) for changes and "
+             "regenerate the slides depending on them. Several presentations (eg: .cfg files) can be watched "
+             "at once.",
         default=False
     )
 
+    parser.add_option(
+        "--watch-backend",
+        type="choice",
+        choices=["native", "poll"],
+        dest="watch_backend",
+        help="How -w detects changes: native (filesystem events, default) or poll (periodically checks the "
+             "files the presentation uses; for network filesystems and containers).",
+        default="native")
+
     options, args = parser.parse_args()
 
     if not args:
         parser.print_help()
         sys.exit(1)
 
-    return options, args[0]
+    return options, args
 
 
 def log(message, type):
@@ -144,23 +287,57 @@ def log(message, type):
     (sys.stdout if type == 'notice' else sys.stderr).write(message + "\n")
 
 
-def run(input_file, options):
-    """Runs the Generator using parsed options."""
+def run(input_files, options):
+    """Runs the Generator using parsed options, for one or several inputs."""
 
     options.logger = log
-    generator.Generator(input_file, **options.__dict__).execute()
+    input_format = options.__dict__.pop('input_format')
+    check = options.__dict__.pop('check', False)
+    if isinstance(input_files, string_types):
+        input_files = [input_files]
+    if len(input_files) > 1 and ('-' in input_files or options.direct):
+        raise ValueError(u"Standard input and direct output only work with a single input")
+    if input_files == ['-']:
+        # read the presentation from stdin, rendering it entirely in memory
+        text = getattr(sys.stdin, 'buffer', sys.stdin).read().decode(options.encoding)
+        input_files = ['stdin' + SUPPORTED_FORMATS[input_format][0]]
+        options.files = {input_files[0]: text}
+        options.watch = False
+    generators = [generator.Generator(input_file, **options.__dict__) for input_file in input_files]
+    if check:
+        status = 0
+        for deck in generators:
+            output = deck.bundle or deck.destination_file
+            reasons = deck.manifest_changes()
+            for reason in reasons:
+                log(u"Outdated %s: %s" % (output, reason), 'warning')
+            if reasons:
+                status = 1
+            else:
+                deck.log(u"Up to date: %s" % output)
+        return status
+    if len(generators) == 1:
+        generators[0].execute()
+    else:
+        generator.execute_all(generators)
 
 
 def main():
     """Main program entry point"""
 
-    options, input_file = _parse_options()
+    if sys.argv[1:2] == ['serve-api']:
+        from .server import main as serve_api
+
+        return serve_api(sys.argv[2:])
+
+    options, input_files = _parse_options()
 
     if (options.debug):
-        run(input_file, options)
+        sys.exit(run(input_files, options))
     else:
         try:
-            run(input_file, options)
+            status = run(input_files, options)
         except Exception as e:
             sys.stderr.write("Error: %s\n" % e)
             sys.exit(1)
+        sys.exit(status)
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""Critical css: the rules of the stylesheets that may apply to the first
+slide and the chrome of a presentation, inlined in its ``<head>`` so it can be
+shown before the stylesheets (and the fonts they embed) are loaded.
+
+A rule is kept when every tag, class and id of one of its selectors appears in
+the critical html, or for classes and ids, in the scripts (which may set them).
+Pseudo-classes and attribute selectors are ignored, so more rules are kept than
+strictly needed, never less. ``@font-face``, ``@keyframes`` and print rules
+are left to the stylesheets.
+"""
+import os
+import re
+
+from . import scanner
+
+GROUPING_RULES = ('media', 'supports')
+FONT_TYPES = {
+    '.woff2': 'font/woff2',
+    '.woff': 'font/woff',
+    '.ttf': 'font/ttf',
+    '.otf': 'font/otf',
+}
+
+_token_re = re.compile(r'''"(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*'|/\*.*?\*/|[{};]''', re.DOTALL)
+_comment_re = re.compile(r'/\*.*?\*/', re.DOTALL)
+_at_rule_re = re.compile(r'@([\w-]+)')
+_print_re = re.compile(r'\bprint\b', re.IGNORECASE)
+_screen_re = re.compile(r'\b(screen|all)\b', re.IGNORECASE)
+_pseudo_args_re = re.compile(r'\([^()]*\)')
+_attribute_re = re.compile(r'\[[^\]]*\]')
+_pseudo_re = re.compile(r'::?[\w-]+')
+_simple_re = re.compile(r'[.#][\w-]+|(?<![\w.#-])[a-zA-Z][\w-]*')
+_word_re = re.compile(r'[a-zA-Z_][\w-]*')
+_url_re = re.compile(r'''url\(\s*(['"]?)([^'")]+?)\1\s*\)''')
+
+
+def split_rules(css):
+    """ Returns the top-level rules of a stylesheet as ``(prelude, block)``
+        tuples, ``block`` being ``None`` for statements (eg: ``@import``).
+    """
+    rules = []
+    depth = 0
+    start = block_start = 0
+    for match in _token_re.finditer(css):
+        token = match.group()
+        if token == '{':
+            if depth == 0:
+                block_start = match.end()
+            depth += 1
+        elif token == '}':
+            if depth == 0:
+                # stray brace
+                start = match.end()
+                continue
+            depth -= 1
+            if depth == 0:
+                rules.append((_comment_re.sub('', css[start:block_start - 1]).strip(),
+                              css[block_start:match.start()]))
+                start = match.end()
+        elif token == ';' and depth == 0:
+            rules.append((_comment_re.sub('', css[start:match.start()]).strip(), None))
+            start = match.end()
+    return rules
+
+
+def split_selectors(prelude):
+    """ Splits a selector list on its top-level commas.
+    """
+    selectors = []
+    depth = start = 0
+    for position, char in enumerate(prelude):
+        if char in '([':
+            depth += 1
+        elif char in ')]':
+            depth = max(depth - 1, 0)
+        elif char == ',' and depth == 0:
+            selectors.append(prelude[start:position].strip())
+            start = position + 1
+    selectors.append(prelude[start:].strip())
+    return [selector for selector in selectors if selector]
+
+
+def selector_tokens(selector):
+    """ Returns the tags (lowercased), ``.classes`` and ``#ids`` a selector
+        requires.
+    """
+    previous = None
+    while previous != selector:
+        previous, selector = selector, _pseudo_args_re.sub('', selector)
+    selector = _pseudo_re.sub('', _attribute_re.sub('', selector))
+    return set(token if token[0] in '.#' else token.lower() for token in _simple_re.findall(selector))
+
+
+def html_tokens(html):
+    """ Returns the tags, ``.classes`` and ``#ids`` used in some html.
+    """
+    tokens = set()
+    for tag in scanner.iter_tags(html):
+        if tag.closing:
+            continue
+        tokens.add(tag.name)
+        tokens.update('.' + name for name in tag.attrs.get('class', '').split())
+        if tag.attrs.get('id'):
+            tokens.add('#' + tag.attrs['id'])
+    return tokens
+
+
+def script_tokens(script):
+    """ Returns the ``.classes`` and ``#ids`` a script may set: all its words.
+    """
+    words = set(_word_re.findall(script))
+    return set('.' + word for word in words) | set('#' + word for word in words)
+
+
+def extract(css, tokens):
+    """ Returns the rules of a stylesheet that may apply to html using the
+        given tokens (see :func:`html_tokens`).
+    """
+    chunks = []
+    for prelude, block in split_rules(css):
+        if block is None:
+            continue
+        if prelude.startswith('@'):
+            match = _at_rule_re.match(prelude)
+            if match and match.group(1).lower() in GROUPING_RULES and not print_only(prelude):
+                inner = extract(block, tokens)
+                if inner:
+                    chunks.append('%s{%s}' % (prelude, inner))
+            continue
+        selectors = [selector for selector in split_selectors(prelude) if selector_tokens(selector) <= tokens]
+        if selectors:
+            chunks.append('%s{%s}' % (','.join(selectors), block.strip()))
+    return '\n'.join(chunks)
+
+
+def print_only(media):
+    """ Tells if a media query list only applies to print.
+    """
+    return bool(_print_re.search(media)) and not _screen_re.search(media)
+
+
+def font_files(css):
+    """ Returns the ``(url, mime_type)`` of the font files of the
+        ``@font-face`` rules of a stylesheet, in the formats of
+        :data:`FONT_TYPES` (``data:`` urls excluded).
+    """
+    files = []
+    for prelude, block in split_rules(css):
+        if block is None or prelude.lower() != '@font-face':
+            continue
+        for match in _url_re.finditer(block):
+            url = match.group(2)
+            mime_type = FONT_TYPES.get(os.path.splitext(re.split(r'[?#]', url)[0])[1].lower())
+            if mime_type and not url.startswith('data:'):
+                files.append((url, mime_type))
+    return files
+
+
+def rebase_urls(css, rebase):
+    """ Returns the stylesheet with its ``url()`` references replaced by
+        ``rebase(url)``.
+    """
+    return _url_re.sub(lambda match: 'url(%s%s%s)' % (match.group(1), rebase(match.group(2)), match.group(1)), css)
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""Size-aware embedding (``--embed-max-bytes``): with ``--embed``, the images
+and fonts up to a size are still inlined as data urls, the larger ones are
+copied to a directory next to the presentation (``presentation-assets/`` for
+``presentation.html``) and referenced by a relative url, so a single huge file
+doesn't make the presentation unusable.
+
+The copies are named after a hash of their contents: they are only written
+once, and never clash.
+"""
+import hashlib
+import mimetypes
+import os
+import posixpath
+import shutil
+import threading
+
+from six.moves.urllib.parse import quote
+from six.moves.urllib.parse import unquote
+from six.moves.urllib.parse import urlsplit
+
+from . import utils
+from .manifest import file_hash
+
+
+class EmbedPolicy(object):
+    """ Embeds the assets of at most ``max_bytes`` (before base64 encoding)
+        and copies the other ones next to ``destination_file``.
+    """
+
+    def __init__(self, max_bytes, destination_file):
+        self.max_bytes = max_bytes
+        self.destination_dir = os.path.dirname(destination_file)
+        self.directory = os.path.splitext(destination_file)[0] + '-assets'
+        self.lock = threading.Lock()
+
+    def place(self, url, base_dir, fetcher=None):
+        """ Returns the ``(url, size, copied)`` of an asset referenced by an
+            url relative to ``base_dir``: a data url if it is small enough,
+            else the relative url of its copy (``copied`` is then true). Returns
+            ``None`` if the asset can't be read.
+        """
+        if not url or url.startswith(('data:', 'file://')):
+            return None
+        if utils.is_remote(url):
+            fetched = fetcher and fetcher.fetch(url)
+            if not fetched:
+                return None
+            mime_type, data = fetched
+            if len(data) <= self.max_bytes:
+                return utils.encode_data(mime_type, data), len(data), False
+            name = unquote(posixpath.basename(urlsplit(url).path)) or 'asset%s' % (mimetypes.guess_extension(mime_type) or '')
+            return self.copy(name, hashlib.sha1(data).hexdigest(), data=data), len(data), True
+
+        path = os.path.join(base_dir, unquote(url))
+        mime_type = mimetypes.guess_type(path)[0]
+        if not mime_type or not os.path.isfile(path):
+            return None
+        size = os.path.getsize(path)
+        if size <= self.max_bytes:
+            with open(path, 'rb') as fh:
+                return utils.encode_data(mime_type, fh.read()), size, False
+        return self.copy(os.path.basename(path), file_hash(path), path=path), size, True
+
+    def copy(self, name, digest, path=None, data=None):
+        """ Writes a copy of a file (``path``) or of some ``data`` to the
+            assets directory, unless it is already there, and returns its url
+            relative to the presentation.
+        """
+        name = '%s-%s' % (digest[:12], name)
+        target = os.path.join(self.directory, name)
+        with self.lock:
+            if not os.path.exists(target):
+                if not os.path.isdir(self.directory):
+                    os.makedirs(self.directory)
+                partial = target + '.part'
+                if path is None:
+                    with open(partial, 'wb') as fh:
+                        fh.write(data)
+                else:
+                    shutil.copyfile(path, partial)
+                os.rename(partial, target)
+        return posixpath.join(quote(os.path.basename(self.directory)), quote(name))
+
+    def summary(self, embedded, copied):
+        """ Returns lines of text telling which assets were embedded and which
+            ones were copied, given their ``{url: size}``.
+        """
+        lines = [u"Embedded %d assets of at most %s, copied %d larger ones to %s"
+                 % (len(embedded), utils.format_size(self.max_bytes), len(copied), self.directory)]
+        lines.extend(u"  %s (%s)" % (url, utils.format_size(size)) for url, size in sorted(copied.items()))
+        return lines
@@ -1,24 +1,77 @@
 # -*- coding: utf-8 -*-
 import codecs
+import contextlib
+import copy
 import inspect
+import io
+import json
 import os
 import re
 import shutil
 import sys
+import threading
+import time
+import weakref
 
 import jinja2
-from six import binary_type
 from six import string_types
+from six import text_type
 from six.moves import configparser
 
 from . import __version__
+from . import critical
+from . import images
 from . import macro as macro_module
+from . import minify
+from . import scanner
 from . import utils
+from .embedding import EmbedPolicy
+from .manifest import Manifest
+from .manifest import SUFFIX as MANIFEST_SUFFIX
+from .model import Deck
+from .model import Slide
 from .parser import Parser
+from .parser import SUPPORTED_EXTENSIONS
+from .parser import SUPPORTED_FORMATS
+from .remote import RemoteFetcher
+from .report import SizeReport
+from .vfs import MemoryFileSystem
+from .vfs import OSFileSystem
 
 BASE_DIR = os.path.dirname(__file__)
 THEMES_DIR = os.path.join(BASE_DIR, 'themes')
 VALID_LINENOS = ('no', 'inline', 'table')
+SIZE_BUDGET_MODES = ('fail', 'warn')
+OUTPUT_FORMATS = ('html', 'ndjson')
+THEME_CSS = ('base', 'print', 'screen', 'theme')
+# the options changing the output, recorded in the manifest of the builds
+MANIFEST_OPTIONS = ('bundle', 'copy_theme', 'critical_css', 'destination_file', 'embed', 'embed_max_bytes',
+                    'encoding', 'exclude', 'extensions',
+                    'guess_lang', 'include', 'lazy_images', 'linenos', 'maxtoclevel', 'minify', 'output_format',
+                    'presenter_notes', 'relative', 'search_index', 'theme_dir')
+# the options a variant may override, by name in the [variants] section of the
+# configuration files, with the option set and how the value is read
+VARIANT_OPTIONS = {
+    'critical_css': ('critical_css', utils.parse_bool),
+    'destination': ('destination_file', text_type),
+    'embed': ('embed', utils.parse_bool),
+    'lazy-images': ('lazy_images', int),
+    'max-toc-level': ('maxtoclevel', int),
+    'minify': ('minify', utils.parse_bool),
+    'presenter_notes': ('presenter_notes', utils.parse_bool),
+    'relative': ('relative', utils.parse_bool),
+    'search_index': ('search_index', utils.parse_bool),
+    'theme': ('theme', text_type),
+}
+
+# theme files resolved once per theme, and their contents cached across
+# renders and generators (they almost never change in watch mode)
+_theme_files = {}
+_theme_contents = utils.FileCache(utils.read_text)
+_minified_contents = utils.FileCache(minify.minify_file)
+_templates = utils.FileCache(lambda path, encoding: jinja2.Template(utils.read_text(path, encoding)))
+# the macros of the templates, loaded once per template
+_template_modules = weakref.WeakKeyDictionary()
 
 
 class Generator(object):
@@ -45,50 +98,131 @@ class Generator(object):
         """ Configures this generator. Available ``args`` are:
             - ``source``: source file or directory path
             Available ``kwargs`` are:
+            - ``bundle``: path of a zip archive to write the presentation and
+                          its assets to, instead of the destination file
+            - ``cache_dir``: directory where downloaded remote assets are
+                             cached
             - ``copy_theme``: copy theme directory and files into presentation
                               one
-            - ``destination_file``: path to html destination file
+            - ``critical_css``: inline the css rules needed by the first slide
+                                and load the stylesheets without blocking, with
+                                preload hints for the fonts and the images of
+                                the first slides (not with ``embed``)
+            - ``destination_file``: path to html destination file (default:
+                                    ``presentation.html``, or
+                                    ``presentation.ndjson``)
             - ``direct``: enables direct rendering presentation to stdout
             - ``debug``: enables debug mode
             - ``embed``: generates a standalone document, with embedded assets
+            - ``embed_max_bytes``: with ``embed``, copy the images and fonts
+                                   larger than this size (bytes, or a size
+                                   such as ``200k``) next to the presentation
+                                   instead of embedding them
             - ``encoding``: the encoding to use for this presentation
+            - ``exclude``: glob patterns of the files and directories to skip
+                           in source directories
             - ``extensions``: Comma separated list of markdown extensions
+            - ``include``: glob patterns of the files to use in source
+                           directories (default: all the supported formats)
+            - ``force``: generate the presentation even if the manifest of the
+                         last build says it is up to date
+            - ``guess_lang``: lexer names (a list, or a comma separated
+                              string) to guess the language of the code blocks
+                              that don't give one from
+            - ``files``: a ``{path: contents}`` mapping to read the sources,
+                         user files and images from instead of the disk
+                         (``source`` is then a path in that mapping)
+            - ``lazy_images``: lazy-load the images of the slides after this
+                               number of slides, and set the width and height
+                               of the local images (not with ``embed``)
             - ``logger``: a logger lambda to use for logging
+            - ``max_asset_size``: size budget of each embedded asset (bytes,
+                                 or a size such as ``2M``)
+            - ``max_size``: size budget of the rendered presentation
             - ``maxtoclevel``: the maximum level to include in toc
+            - ``minify``: minify the html, and the embedded stylesheets and
+                          javascript
+            - ``output_format``: ``html`` (the default) or ``ndjson`` (the
+                                 slides as newline-delimited JSON)
             - ``presenter_notes``: enable presenter notes
             - ``relative``: enable relative asset urls
+            - ``search_index``: embed a full-text search index of the slides
+            - ``size_budget``: ``fail`` (the default) to fail the build when a
+                               size budget is exceeded, ``warn`` to only log
+                               warnings
+            - ``size_report``: log the breakdown of the size of the rendered
+                               presentation
             - ``theme``: path to the theme to use for this presentation
+            - ``variants``: option overrides (``{option: value}`` dicts, see
+                            :data:`VARIANT_OPTIONS`), each one writing a
+                            variant of the presentation to its own
+                            ``destination_file`` from the same parsed sources
             - ``verbose``: enables verbose output
+            - ``watch``: regenerate the presentation when its files change
+            - ``watch_backend``: ``native`` (watchdog) or ``poll``
         """
         self.user_css = []
         self.user_js = []
+        self.bundle = kwargs.get('bundle', None)
+        self.cache_dir = kwargs.get('cache_dir', None)
         self.copy_theme = kwargs.get('copy_theme', False)
+        self.critical_css = kwargs.get('critical_css', False)
         self.debug = kwargs.get('debug', False)
-        self.destination_file = kwargs.get('destination_file',
-                                           'presentation.html')
+        self.output_format = kwargs.get('output_format') or 'html'
+        if self.output_format not in OUTPUT_FORMATS:
+            raise ValueError(u"Invalid output format %s, expected one of: %s"
+                             % (self.output_format, ', '.join(OUTPUT_FORMATS)))
+        self.destination_file = kwargs.get('destination_file') or 'presentation.%s' % self.output_format
         self.direct = kwargs.get('direct', False)
         self.embed = kwargs.get('embed', False)
+        self.embed_max_bytes = utils.parse_size(kwargs.get('embed_max_bytes'))
         self.encoding = kwargs.get('encoding', 'utf8')
+        self.exclude = kwargs.get('exclude') or []
         self.extensions = kwargs.get('extensions', None)
+        self.files = kwargs.get('files', None)
+        self.force = kwargs.get('force', False)
+        self.guess_lang = macro_module.lexer_names(kwargs.get('guess_lang'))
+        self.include = kwargs.get('include') or []
+        self.lazy_images = kwargs.get('lazy_images', None)
         self.logger = kwargs.get('logger', None)
+        self.max_asset_size = utils.parse_size(kwargs.get('max_asset_size'))
+        self.max_size = utils.parse_size(kwargs.get('max_size'))
         self.maxtoclevel = kwargs.get('maxtoclevel', 2)
+        self.minify = kwargs.get('minify', False)
         self.presenter_notes = kwargs.get('presenter_notes', True)
         self.relative = kwargs.get('relative', False)
+        self.search_index = kwargs.get('search_index', False)
+        self.size_budget = kwargs.get('size_budget') or 'fail'
+        self.size_report = kwargs.get('size_report', False)
         self.theme = kwargs.get('theme', 'default')
+        variants = kwargs.get('variants') or []
         self.verbose = kwargs.get('verbose', False)
         self.linenos = self.linenos_check(kwargs.get('linenos'))
         self.watch = kwargs.get('watch', False)
-        self.num_slides = 0
-        self.__toc = []
+        self.watch_backend = kwargs.get('watch_backend') or 'native'
+        self._deck = Deck()
+        self._local = threading.local()
+        self.slide_cache = {}
+        self.fragment_cache = {}
+        self.cache_lock = threading.Lock()
 
         if self.direct:
             # Only output html in direct output mode, not log messages
             self.verbose = False
 
-        if not source or not os.path.exists(source):
+        if self.files is None:
+            self.fs = OSFileSystem()
+        else:
+            self.fs = MemoryFileSystem(self.files)
+            # there's nothing to copy the theme alongside of
+            self.copy_theme = False
+
+        if not source or not self.fs.exists(source):
             raise IOError("Source file/directory %s does not exist" % source)
 
+        self.config_file = None
         if source.endswith('.cfg'):
+            self.config_file = source
             self.work_dir = os.path.dirname(source)
             config = self.parse_config(source)
             self.source = config.get('source')
@@ -99,13 +233,27 @@ class Generator(object):
             self.embed = config.get('embed', self.embed)
             self.relative = config.get('relative', self.relative)
             self.copy_theme = config.get('copy_theme', self.copy_theme)
+            self.search_index = config.get('search_index', self.search_index)
+            self.critical_css = config.get('critical_css', self.critical_css)
+            self.minify = config.get('minify', self.minify)
+            self.cache_dir = config.get('cache_dir', self.cache_dir)
             self.extensions = config.get('extensions', self.extensions)
+            self.include = config.get('include', self.include)
+            self.exclude = config.get('exclude', self.exclude)
+            self.guess_lang = macro_module.lexer_names(config.get('guess-lang', self.guess_lang))
+            self.lazy_images = config.get('lazy-images', self.lazy_images)
             self.maxtoclevel = config.get('max-toc-level', self.maxtoclevel)
+            self.max_size = config.get('max-size', self.max_size)
+            self.max_asset_size = config.get('max-asset-size', self.max_asset_size)
+            self.embed_max_bytes = config.get('embed-max-bytes', self.embed_max_bytes)
+            self.size_budget = config.get('size-budget', self.size_budget)
+            self.size_report = config.get('size_report', self.size_report)
             self.theme = config.get('theme', self.theme)
             self.destination_dir = os.path.dirname(self.destination_file)
             self.user_css.extend(self.process_user_files(config.get('css', [])))
             self.user_js.extend(self.process_user_files(config.get('js', [])))
             self.linenos = self.linenos_check(config.get('linenos', self.linenos))
+            variants = config.get('variants', variants)
         else:
             self.source = source
             self.work_dir = '.'
@@ -113,21 +261,80 @@ class Generator(object):
 
             source_abspath = os.path.abspath(source)
 
-        if not os.path.isdir(source_abspath):
+        if not self.fs.isdir(source_abspath):
             source_abspath = os.path.dirname(source_abspath)
 
         self.watch_dir = source_abspath
 
-        if os.path.exists(self.destination_file) and not os.path.isfile(self.destination_file):
+        if self.files is None and os.path.exists(self.destination_file) and not os.path.isfile(self.destination_file):
             raise IOError("Destination %s exists and is not a file" % self.destination_file)
 
+        if self.size_budget not in SIZE_BUDGET_MODES:
+            raise ValueError(u"Invalid size budget mode %s, expected one of: %s"
+                             % (self.size_budget, ', '.join(SIZE_BUDGET_MODES)))
+
+        if self.bundle:
+            # assets go into the archive, found from their file:// urls
+            self.embed = self.relative = False
+
         self.theme_dir = self.find_theme_dir(self.theme, self.copy_theme)
+        self.fetcher = RemoteFetcher(self.cache_dir, logger=self.log)
         self.template_file = self.get_template_file()
+        self.embed_policy = self.get_embed_policy()
 
         # macros registering
         self.macros = []
         self.register_macro(*self.default_macros)
 
+        if variants and self.output_format != 'html':
+            raise ValueError(u"Variants can only be written in the html output format")
+        self.variants = [self.make_variant(overrides) for overrides in variants]
+
+    def make_variant(self, overrides):
+        """ Returns a generator writing a variant of this presentation: the
+            same sources and options but the given ``{option: value}``
+            overrides (see :data:`VARIANT_OPTIONS`), ``destination_file``
+            being required. Its slides are derived from the ones parsed by
+            this generator (see :meth:`write_variants`).
+        """
+        unknown = set(overrides) - set(option for option, parse in VARIANT_OPTIONS.values())
+        if unknown:
+            raise ValueError(u"Invalid variant options: %s" % ', '.join(sorted(unknown)))
+        if not overrides.get('destination_file'):
+            raise ValueError(u"Variant %r has no destination file" % overrides)
+        variant = copy.copy(self)
+        for option, value in overrides.items():
+            setattr(variant, option, value)
+        variant.bundle = None
+        variant.variants = []
+        variant.destination_dir = os.path.dirname(variant.destination_file)
+        # its own builds and caches, the theme and remote assets caches are
+        # still shared
+        variant._deck = Deck()
+        variant._local = threading.local()
+        variant.slide_cache = {}
+        variant.fragment_cache = {}
+        variant.cache_lock = threading.Lock()
+        if variant.theme != self.theme:
+            variant.theme_dir = variant.find_theme_dir(variant.theme, variant.copy_theme)
+            variant.template_file = variant.get_template_file()
+        variant.user_css, variant.user_js = (
+            [dict(entry, path_url=utils.get_path_url(entry['path'], variant.relative and variant.destination_dir))
+             if entry.get('path') else dict(entry) for entry in entries]
+            for entries in (self.user_css, self.user_js))
+        variant.embed_policy = variant.get_embed_policy()
+        variant.macros = []
+        variant.register_macro(*[type(macro) for macro in self.macros])
+        return variant
+
+    def get_embed_policy(self):
+        """ Returns the :class:`EmbedPolicy` deciding which assets are
+            embedded, or ``None`` if they all are (or none).
+        """
+        if self.embed and self.embed_max_bytes and self.files is None:
+            return EmbedPolicy(self.embed_max_bytes, self.destination_file)
+        return None
+
     def process_user_files(self, files):
         if isinstance(files, string_types):
             files = [files]
@@ -142,112 +349,311 @@ class Generator(object):
                 self.log("Loaded:  %s (not embeddable)\n" % path)
             else:
                 path = os.path.normpath(os.path.join(self.work_dir, path))
-                if not os.path.exists(path):
+                if not self.fs.exists(path):
                     raise IOError('%s user file not found' % (path,))
-                with codecs.open(path, encoding=self.encoding) as fh:
-                    yield {
-                        'path_url': utils.get_path_url(path, self.relative and self.destination_dir),
-                        'dirname': os.path.dirname(path) or '.',
-                        'contents': fh.read(),
-                        'embeddable': True,
-                    }
-                    self.log("Loaded:  %s\n" % path)
+                yield {
+                    'path': path,
+                    'path_url': utils.get_path_url(path, self.relative and self.destination_dir),
+                    'dirname': os.path.dirname(path) or '.',
+                    'contents': self.fs.read_text(path, self.encoding),
+                    'embeddable': True,
+                }
+                self.log("Loaded:  %s\n" % path)
+
+    @property
+    def deck(self):
+        """ The :class:`Deck` of the build in progress in the current thread,
+            or of its last one, or else of the last build of any thread.
+        """
+        deck = getattr(self._local, 'deck', None)
+        return self._deck if deck is None else deck
+
+    @contextlib.contextmanager
+    def building(self, changed=None):
+        """ Runs a build in the current thread, with a new :class:`Deck`
+            holding its state, so a generator can run several builds at once.
+
+            The slides of the previous builds are only reused by incremental
+            builds (``changed`` given), which run one at a time. The parsed
+            sources and rendered slides of a build are kept for the next ones
+            once it is done.
+        """
+        if changed is not None:
+            self.cache_lock.acquire()
+        deck = self._local.deck = Deck()
+        self.fetcher.open()
+        try:
+            yield deck
+        finally:
+            self.fetcher.close()
+            if changed is None:
+                self.cache_lock.acquire()
+            try:
+                self.slide_cache.update(deck.slide_cache)
+                if deck.fragments is not None:
+                    self.fragment_cache = deck.fragments
+                self._deck = deck
+            finally:
+                self.cache_lock.release()
 
     def add_toc_entry(self, title, level, slide_number):
         """ Adds a new entry to current presentation Table of Contents.
         """
-        self.__toc.append({'title': title, 'number': slide_number,
-                           'level': level})
+        self.deck.add_toc_entry(title, level, slide_number)
 
     @property
     def toc(self):
         """ Smart getter for Table of Content list.
         """
-        toc = []
-        stack = [toc]
-        for entry in self.__toc:
-            entry['sub'] = []
-            while entry['level'] < len(stack):
-                stack.pop()
-            while entry['level'] > len(stack):
-                stack.append(stack[-1][-1]['sub'])
-            stack[-1].append(entry)
-        return toc
+        return self.deck.toc
+
+    @property
+    def num_slides(self):
+        """ Number of slides of the current build.
+        """
+        return self.deck.num_slides
+
+    @property
+    def dependencies(self):
+        """ Absolute paths of all the files read by the last build.
+        """
+        return self.deck.dependencies
 
     def execute(self):
         """ Execute this generator regarding its current configuration.
         """
-        if self.direct:
+        if self.direct and self.output_format == 'ndjson':
+            self.write_ndjson(sys.stdout)
+        elif self.direct:
             out = getattr(sys.stdout, 'buffer', sys.stdout)
             out.write(self.render().encode(self.encoding))
         else:
-            self.write_and_log()
+            execute_all([self])
 
-            if self.watch:
-                from .watcher import watch
+    def write_and_log(self, changed=None):
+        output = self.bundle or self.destination_file
+        if changed is None and not self.force and not self.watch and self.files is None:
+            if not self.manifest_changes():
+                self.log(u"Up to date: %s" % output)
+                return
+        self.write(changed)
+        self.log(u"Generated file: %s" % output)
 
-                self.log(u"Watching %s\n" % self.watch_dir)
+    @property
+    def manifest_file(self):
+        """ Path of the manifest of the builds, next to the presentation.
+        """
+        return (self.bundle or self.destination_file) + MANIFEST_SUFFIX
 
-                watch(self.watch_dir, self.write_and_log)
+    def manifest_options(self):
+        """ Returns the options recorded in the manifest, as they read back
+            from JSON.
+        """
+        return json.loads(json.dumps(dict((name, getattr(self, name)) for name in MANIFEST_OPTIONS)))
 
-    def write_and_log(self):
-        self.watch_files = []
-        self.num_slides = 0
-        self.__toc = []
-        self.write()
-        self.log(u"Generated file: %s" % self.destination_file)
+    def source_paths(self):
+        """ Returns the paths of the source files, in order, found without
+            reading them.
+        """
+        paths = []
+        for source in self.source if type(self.source) is list else [self.source]:
+            source = os.path.normpath(os.path.join(self.work_dir, source))
+            paths.extend(self.discover_sources(source) if self.fs.isdir(source) else [source])
+        return paths
+
+    def manifest_changes(self):
+        """ Returns the reasons why the presentation (or one of its variants)
+            must be generated again, found by comparing the manifest of the
+            last build with the options and files: an empty list means it is
+            up to date. Nothing is parsed nor rendered.
+        """
+        sources = [os.path.abspath(path) for path in self.source_paths()]
+        reasons = []
+        for generator in [self] + self.variants:
+            output = generator.bundle or generator.destination_file
+            manifest = Manifest.load(generator.manifest_file)
+            if not os.path.isfile(output):
+                reasons.append(u"%s is missing" % output)
+            elif manifest is None:
+                reasons.append(u"%s is missing or invalid" % generator.manifest_file)
+            else:
+                reasons.extend(manifest.changes(generator.manifest_options(), sources))
+        return reasons
+
+    def write_manifest(self):
+        """ Writes the manifest of the last build.
+        """
+        inputs = set(self.dependencies)
+        if self.config_file:
+            inputs.add(os.path.abspath(self.config_file))
+        Manifest.build(self.manifest_options(), self.deck.sources, sorted(inputs)).save(self.manifest_file)
 
     def get_template_file(self):
         """ Retrieves Jinja2 template file path.
         """
-        if os.path.exists(os.path.join(self.theme_dir, 'base.html')):
-            return os.path.join(self.theme_dir, 'base.html')
-        default_dir = os.path.join(THEMES_DIR, 'default')
-        if not os.path.exists(os.path.join(default_dir, 'base.html')):
-            raise IOError("Cannot find base.html in default theme")
-        return os.path.join(default_dir, 'base.html')
+        return self.find_theme_file('base.html')
+
+    def find_theme_file(self, *path):
+        """ Returns the path of a file from the current theme, falling back to
+            the default theme. Lookups are cached per theme until the theme
+            directory that would hold the file changes.
+        """
+        key = (self.theme_dir,) + path
+        try:
+            signature = os.stat(os.path.join(self.theme_dir, *path[:-1])).st_mtime
+        except OSError:
+            signature = None
+        cached = _theme_files.get(key)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+        for theme_dir in (self.theme_dir, os.path.join(THEMES_DIR, 'default')):
+            theme_file = os.path.join(theme_dir, *path)
+            if os.path.exists(theme_file):
+                _theme_files[key] = signature, theme_file
+                return theme_file
+        raise IOError(u"Cannot find %s in default theme" % path[-1])
+
+    def load_theme_file(self, cache, *path):
+        """ Returns the path of a theme file and its contents, loaded through
+            the given cache. If the file went away since it was resolved, the
+            lookup is done again (eventually falling back to the default theme).
+        """
+        theme_file = self.find_theme_file(*path)
+        try:
+            return theme_file, cache.get(theme_file, self.encoding)
+        except (IOError, OSError):
+            _theme_files.pop((self.theme_dir,) + path, None)
+            theme_file = self.find_theme_file(*path)
+            return theme_file, cache.get(theme_file, self.encoding)
+
+    def get_theme_asset(self, *path):
+        """ Returns the template vars of a theme css or js file. Minified
+            contents are cached as long as the file doesn't change.
+        """
+        if self.minify and self.embed:
+            asset_file, (contents, original_size) = self.load_theme_file(_minified_contents, *path)
+        else:
+            asset_file, contents = self.load_theme_file(_theme_contents, *path)
+            original_size = len(contents)
+        self.deck.dependencies.add(os.path.abspath(asset_file))
+        return {
+            'path': asset_file,
+            'path_url': utils.get_path_url(asset_file, self.relative and self.destination_dir),
+            'contents': contents,
+            'original_size': original_size,
+            'embeddable': True
+        }
 
-    def fetch_contents(self, source, work_dir):
+    def fetch_contents(self, source, work_dir, changed=None):
         """ Recursively fetches Markdown contents from a single file or
             directory containing itself Markdown/RST files.
+
+            When ``changed`` is a set of paths, the slides of the previous
+            build are reused unless they depend on one of these paths.
         """
-        slides = []
+        return list(self.iter_contents(source, work_dir, changed))
+
+    def iter_contents(self, source, work_dir, changed=None, cache=True):
+        """ Yields the slides of :meth:`fetch_contents` one by one, as they are
+            processed. They are kept for the next builds unless ``cache`` is
+            false.
+        """
+        found = False
 
         if type(source) is list:
             for entry in source:
-                slides.extend(self.fetch_contents(entry, work_dir))
+                for slide in self.iter_contents(entry, work_dir, changed, cache):
+                    found = True
+                    yield slide
         else:
             source = os.path.normpath(os.path.join(work_dir, source))
-            if os.path.isdir(source):
+            if self.fs.isdir(source):
                 self.log(u"Entering %r" % source)
-                entries = os.listdir(source)
-                entries.sort()
-                for entry in entries:
-                    slides.extend(self.fetch_contents(entry, source))
+                paths = self.discover_sources(source)
             else:
-                try:
-                    parser = Parser(os.path.splitext(source)[1], self.encoding, self.extensions)
-                except NotImplementedError as exc:
-                    self.log(u"Failed   %r: %r" % (source, exc))
-                    return slides
-
-                self.log(u"Adding   %r (%s)" % (source, parser.format))
+                paths = [source]
+            for path in paths:
+                self.deck.sources.append(os.path.abspath(path))
+                for slide in self.iter_file(path, changed, cache):
+                    found = True
+                    yield slide
+
+        if not found:
+            self.log(u"Exiting  %r: no contents found" % source, 'notice')
 
-                try:
-                    with codecs.open(source, encoding=self.encoding) as file:
-                        file_contents = file.read()
-                except UnicodeDecodeError:
-                    self.log(u"Unable to decode source %r: skipping" % source,
-                             'warning')
-                else:
-                    inner_slides = re.split(r'<hr.+>', parser.parse(file_contents))
-                    for inner_slide in inner_slides:
-                        slides.append(self.get_slide_vars(inner_slide, source))
+    def discover_sources(self, directory):
+        """ Yields the source files of a directory and of its subdirectories,
+            in order. Entries are picked by name before anything is read:
+            hidden ones, files of unsupported formats, files not matching the
+            ``include`` patterns and entries matching the ``exclude`` ones are
+            skipped (patterns match paths relative to the configuration file).
+        """
+        for name, is_dir in self.fs.entries(directory):
+            if name.startswith('.'):
+                continue
+            path = os.path.join(directory, name)
+            relative_path = os.path.relpath(path, self.work_dir)
+            if self.exclude and utils.match_globs(relative_path, self.exclude):
+                continue
+            if is_dir:
+                self.log(u"Entering %r" % path)
+                for source in self.discover_sources(path):
+                    yield source
+            elif name.endswith(SUPPORTED_EXTENSIONS) and (not self.include or
+                                                          utils.match_globs(relative_path, self.include)):
+                yield path
+
+    def iter_file(self, source, changed=None, cache=True):
+        """ Yields the slides of a source file (see :meth:`iter_contents`).
+        """
+        cached = self.slide_cache.get(source) if changed is not None else None
+        if cached is None or cached[0] & changed:
+            cached = self.parse_source(source)
+            if cached is None:
+                return
+            if cache:
+                self.deck.slide_cache[source] = cached
+        else:
+            self.log(u"Reusing  %r" % source)
+
+        file_dependencies, entries = cached
+        self.deck.dependencies.update(file_dependencies)
+        for entry in entries:
+            inner_slide, slide, dependencies = entry
+            if dependencies is None or changed is None or dependencies & changed:
+                slide = self.get_slide_vars(inner_slide, source)
+                if slide:
+                    slide.dependencies.update(file_dependencies)
+                entry[1:] = slide, slide.dependencies if slide else set()
+            if slide:
+                self.deck.dependencies.update(slide.dependencies)
+            yield slide
+
+    def parse_source(self, source):
+        """ Parses a source file and returns the set of files read for it and
+            a list of ``[html, slide, dependencies]`` entries, one per slide,
+            the slides being computed by :meth:`fetch_contents`.
+        """
+        try:
+            parser = Parser(os.path.splitext(source)[1], self.encoding, self.extensions, self.linenos)
+        except NotImplementedError as exc:
+            self.log(u"Failed   %r: %r" % (source, exc))
+            return None
 
-        if not slides:
-            self.log(u"Exiting  %r: no contents found" % source, 'notice')
+        self.log(u"Adding   %r (%s)" % (source, parser.format))
 
-        return slides
+        try:
+            file_contents = self.fs.read_text(source, self.encoding)
+        except UnicodeDecodeError:
+            self.log(u"Unable to decode source %r: skipping" % source,
+                     'warning')
+            return None
+
+        html = parser.parse(file_contents, source if self.files is None else None)
+        if self.embed or any(variant.embed for variant in self.variants):
+            self.fetcher.prefetch(macro_module.EmbedImagesMacro.remote_urls(html))
+        file_dependencies = set([os.path.abspath(source)] + parser.dependencies)
+        return file_dependencies, [[inner_slide, None, None] for inner_slide in re.split(r'<hr.+>', html)]
 
     def find_theme_dir(self, theme, copy_theme=False):
         """ Finds them dir path from its name.
@@ -259,6 +665,10 @@ class Generator(object):
         else:
             raise IOError("Theme %s not found or invalid" % theme)
 
+        if self.files is not None:
+            # in-memory presentations never look at the working directory
+            return theme_dir
+
         target_theme_dir = os.path.join(os.getcwd(), 'theme')
         if copy_theme or os.path.exists(target_theme_dir):
             self.log(u'Copying %s theme directory to %s'
@@ -277,89 +687,35 @@ class Generator(object):
             print and screen contexts, depending if we want a standalone
             presentation or not.
         """
-        css = {}
-
-        base_css = os.path.join(self.theme_dir, 'css', 'base.css')
-        if not os.path.exists(base_css):
-            base_css = os.path.join(THEMES_DIR, 'default', 'css', 'base.css')
-            if not os.path.exists(base_css):
-                raise IOError(u"Cannot find base.css in default theme")
-        with codecs.open(base_css, encoding=self.encoding) as css_file:
-            css['base'] = {
-                'path_url': utils.get_path_url(base_css, self.relative and self.destination_dir),
-                'contents': css_file.read(),
-                'embeddable': True
-            }
-
-        print_css = os.path.join(self.theme_dir, 'css', 'print.css')
-        if not os.path.exists(print_css):
-            print_css = os.path.join(THEMES_DIR, 'default', 'css', 'print.css')
-            if not os.path.exists(print_css):
-                raise IOError(u"Cannot find print.css in default theme")
-        with codecs.open(print_css, encoding=self.encoding) as css_file:
-            css['print'] = {
-                'path_url': utils.get_path_url(print_css, self.relative and self.destination_dir),
-                'contents': css_file.read(),
-                'embeddable': True
-            }
-
-        screen_css = os.path.join(self.theme_dir, 'css', 'screen.css')
-        if not os.path.exists(screen_css):
-            screen_css = os.path.join(THEMES_DIR, 'default', 'css', 'screen.css')
-            if not os.path.exists(screen_css):
-                raise IOError(u"Cannot find screen.css in default theme")
-        with codecs.open(screen_css, encoding=self.encoding) as css_file:
-            css['screen'] = {
-                'path_url': utils.get_path_url(screen_css, self.relative and self.destination_dir),
-                'contents': css_file.read(),
-                'embeddable': True
-            }
-
-        theme_css = os.path.join(self.theme_dir, 'css', 'theme.css')
-        if not os.path.exists(theme_css):
-            theme_css = os.path.join(THEMES_DIR, 'default', 'css', 'theme.css')
-            if not os.path.exists(theme_css):
-                raise IOError(u"Cannot find theme.css in default theme")
-        with codecs.open(theme_css, encoding=self.encoding) as css_file:
-            css['theme'] = {
-                'path_url': utils.get_path_url(theme_css, self.relative and self.destination_dir),
-                'contents': css_file.read(),
-                'embeddable': True
-            }
-
-        return css
+        return dict((name, self.get_theme_asset('css', '%s.css' % name)) for name in THEME_CSS)
 
     def get_js(self):
         """ Fetches and returns javascript file path or contents, depending if
             we want a standalone presentation or not.
         """
-        js_file = os.path.join(self.theme_dir, 'js', 'slides.js')
-
-        if not os.path.exists(js_file):
-            js_file = os.path.join(THEMES_DIR, 'default', 'js', 'slides.js')
+        return self.get_theme_asset('js', 'slides.js')
 
-            if not os.path.exists(js_file):
-                raise IOError(u"Cannot find slides.js in default theme")
-        with codecs.open(js_file, encoding=self.encoding) as js_file_obj:
-            return {
-                'path_url': utils.get_path_url(js_file, self.relative and self.destination_dir),
-                'contents': js_file_obj.read(),
-                'embeddable': True
-            }
-
-    def get_slide_vars(self, slide_src, source,
+    def get_slide_vars(self, slide_src, source, base=False,
                        _presenter_notes_re=re.compile(r'<h\d[^>]*>presenter notes</h\d>',
                                                       re.DOTALL | re.UNICODE | re.IGNORECASE),
                        _slide_title_re=re.compile(r'(<h(\d+?).*?>(.+?)</h\d>)\s?(.+)?', re.DOTALL | re.UNICODE)):
         """ Computes a single slide template vars from its html source code.
             Also extracts slide information for the table of contents.
+
+            With ``base``, the macros depending on the options of the
+            variants are left out and the presenter notes section is kept
+            apart, whatever the ``presenter_notes`` option (see
+            :meth:`derive_slide`).
         """
         presenter_notes = ''
+        notes_section = None
 
         find = _presenter_notes_re.search(slide_src)
 
         if find:
-            if self.presenter_notes:
+            if base:
+                notes_section = slide_src[find.end():].strip()
+            elif self.presenter_notes:
                 presenter_notes = slide_src[find.end():].strip()
 
             slide_src = slide_src[:find.start()]
@@ -376,42 +732,57 @@ class Generator(object):
             content = find.group(4).strip() if find.group(4) else find.group(4)
 
         slide_classes = []
-        context = {}
+        context = {'dependencies': set()}
+        variant = False if base else None
 
         if header:
-            header, _ = self.process_macros(header, source, context)
+            header, _ = self.process_macros(header, source, context, variant)
 
         if content:
-            content, slide_classes = self.process_macros(content, source, context)
+            content, slide_classes = self.process_macros(content, source, context, variant)
 
         # macros must be able to set the basic slide class (content or title):
         # if the slide class is not defined, guess it
         if all(cls not in slide_classes for cls in self.basic_slide_classes):
             slide_classes.append('slide-content' if content else 'slide-title')
 
-        source_dict = {}
-
-        if source:
-            source_dict = {
-                'rel_path': source.decode(sys.getfilesystemencoding(), 'ignore') if isinstance(source,
-                                                                                               binary_type) else source,
-                'abs_path': os.path.abspath(source)
-            }
-
         if header or content:
-            context.update(
-                content=content,
-                classes=slide_classes,
-                header=header,
-                level=level,
-                source=source_dict,
-                title=title,
-            )
-            context.setdefault('presenter_notes', '')
-            context['presenter_notes'] += presenter_notes
-            if not context['presenter_notes']:
-                context['presenter_notes'] = None
-            return context
+            presenter_notes = context.pop('presenter_notes', '') + presenter_notes
+            slide = Slide(header, content, slide_classes, level, title, source, presenter_notes or None)
+            slide.dependencies = context.pop('dependencies')
+            slide.embedded = context.pop('embedded', {})
+            slide.copied = context.pop('copied', {})
+            for key, value in context.items():
+                slide[key] = value
+            if base:
+                slide['notes_section'] = notes_section
+            return slide
+
+    def derive_slide(self, slide):
+        """ Returns the slide of this variant from a slide parsed for all the
+            variants (see :meth:`get_slide_vars`): a copy, processed by the
+            macros depending on the options of the variants, and with the
+            presenter notes section if the variant shows it.
+        """
+        if not slide:
+            return slide
+        slide = copy.copy(slide)
+        slide.classes = list(slide.classes)
+        slide.extra = dict(slide.extra)
+        notes_section = slide.extra.pop('notes_section', None)
+        context = {'dependencies': set(slide.dependencies), 'embedded': dict(slide.embedded),
+                   'copied': dict(slide.copied)}
+        for key in ('header', 'content', 'presenter_notes', 'declared_footer'):
+            if slide.get(key):
+                slide[key], _ = self.process_macros(slide[key], slide.source_path, context, variant=True)
+        if self.presenter_notes and notes_section:
+            slide.presenter_notes = (slide.presenter_notes or '') + notes_section
+        slide.dependencies = context.pop('dependencies')
+        slide.embedded = context.pop('embedded')
+        slide.copied = context.pop('copied')
+        for key, value in context.items():
+            slide[key] = value
+        return slide
 
     def get_template_vars(self, slides):
         """ Computes template vars from slides html source code.
@@ -421,21 +792,121 @@ class Generator(object):
         except (IndexError, TypeError):
             head_title = "Untitled Presentation"
 
-        for slide_index, slide_vars in enumerate(slides):
-            if not slide_vars:
-                continue
-            self.num_slides += 1
-            slide_number = slide_vars['number'] = self.num_slides
-            if slide_vars['level'] and slide_vars['level'] <= self.maxtoclevel:
-                # only show slides that have a title and lever is not too deep
-                self.add_toc_entry(slide_vars['title'], slide_vars['level'], slide_number)
+        for slide_vars in slides:
+            if slide_vars:
+                self.number_slide(slide_vars)
+
+        if self.lazy_images is not None and not self.embed:
+            slides = [self.defer_images(slide) if slide and slide['number'] > self.lazy_images else slide
+                      for slide in slides]
+
+        user_css, user_js = self.user_css, self.user_js
+        if self.minify and self.embed:
+            user_css = [self.minify_user_file(entry, minify.minify_css) for entry in user_css]
+            user_js = [self.minify_user_file(entry, minify.minify_js) for entry in user_js]
 
         return {'head_title': head_title, 'num_slides': str(self.num_slides),
                 'slides': slides, 'toc': self.toc, 'embed': self.embed,
                 'css': self.get_css(), 'js': self.get_js(),
-                'user_css': self.user_css, 'user_js': self.user_js,
+                'user_css': user_css, 'user_js': user_js,
+                'search_index': self.get_search_index(slides) if self.search_index else None,
+                'critical_css': None, 'preload': [],
                 'version': __version__}
 
+    def number_slide(self, slide):
+        """ Gives the next number to a slide and its footer (the last one
+            declared so far), and adds it to the table of contents.
+        """
+        self.deck.num_slides += 1
+        slide['number'] = self.deck.num_slides
+        footer = slide.get('declared_footer')
+        if footer is not None:
+            self.deck.footer = footer
+        if self.deck.footer or slide.get('footer'):
+            slide['footer'] = self.deck.footer or None
+            classes = slide['classes']
+            if slide['footer'] and 'has_footer' not in classes:
+                classes.append('has_footer')
+            elif not slide['footer'] and 'has_footer' in classes:
+                classes.remove('has_footer')
+        if slide['level'] and slide['level'] <= self.maxtoclevel:
+            # only show slides that have a title and lever is not too deep
+            self.add_toc_entry(slide['title'], slide['level'], slide['number'])
+
+    def defer_images(self, slide):
+        """ Returns the slide with its images loaded lazily: a copy, the
+            slides being kept as they are for the next builds (where they may
+            come first).
+        """
+        if not slide.content:
+            return slide
+        content = images.defer_loading(slide.content)
+        if content == slide.content:
+            return slide
+        slide = copy.copy(slide)
+        slide.content = content
+        return slide
+
+    def iter_slides(self, changed=None):
+        """ Yields the slides of the presentation, numbered, one by one as
+            soon as they are processed: nothing is kept but the table of
+            contents, so decks of any size can be streamed (see
+            :meth:`write_ndjson`). Slides are only kept for the next builds
+            in watch mode.
+        """
+        with self.building(changed):
+            for slide in self.iter_contents(self.source, self.work_dir, changed, cache=self.watch):
+                if slide:
+                    self.number_slide(slide)
+                    yield slide
+
+    def write_ndjson(self, out, changed=None):
+        """ Writes the slides to a text file object as newline-delimited JSON,
+            one slide (see :meth:`Slide.as_dict`) per line.
+        """
+        count = 0
+        for slide in self.iter_slides(changed):
+            out.write(text_type(json.dumps(slide.as_dict(), sort_keys=True)))
+            out.write(u'\n')
+            count += 1
+        self.log(u"Exported %d slides" % count)
+
+    def minify_user_file(self, entry, minifier):
+        """ Returns a copy of a user css or js file entry with minified
+            contents.
+        """
+        if not entry['embeddable']:
+            return entry
+        return dict(entry, contents=minifier(entry['contents']), original_size=len(entry['contents']))
+
+    def minify_html(self, context, html):
+        """ Minifies the rendered html and logs the size reduction, including
+            the one of the embedded stylesheets and javascript.
+        """
+        original_size = len(html)
+        if self.embed:
+            assets = list(context['css'].values()) + [context['js']] + context['user_css'] + context['user_js']
+            original_size += sum(asset.get('original_size', len(asset['contents'])) - len(asset['contents'])
+                                 for asset in assets if asset['embeddable'])
+        html = minify.minify_html(html)
+        self.log(u"Minified: %d bytes -> %d bytes (-%.1f%%)"
+                 % (original_size, len(html), 100.0 * (original_size - len(html)) / (original_size or 1)))
+        return html
+
+    def get_search_index(self, slides):
+        """ Builds the full-text search index of the slides and returns it
+            serialized as JSON, safe to be inlined in a ``<script>`` tag.
+        """
+        start = time.time()
+        index = utils.build_search_index(slides, self.presenter_notes)
+        serialized = json.dumps(index, separators=(',', ':'), sort_keys=True)
+        # none of these may appear raw inside a <script> element
+        for char, escape in (('<', '\\u003c'), ('>', '\\u003e'), ('&', '\\u0026')):
+            serialized = serialized.replace(char, escape)
+        self.log(u"Built search index: %d terms, %d bytes in %.3fs"
+                 % (len(index['terms']), len(serialized), time.time() - start))
+        return serialized
+
     def linenos_check(self, value):
         """ Checks and returns a valid value for the ``linenos`` option.
         """
@@ -456,13 +927,23 @@ class Generator(object):
         self.log(u"Config   %s" % config_source)
         try:
             raw_config = configparser.RawConfigParser()
-            raw_config.read(config_source)
+            if self.files is None:
+                raw_config.read(config_source)
+            else:
+                config_text = self.fs.read_text(config_source, self.encoding)
+                if hasattr(raw_config, 'read_string'):
+                    raw_config.read_string(config_text)
+                else:
+                    raw_config.readfp(io.StringIO(config_text))
         except Exception as e:
             raise RuntimeError(u"Invalid configuration file: %s" % e)
         section_name = 'landslide' if raw_config.has_section('landslide') else 'darkslide'
         config = {
             'source': raw_config.get(section_name, 'source').replace('\r', '').split('\n')
         }
+        if raw_config.has_option(section_name, 'cache_dir'):
+            config['cache_dir'] = os.path.join(os.path.dirname(config_source),
+                                               os.path.expanduser(raw_config.get(section_name, 'cache_dir')))
         if raw_config.has_option(section_name, 'theme'):
             config['theme'] = raw_config.get(section_name, 'theme')
             self.log(u"Using    configured theme %s" % config['theme'])
@@ -470,24 +951,61 @@ class Generator(object):
             config['destination'] = raw_config.get(section_name, 'destination')
         if raw_config.has_option(section_name, 'linenos'):
             config['linenos'] = raw_config.get(section_name, 'linenos')
-        if raw_config.has_option(section_name, 'max-toc-level'):
-            config['max-toc-level'] = int(raw_config.get(section_name, 'max-toc-level'))
-        for boolopt in ('embed', 'relative', 'copy_theme'):
+        for intopt in ('max-toc-level', 'lazy-images'):
+            if raw_config.has_option(section_name, intopt):
+                config[intopt] = int(raw_config.get(section_name, intopt))
+        for sizeopt in ('max-size', 'max-asset-size', 'embed-max-bytes'):
+            if raw_config.has_option(section_name, sizeopt):
+                config[sizeopt] = utils.parse_size(raw_config.get(section_name, sizeopt))
+        if raw_config.has_option(section_name, 'size-budget'):
+            config['size-budget'] = raw_config.get(section_name, 'size-budget')
+        for boolopt in ('embed', 'relative', 'copy_theme', 'search_index', 'minify', 'size_report', 'critical_css'):
             if raw_config.has_option(section_name, boolopt):
                 config[boolopt] = raw_config.getboolean(section_name, boolopt)
         if raw_config.has_option(section_name, 'extensions'):
             config['extensions'] = ",".join(raw_config.get(section_name, 'extensions').replace('\r', '').split('\n'))
+        if raw_config.has_option(section_name, 'guess-lang'):
+            config['guess-lang'] = raw_config.get(section_name, 'guess-lang')
+        for globopt in ('include', 'exclude'):
+            if raw_config.has_option(section_name, globopt):
+                config[globopt] = raw_config.get(section_name, globopt).split()
         if raw_config.has_option(section_name, 'css'):
             config['css'] = raw_config.get(section_name, 'css').replace('\r', '').split('\n')
         if raw_config.has_option(section_name, 'js'):
             config['js'] = raw_config.get(section_name, 'js').replace('\r', '').split('\n')
+        if raw_config.has_section('variants'):
+            config['variants'] = [self.parse_variant(name, raw_config.get('variants', name))
+                                  for name in raw_config.options('variants')]
         return config
 
-    def process_macros(self, content, source, context):
-        """ Processed all macros.
+    def parse_variant(self, name, value):
+        """ Returns the option overrides of a variant of the ``[variants]``
+            section of a configuration file, declared as ``name = option=value
+            ...`` (see :data:`VARIANT_OPTIONS`).
+        """
+        overrides = {}
+        for item in value.split():
+            option, equal, setting = item.partition('=')
+            if not equal or option not in VARIANT_OPTIONS:
+                raise RuntimeError(u"Invalid variant %s: %r, expected option=value with an option among: %s"
+                                   % (name, item, ', '.join(sorted(VARIANT_OPTIONS))))
+            option, parse = VARIANT_OPTIONS[option]
+            try:
+                overrides[option] = parse(setting)
+            except ValueError as e:
+                raise RuntimeError(u"Invalid variant %s: %s" % (name, e))
+        if not overrides.get('destination_file'):
+            raise RuntimeError(u"Invalid variant %s: no destination" % name)
+        return overrides
+
+    def process_macros(self, content, source, context, variant=None):
+        """ Processed all macros, or only the ones depending on the options
+            of the variants (``variant`` true) or not (``variant`` false).
         """
         classes = []
         for macro in self.macros:
+            if variant is not None and macro.variant != variant:
+                continue
             content, add_classes = macro.process(content, source, context)
             if add_classes:
                 classes += add_classes
@@ -496,7 +1014,9 @@ class Generator(object):
     def register_macro(self, *macros):
         """ Registers macro classes passed a method arguments.
         """
-        macro_options = {'relative': self.relative, 'linenos': self.linenos, 'destination_dir': self.destination_dir}
+        macro_options = {'relative': self.relative, 'linenos': self.linenos, 'destination_dir': self.destination_dir,
+                         'fetcher': self.fetcher, 'fs': self.fs, 'lazy_images': self.lazy_images,
+                         'guess_lang': self.guess_lang, 'embed_policy': self.embed_policy}
         for m in macros:
             if inspect.isclass(m) and issubclass(m, macro_module.Macro):
                 self.macros.append(m(logger=self.logger, embed=self.embed, options=macro_options))
@@ -506,7 +1026,8 @@ class Generator(object):
 
     def embed_url_data(self, context, html):
         """Find all image and fonts referenced in CSS with an ``url()`` function
-        and embed them in base64. Images from the user (i.e. included in its
+        and embed them in base64 (or copy them next to the presentation, see
+        :meth:`get_embed_policy`). Images from the user (i.e. included in its
         source code, *not* in its CSS) are embedded by the macro
         `EmbedImagesMacro`.
         """
@@ -514,53 +1035,296 @@ class Generator(object):
                               re.DOTALL | re.UNICODE)
         embed_exts = ('.jpg', '.jpeg', '.png', '.gif', '.svg', '.woff2',
                       '.woff')
-        embed_urls = (url for url in all_urls if url.endswith(embed_exts))
+        embed_urls = [url.replace('"', '').replace("'", '') for url in all_urls if url.endswith(embed_exts)]
+        self.fetcher.prefetch(url for url in embed_urls if utils.is_remote(url))
 
+        # the theme is always read from disk, user files maybe not
         css_dirs = (
-            [os.path.join(self.theme_dir, 'css')] +
-            [css_entry['dirname'] for css_entry in context['user_css']]
+            [(os.path.join(self.theme_dir, 'css'), None)] +
+            [(css_entry['dirname'], self.fs) for css_entry in context['user_css']]
         )
 
         for embed_url in embed_urls:
-            embed_url = embed_url.replace('"', '').replace("'", '')
-
-            directory, encoded_url = None, None
-            for directory in css_dirs:
-                encoded_url = utils.encode_data_from_url(embed_url, directory)
+            directory, encoded_url, copied = None, None, False
+            for directory, fs in css_dirs:
+                if self.embed_policy:
+                    encoded_url, size, copied = (self.embed_policy.place(embed_url, directory, self.fetcher) or
+                                                 (None, 0, False))
+                else:
+                    encoded_url = utils.encode_data_from_url(embed_url, directory, self.fetcher, fs)
                 if encoded_url:
                     break
 
             if encoded_url:
+                self.deck.dependencies.add(utils.local_path(embed_url, directory))
                 html = html.replace(embed_url, encoded_url, 1)
-                self.log("Embedded theme file %s from directory %s"
-                         % (embed_url, directory))
+                if copied:
+                    self.deck.copied[embed_url] = size
+                    self.log(u"Copied theme file %s to %s: %s, over %s"
+                             % (embed_url, encoded_url, utils.format_size(size),
+                                utils.format_size(self.embed_max_bytes)))
+                else:
+                    self.deck.embedded[embed_url] = len(encoded_url)
+                    self.log("Embedded theme file %s from directory %s"
+                             % (embed_url, directory))
             else:
                 self.log(u"Failed to embed theme file %s" % embed_url)
 
         return html
 
-    def render(self):
+    def render(self, changed=None, slides=None):
         """ Returns generated html code.
+
+            ``changed`` is the set of the paths (from :attr:`dependencies`)
+            that changed since the previous build: only the slides depending
+            on them are processed again.
+
+            ``slides`` are rendered instead of the ones of the sources when
+            given (see :meth:`write_variants`).
+
+            Several threads may render at once (see :meth:`building`).
         """
-        with codecs.open(self.template_file, encoding=self.encoding) as template_src:
-            template = jinja2.Template(template_src.read())
-        slides = self.fetch_contents(self.source, self.work_dir)
-        context = self.get_template_vars(slides)
+        with self.building(changed) as deck:
+            for user_file in self.user_css + self.user_js:
+                if user_file.get('path'):
+                    path = os.path.abspath(user_file['path'])
+                    if changed and path in changed:
+                        user_file['contents'] = self.fs.read_text(user_file['path'], self.encoding)
+                    deck.dependencies.add(path)
+            self.template_file, template = self.load_theme_file(_templates, 'base.html')
+            deck.dependencies.add(os.path.abspath(self.template_file))
+
+            if slides is None:
+                slides = self.fetch_contents(self.source, self.work_dir, changed)
+            else:
+                deck.sources = [os.path.abspath(path) for path in self.source_paths()]
+                for slide in slides:
+                    if slide:
+                        deck.dependencies.update(slide.dependencies)
+            context = self.get_template_vars(slides)
+            context['rendered_slides'] = self.render_slides(template, context)
 
-        html = template.render(context)
+            if self.critical_css and not self.embed:
+                context['critical_css'], context['preload'] = self.get_critical_css(template, context)
 
-        if self.embed:
-            html = self.embed_url_data(context, html)
+            html = template.render(context)
+
+            if self.minify:
+                html = self.minify_html(context, html)
+
+            if self.embed:
+                html = self.embed_url_data(context, html)
+
+            if self.embed_policy:
+                embedded, copied = dict(deck.embedded), dict(deck.copied)
+                for slide in slides:
+                    if slide:
+                        embedded.update(slide.embedded)
+                        copied.update(slide.copied)
+                for line in self.embed_policy.summary(embedded, copied):
+                    self.log(line)
+
+            if self.size_report or self.max_size or self.max_asset_size:
+                deck.report = self.check_size(context, html)
 
         return html
 
-    def write(self):
+    def get_critical_css(self, template, context):
+        """ Returns the css rules the chrome and the first slide may need (see
+            :mod:`darkslide.critical`) and the ``preload`` hints of the fonts
+            of the stylesheets and of the images of the slides that aren't
+            lazy-loaded (only the first one without ``lazy_images``).
+        """
+        slides = context['slides']
+        first = next((index for index, slide in enumerate(slides) if slide), 0)
+        rendered = context['rendered_slides']
+        html = template.render(dict(context, slides=slides[first:first + 1],
+                                    rendered_slides=rendered and rendered[first:first + 1]))
+        tokens = critical.html_tokens(html)
+        for script in [context['js']] + context['user_js']:
+            tokens |= critical.script_tokens(script['contents'])
+
+        stylesheets = [(context['css']['base'], None), (context['css']['screen'], 'screen, projection'),
+                       (context['css']['theme'], None)]
+        stylesheets.extend((entry, None) for entry in context['user_css'] if entry['embeddable'])
+        chunks = []
+        preload = []
+        for entry, media in stylesheets:
+            def rebase(url, css_dir=os.path.dirname(entry['path'])):
+                if url.startswith(('data:', 'http://', 'https://', 'file://', '/', '#')):
+                    return url
+                return utils.get_path_url(os.path.join(css_dir, url), self.relative and self.destination_dir)
+
+            rules = critical.rebase_urls(critical.extract(entry['contents'], tokens), rebase)
+            if rules:
+                chunks.append('@media %s{%s}' % (media, rules) if media else rules)
+            preload.extend({'href': rebase(url), 'as': 'font', 'type': mime_type}
+                           for url, mime_type in critical.font_files(entry['contents']))
+
+        eager = [slide for slide in slides if slide][:1 if self.lazy_images is None else self.lazy_images]
+        preload.extend({'href': url, 'as': 'image', 'type': None}
+                       for slide in eager for url, start, end in scanner.find_images(slide['content'] or '')
+                       if not url.startswith('data:'))
+        unique = []
+        for link in preload:
+            if link not in unique:
+                unique.append(link)
+        css = minify.minify_css('\n'.join(chunks))
+        self.log(u"Inlined  %d bytes of critical css, preloading %d files" % (len(css), len(unique)))
+        return css, unique
+
+    def check_size(self, context, html):
+        """ Logs the size report of the rendered html and checks it against the
+            size budgets. Exceeding them fails the build, unless in ``warn``
+            mode or watching (warnings are logged instead).
+        """
+        report = SizeReport.build(html, context, self.deck.embedded)
+        if self.size_report:
+            for line in report.lines():
+                self.log(line)
+        errors = report.check(self.max_size, self.max_asset_size)
+        if errors and self.size_budget == 'fail' and not self.watch:
+            raise RuntimeError(u"Size budget exceeded: %s" % '; '.join(errors))
+        for error in errors:
+            self.log(u"Size budget exceeded: %s" % error, 'warning')
+        return report
+
+    def render_slides(self, template, context):
+        """ Renders the slides one by one with the ``render_slide`` macro of the
+            template, reusing the fragments of the previous build for the
+            slides that didn't change. Returns ``None`` if the template has no
+            such macro (the slides are then rendered by the template itself).
+        """
+        module = _template_modules.get(template)
+        if module is None:
+            module = _template_modules[template] = template.make_module(dict(context, slides=[]))
+        render_slide = getattr(module, 'render_slide', None)
+        if render_slide is None:
+            return None
+
+        num_slides = context['num_slides']
+        fragments = {}
+        rendered = []
+        reused = 0
+        for slide in context['slides']:
+            try:
+                key = template, num_slides, slide.fragment_key()
+                fragment = fragments.get(key) or self.fragment_cache.get(key)
+            except (AttributeError, TypeError):
+                # not a slide object, or unhashable values set by a macro
+                key = fragment = None
+            if fragment is None:
+                fragment = render_slide(slide, num_slides)
+            else:
+                reused += 1
+            if key is not None:
+                fragments[key] = fragment
+            rendered.append(fragment)
+        self.log(u"Rendered %d slides (%d reused)" % (len(rendered), reused))
+        self.deck.fragments = fragments
+        return rendered
+
+    def write(self, changed=None):
         """ Writes generated presentation code into the destination file.
         """
-        html = self.render()
-        dirname = os.path.dirname(self.destination_file)
-        if dirname and not os.path.exists(dirname):
-            os.makedirs(dirname)
-        with codecs.open(self.destination_file, 'w',
-                         encoding='utf_8') as outfile:
-            outfile.write(html)
+        if self.output_format == 'ndjson':
+            with codecs.open(self.destination_file, 'w', encoding='utf_8') as outfile:
+                self.write_ndjson(outfile, changed)
+        elif self.variants:
+            self.write_variants(changed)
+        else:
+            self.write_html(self.render(changed))
+        if self.files is None:
+            self.write_manifest()
+
+    def write_html(self, html):
+        """ Writes rendered html into the bundle or the destination file.
+        """
+        if self.bundle:
+            from .bundle import Bundle
+
+            Bundle(self.bundle, self.encoding, self.log).write(html)
+        else:
+            dirname = os.path.dirname(self.destination_file)
+            if dirname and not os.path.exists(dirname):
+                os.makedirs(dirname)
+            with codecs.open(self.destination_file, 'w',
+                             encoding='utf_8') as outfile:
+                outfile.write(html)
+
+    def write_variants(self, changed=None):
+        """ Writes the presentation and its variants. The sources are parsed
+            and the macros that don't depend on the options of the variants
+            are processed once for all of them (see :meth:`get_slide_vars`):
+            only the other macros, the presenter notes and the rendering are
+            done for each variant. Every build parses the sources again.
+        """
+        base = []
+        for path in self.source_paths():
+            parsed = self.parse_source(path)
+            if parsed is None:
+                continue
+            file_dependencies, entries = parsed
+            for inner_slide, _, _ in entries:
+                slide = self.get_slide_vars(inner_slide, path, base=True)
+                if slide:
+                    slide.dependencies.update(file_dependencies)
+                base.append(slide)
+
+        self.write_html(self.render(changed, [self.derive_slide(slide) for slide in base]))
+        for variant in self.variants:
+            variant.write_html(variant.render(changed, [variant.derive_slide(slide) for slide in base]))
+            if variant.files is None:
+                variant.write_manifest()
+            self.log(u"Generated file: %s" % variant.destination_file)
+
+
+def execute_all(generators):
+    """ Writes several presentations, then watches the ones with the ``watch``
+        option, all with a single observer (using the ``watch_backend`` of the
+        first one): a change only regenerates the
+        presentations depending on the changed file. The theme, template and
+        remote asset caches are shared by all of them.
+    """
+    destinations = {}
+    for generator in generators:
+        for output in [generator] + generator.variants:
+            destination = os.path.abspath(output.bundle or output.destination_file)
+            if destination in destinations:
+                raise IOError(u"Both %s and %s would be written to %s"
+                              % (destinations[destination].watch_dir, output.watch_dir, destination))
+            destinations[destination] = output
+
+    for generator in generators:
+        generator.write_and_log()
+
+    watched = [generator for generator in generators if generator.watch]
+    if watched:
+        from .watcher import WatchedDeck
+        from .watcher import watch_decks
+
+        decks = []
+        for generator in watched:
+            generator.log(u"Watching %s\n" % generator.watch_dir)
+            decks.append(WatchedDeck(generator.watch_dir, generator.write_and_log,
+                                     lambda generator=generator: generator.dependencies))
+        watch_decks(decks, watched[0].watch_backend)
+
+
+def render_files(files, source='.', **kwargs):
+    """ Renders a presentation from in-memory files: ``files`` maps paths to
+        their contents (text for sources and stylesheets, bytes for images)
+        and ``source`` is the file, directory or ``.cfg`` to render from that
+        mapping. Nothing but the theme is read from disk.
+    """
+    return Generator(source, files=files, **kwargs).render()
+
+
+def render_string(text, format='markdown', **kwargs):
+    """ Renders a presentation from a single source string in the given
+        format (``markdown``, ``restructuredtext`` or ``textile``).
+    """
+    if format not in SUPPORTED_FORMATS:
+        raise NotImplementedError(u"Unsupported format %s" % format)
+    source = 'presentation' + SUPPORTED_FORMATS[format][0]
+    return render_files({source: text}, source, **kwargs)
@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+"""Intrinsic size of images, read from the first bytes of PNG, GIF, JPEG and
+SVG files, and the ``<img>`` attributes set from it: ``width`` and ``height``
+(so the browser reserves the space of the images before loading them) and
+``loading="lazy"`` / ``decoding="async"`` for the images of the slides that
+aren't shown first.
+
+The sizes of the files on disk are cached by mtime, rebuilds don't read them
+again.
+"""
+import io
+import re
+import struct
+
+from . import scanner
+from . import utils
+from .vfs import MemoryFileSystem
+
+# how much of an svg file is read to find the size of its root element
+SVG_HEAD_SIZE = 4096
+# start of frame markers, the ones holding the size of a jpeg image
+JPEG_SOF_MARKERS = frozenset(range(0xc0, 0xd0)) - frozenset((0xc4, 0xc8, 0xcc))
+# markers without a length
+JPEG_STANDALONE_MARKERS = frozenset((0x01, 0xd8) + tuple(range(0xd0, 0xd8)))
+
+_svg_length_re = re.compile(r'^\s*(\d+(?:\.\d*)?|\.\d+)\s*(?:px)?\s*$')
+_svg_viewbox_re = re.compile(r'[\s,]+')
+
+
+def read_size(fh):
+    """ Returns the ``(width, height)`` of the image in a binary file object,
+        or ``None`` if it isn't a PNG, GIF, JPEG or SVG image or has no
+        definite size.
+    """
+    try:
+        head = fh.read(26)
+        if head.startswith(b'\x89PNG\r\n\x1a\n') and head[12:16] == b'IHDR':
+            return struct.unpack('>II', head[16:24])
+        if head[:6] in (b'GIF87a', b'GIF89a'):
+            return struct.unpack('<HH', head[6:10])
+        if head.startswith(b'\xff\xd8'):
+            fh.seek(2)
+            return _jpeg_size(fh)
+        if head.lstrip()[:1] == b'<':
+            return _svg_size(head + fh.read(SVG_HEAD_SIZE - len(head)))
+    except (struct.error, ValueError):
+        pass
+    return None
+
+
+def _jpeg_size(fh):
+    rotated = False
+    while True:
+        marker = fh.read(2)
+        if marker[:1] != b'\xff':
+            return None
+        while marker[1:] == b'\xff':
+            # fill bytes
+            marker = b'\xff' + fh.read(1)
+        if len(marker) < 2:
+            return None
+        code = ord(marker[1:])
+        if code in JPEG_STANDALONE_MARKERS:
+            continue
+        if code in (0xd9, 0xda):
+            # end of image or start of scan: no frame header
+            return None
+        length, = struct.unpack('>H', fh.read(2))
+        if code in JPEG_SOF_MARKERS:
+            height, width = struct.unpack('>xHH', fh.read(5))
+            return (height, width) if rotated else (width, height)
+        if code == 0xe1:
+            rotated = _exif_rotated(fh.read(length - 2)) or rotated
+        else:
+            fh.seek(length - 2, io.SEEK_CUR)
+
+
+def _exif_rotated(data):
+    """ Tells if the EXIF orientation of a jpeg image turns it by 90° (the
+        browsers apply it, so the width and height are swapped).
+    """
+    if not data.startswith(b'Exif\x00\x00'):
+        return False
+    tiff = data[6:]
+    order = {b'II': '<', b'MM': '>'}.get(tiff[:2])
+    if not order:
+        return False
+    offset, = struct.unpack(order + 'I', tiff[4:8])
+    count, = struct.unpack(order + 'H', tiff[offset:offset + 2])
+    for position in range(offset + 2, offset + 2 + 12 * count, 12):
+        tag, = struct.unpack(order + 'H', tiff[position:position + 2])
+        if tag == 0x0112:
+            orientation, = struct.unpack(order + 'H', tiff[position + 8:position + 10])
+            return orientation >= 5
+    return False
+
+
+def _svg_size(head):
+    for tag in scanner.iter_tags(head.decode('utf-8', 'ignore')):
+        if tag.name != 'svg' or tag.closing:
+            continue
+        width, height = (_svg_length(tag.attrs.get(name)) for name in ('width', 'height'))
+        if width and height:
+            return int(round(width)), int(round(height))
+        try:
+            x, y, view_width, view_height = (float(value) for value in
+                                             _svg_viewbox_re.split(tag.attrs.get('viewbox', '').strip()))
+        except ValueError:
+            return None
+        if view_width <= 0 or view_height <= 0:
+            return None
+        if width:
+            view_width, view_height = width, width * view_height / view_width
+        elif height:
+            view_width, view_height = height * view_width / view_height, height
+        return int(round(view_width)), int(round(view_height))
+    return None
+
+
+def _svg_length(value):
+    """ Returns an svg length in pixels, or ``None`` for relative lengths.
+    """
+    match = _svg_length_re.match(value or '')
+    return float(match.group(1)) if match else None
+
+
+def _read_file_size(path):
+    with open(path, 'rb') as fh:
+        return read_size(fh)
+
+
+_sizes = utils.FileCache(_read_file_size)
+
+
+def image_size(path, fs=None):
+    """ Returns the ``(width, height)`` of an image file, or ``None`` if it
+        can't be read or has no definite size.
+    """
+    try:
+        if isinstance(fs, MemoryFileSystem):
+            return read_size(io.BytesIO(fs.read_bytes(path)))
+        return _sizes.get(path)
+    except (IOError, OSError):
+        return None
+
+
+def insert_position(html, tag):
+    """ Returns where attributes can be added to a start tag: after its last
+        attribute, before the ``>`` or ``/>`` ending it.
+    """
+    position = tag.end - 1
+    floor = max([end for start, end in tag.spans.values()] + [tag.start + len(tag.name) + 1])
+    while position > floor and html[position - 1] in ' \t\r\n\f/':
+        position -= 1
+    return position
+
+
+def set_sizes(html, base_dir, fs=None):
+    """ Returns the ``(start, end, text)`` insertions (see
+        :func:`scanner.replace_spans`) adding their ``width`` and ``height`` to
+        the ``<img>`` elements of local images that have no size set, and the
+        paths of the images read.
+    """
+    insertions = []
+    paths = []
+    for tag in scanner.iter_tags(html):
+        if tag.name != 'img' or tag.closing or 'width' in tag.attrs or 'height' in tag.attrs:
+            continue
+        if re.search(r'(^|;)\s*(width|height)\s*:', tag.attrs.get('style', '')):
+            continue
+        path = utils.local_path(utils.unescape(tag.attrs.get('src', '')), base_dir)
+        if not path:
+            continue
+        paths.append(path)
+        size = image_size(path, fs)
+        if size and all(size):
+            position = insert_position(html, tag)
+            insertions.append((position, position, ' width="%d" height="%d"' % size))
+    return insertions, paths
+
+
+def defer_loading(html):
+    """ Returns the html with ``loading="lazy"`` and ``decoding="async"`` added
+        to its ``<img>`` elements (unless they already have these attributes).
+    """
+    insertions = []
+    for tag in scanner.iter_tags(html):
+        if tag.name != 'img' or tag.closing:
+            continue
+        attrs = ''.join(' %s="%s"' % (name, value) for name, value in (('loading', 'lazy'), ('decoding', 'async'))
+                        if name not in tag.attrs)
+        if attrs:
+            position = insert_position(html, tag)
+            insertions.append((position, position, attrs))
+    return scanner.replace_spans(html, insertions)
@@ -1,15 +1,20 @@
 # -*- coding: utf-8 -*-
+import hashlib
 import os
 import re
-import sys
 
 import pygments
 import qrcode
+from pygments import token
 from pygments.formatters import HtmlFormatter
+from pygments.lexers import find_lexer_class_by_name
 from pygments.lexers import get_lexer_by_name
+from pygments.util import ClassNotFound
 from qrcode.image.svg import SvgPathImage
 from six.moves import html_entities
 
+from . import images
+from . import scanner
 from . import utils
 
 try:
@@ -17,12 +22,74 @@ try:
 except ImportError:
     from StringIO import StringIO
 
+# how much of a code block is read to guess its language
+GUESS_SAMPLE_SIZE = 400
+# the tokens telling that a lexer understands the code it reads
+GUESS_TOKENS = (token.Keyword, token.Name.Builtin, token.Name.Class, token.Name.Function, token.Name.Namespace,
+                token.Name.Tag, token.Name.Attribute, token.Comment, token.Literal, token.Operator.Word)
+
+# guessed languages by (digest of the sample, candidates)
+_guesses = {}
+# weight of each token type in the guesses: 1 for the ones in GUESS_TOKENS,
+# -2 for errors (lenient lexers read anything without them), 0 otherwise
+_token_weights = {}
+
+
+def lexer_names(names):
+    """ Returns the lexer names of a comma or space separated string (or a
+        list), checking that pygments has them.
+    """
+    if not names:
+        return []
+    if not isinstance(names, list):
+        names = re.split(r'[\s,]+', names.strip())
+    for name in names:
+        try:
+            find_lexer_class_by_name(name)
+        except ClassNotFound:
+            raise ValueError(u"Unknown pygments lexer %s" % name)
+    return names
+
+
+def guess_lang(code, candidates):
+    """ Returns the name of the lexer among ``candidates`` that recognizes
+        the beginning of some code best, the first one on a tie, or ``None``
+        if none does. Only the first :data:`GUESS_SAMPLE_SIZE` characters
+        are lexed, the guesses are cached by their digest.
+    """
+    sample = code[:GUESS_SAMPLE_SIZE]
+    key = hashlib.sha1(sample.encode('utf-8')).hexdigest(), tuple(candidates)
+    if key in _guesses:
+        return _guesses[key]
+    size = float(len(sample.strip()) or 1)
+    best, best_score = None, 0
+    for name in candidates:
+        lexer = find_lexer_class_by_name(name)
+        weights = 0
+        for position, token_type, value in lexer().get_tokens_unprocessed(sample):
+            weight = _token_weights.get(token_type)
+            if weight is None:
+                weight = _token_weights[token_type] = -2 if token_type in token.Error else int(
+                    any(token_type in known_type for known_type in GUESS_TOKENS))
+            if weight:
+                weights += weight * len(value.strip())
+        score = lexer.analyse_text(sample) + weights / size
+        if score > best_score:
+            best, best_score = name, score
+    _guesses[key] = best
+    return best
+
 
 class Macro(object):
     """Base class for altering slide HTML during presentation generation"""
 
-    def __init__(self, logger=sys.stdout, embed=False, options=None):
-        self.logger = logger
+    # whether the output depends on the options that may change between the
+    # variants of a presentation: such macros run once per variant, after the
+    # other ones (see Generator.write_variants)
+    variant = False
+
+    def __init__(self, logger=None, embed=False, options=None):
+        self.logger = logger if callable(logger) else self.ignore
         self.embed = embed
         if options:
             if not isinstance(options, dict):
@@ -31,6 +98,31 @@ class Macro(object):
         else:
             self.options = {}
 
+    @staticmethod
+    def ignore(message, type='notice'):
+        """Logger used when the generator has none"""
+
+    @staticmethod
+    def add_dependency(context, path):
+        """Records a file the slide depends on (watch mode rebuilds the slide
+        when it changes)"""
+        if context is not None and path:
+            context.setdefault('dependencies', set()).add(path)
+
+    @staticmethod
+    def add_embedded(context, url, size):
+        """Records the size of an asset embedded in the slide (for the size
+        report)"""
+        if context is not None:
+            context.setdefault('embedded', {})[url] = size
+
+    @staticmethod
+    def add_copied(context, url, size):
+        """Records the size of an asset of the slide copied next to the
+        presentation instead of being embedded (see EmbedPolicy)"""
+        if context is not None:
+            context.setdefault('copied', {})[url] = size
+
     def process(self, content, source=None, context=None):
         """Generic processor (does actually nothing)"""
         return content, []
@@ -39,17 +131,6 @@ class Macro(object):
 class CodeHighlightingMacro(Macro):
     """Performs syntax coloration in slide code blocks using Pygments"""
 
-    macro_re = re.compile(
-        r"""(?P<whole_block>
-        <pre.*?> \s*
-            (?:<code\s*(?:class=\"(?P<lang0>.*?)\")?>)?
-                (?:!(?P<lang1>\w+))? \s*
-                (?P<code_block>.*?)
-            (?:</code>)? \s*
-        </pre>
-        )""",
-        re.UNICODE | re.MULTILINE | re.DOTALL | re.VERBOSE)
-
     html_entity_re = re.compile(r'&(\w+?);')
 
     def descape(self, string, defs=None):
@@ -66,37 +147,51 @@ class CodeHighlightingMacro(Macro):
         return self.html_entity_re.sub(replacer, string)
 
     def process(self, content, source=None, context=None):
-        code_blocks = self.macro_re.findall(content)
+        if '<pre' not in content:
+            return content, []
+        code_blocks = scanner.find_code_blocks(content)
         if not code_blocks:
             return content, []
 
-        classes = []
-        for whole_block, lang0, lang1, code in code_blocks:
-            lang = lang0 or lang1
+        replacements = []
+        for block in code_blocks:
+            lang = block.lang
+            if not lang and block.code.startswith('<'):
+                # already highlighted by the parser (sources are escaped, so
+                # they can't start with a tag)
+                continue
+            if not lang and self.options.get('guess_lang'):
+                lang = guess_lang(self.descape(block.code), self.options['guess_lang'])
+                if not lang:
+                    self.logger(u"Couldn't guess the language of a code block, skipping", 'notice')
+                    continue
+            if not lang:
+                continue
             try:
                 lexer = get_lexer_by_name(lang, startinline=True)
             except Exception:
                 self.logger(u"Unknown pygment lexer \"%s\", skipping"
                             % lang, 'warning')
-                return content, classes
+                continue
 
-            if 'linenos' not in self.options or self.options['linenos'] == 'no':
-                self.options['linenos'] = False
-
-            formatter = HtmlFormatter(linenos=self.options['linenos'],
+            linenos = self.options.get('linenos', 'no')
+            formatter = HtmlFormatter(linenos=False if linenos == 'no' else linenos,
                                       nobackground=True)
-            pretty_code = pygments.highlight(self.descape(code), lexer,
+            pretty_code = pygments.highlight(self.descape(block.code), lexer,
                                              formatter)
-            content = content.replace(whole_block, pretty_code, 1)
+            replacements.append((block.start, block.end, pretty_code))
 
-        return content, [u'has_code']
+        return scanner.replace_spans(content, replacements), [u'has_code']
 
 
 class EmbedImagesMacro(Macro):
     """Encodes images in base64 for embedding in image:data"""
-    macro_re = re.compile(
-        r'<img\s.*?src="(.+?)"\s?.*?/?>|<object[^<>]+?data="(.*?)"[^<>]+?type="image/svg\+xml"',
-        re.DOTALL | re.UNICODE)
+    variant = True
+
+    @classmethod
+    def remote_urls(cls, content):
+        """Returns the remote image urls referenced in the given html"""
+        return [url for url, start, end in scanner.find_images(content) if utils.is_remote(url)]
 
     def process(self, content, source=None, context=None):
         classes = []
@@ -104,37 +199,38 @@ class EmbedImagesMacro(Macro):
         if not self.embed:
             return content, classes
 
-        images = self.macro_re.findall(content)
-
         source_dir = os.path.dirname(source)
+        policy = self.options.get('embed_policy')
+        replacements = []
 
-        for image_url, data_url in images:
-            encoded_url = utils.encode_data_from_url(image_url or data_url, source_dir)
+        for url, start, end in scanner.find_images(content):
+            self.add_dependency(context, utils.local_path(url, source_dir))
+            if policy:
+                encoded_url, size, copied = policy.place(url, source_dir, self.options.get('fetcher')) or (None, 0, False)
+            else:
+                encoded_url = utils.encode_data_from_url(url, source_dir,
+                                                         self.options.get('fetcher'), self.options.get('fs'))
+                copied = False
 
             if not encoded_url:
-                self.logger(u"Failed to embed image \"%s\"" % image_url, 'warning')
-                return content, classes
-
-            if image_url:
-                content = content.replace(u"src=\"" + image_url,
-                                          u"src=\"" + encoded_url, 1)
+                self.logger(u"Failed to embed image \"%s\"" % url, 'warning')
+                continue
+
+            replacements.append((start, end, encoded_url))
+            if copied:
+                self.add_copied(context, url, size)
+                self.logger(u"Copied image %s to %s: %s, over %s" % (url, encoded_url, utils.format_size(size),
+                                                                     utils.format_size(policy.max_bytes)), 'notice')
             else:
-                content = content.replace(u"data=\"" + data_url,
-                                          u"data=\"" + encoded_url, 1)
+                self.add_embedded(context, url, len(encoded_url))
+                self.logger(u"Embedded image %s" % url, 'notice')
 
-            self.logger(u"Embedded image %s" % (image_url or data_url), 'notice')
-
-        return content, classes
+        return scanner.replace_spans(content, replacements), classes
 
 
 class FixImagePathsMacro(Macro):
     """Replaces html image paths with fully qualified absolute urls"""
-
-    macro_re = re.compile(
-        r'<img.*?src="(?!https?://|file://)(.*?)"'
-        r'|<object[^<>]+?data="(?!http://)(.*?)"[^<>]+?type="image/svg\+xml"',
-        re.DOTALL | re.UNICODE
-    )
+    variant = True
 
     def process(self, content, source=None, context=None):
         classes = []
@@ -144,17 +240,23 @@ class FixImagePathsMacro(Macro):
 
         base_path = utils.get_path_url(source, self.options['relative'] and self.options['destination_dir'])
         base_url = os.path.split(base_path)[0]
+        replacements = []
 
-        images = self.macro_re.findall(content)
+        for url, start, end in scanner.find_images(content):
+            if utils.is_remote(url) or url.startswith(('file://', 'data:')):
+                continue
+            self.add_dependency(context, utils.local_path(url, os.path.dirname(source)))
+            replacements.append((start, end, os.path.join(base_url, url)))
 
-        for matches in images:
-            for image in matches:
-                if image:
-                    full_path = '"%s"' % os.path.join(base_url, image)
-                    image = '"%s"' % image
-                    content = content.replace(image, full_path)
+        if self.options.get('lazy_images') is not None:
+            # the images of the slides are loaded lazily (see
+            # Generator.defer_images), give them their size meanwhile
+            insertions, paths = images.set_sizes(content, os.path.dirname(source), self.options.get('fs'))
+            for path in paths:
+                self.add_dependency(context, path)
+            replacements = sorted(replacements + insertions)
 
-        return content, classes
+        return scanner.replace_spans(content, replacements), classes
 
 
 class FxMacro(Macro):
@@ -214,21 +316,20 @@ class QRMacro(Macro):
 
 
 class FooterMacro(Macro):
-    """Add footer in slides"""
-    footer = ''
+    """Add footer in slides (the generator carries it to the following
+    slides)"""
     macro_re = re.compile(r'<p>\.footer:\s?(.*?)</p>')
 
     def process(self, content, source=None, context=None):
-        classes = []
+        footers = []
 
         def save(match):
-            self.footer = match.group(1)
+            footers.append(match.group(1))
             return ''
 
         content = self.macro_re.sub(save, content)
 
-        if self.footer:
-            classes.append(u'has_footer')
-            context['footer'] = self.footer
+        if footers and context is not None:
+            context['declared_footer'] = footers[-1]
 
-        return content, classes
+        return content, []
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""Manifest of a build, written next to the presentation: the darkslide
+version, the options, the source files and a hash of every file read (sources,
+configuration, theme and user files, images). Comparing it with the files on
+disk tells if the presentation is up to date, without parsing nor rendering
+anything.
+"""
+import hashlib
+import json
+import os
+
+from . import __version__
+
+CHUNK_SIZE = 64 * 1024
+SUFFIX = '.manifest.json'
+
+
+def file_hash(path):
+    """ Returns the sha1 hex digest of a file, or ``None`` if it can't be read.
+    """
+    digest = hashlib.sha1()
+    try:
+        with open(path, 'rb') as fh:
+            for chunk in iter(lambda: fh.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+    except (IOError, OSError):
+        return None
+    return digest.hexdigest()
+
+
+class Manifest(object):
+    """ The ``options``, ``sources`` (paths, in order) and ``inputs`` (hashes
+        by absolute path) of a build.
+    """
+
+    def __init__(self, options, sources, inputs, version=__version__):
+        self.version = version
+        self.options = options
+        self.sources = sources
+        self.inputs = inputs
+
+    @classmethod
+    def build(cls, options, sources, paths):
+        """ Returns the manifest of a build that read the given files.
+        """
+        return cls(options, sources, dict((path, file_hash(path)) for path in paths))
+
+    @classmethod
+    def load(cls, path):
+        """ Reads a manifest, returns ``None`` if there's none or it is
+            invalid.
+        """
+        try:
+            with open(path) as fh:
+                data = json.load(fh)
+            return cls(data['options'], data['sources'], data['inputs'], data['version'])
+        except (IOError, OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def save(self, path):
+        with open(path, 'w') as fh:
+            json.dump({
+                'version': self.version,
+                'options': self.options,
+                'sources': self.sources,
+                'inputs': self.inputs,
+            }, fh, indent=2, sort_keys=True)
+
+    def changes(self, options, sources):
+        """ Returns the reasons why a build with the given options and sources
+            would differ from this one: each file read by this build is hashed
+            again. Empty if nothing changed.
+        """
+        reasons = []
+        if self.version != __version__:
+            reasons.append(u"darkslide version changed (%s -> %s)" % (self.version, __version__))
+        for name in sorted(set(self.options) | set(options)):
+            if self.options.get(name) != options.get(name):
+                reasons.append(u"option %s changed" % name)
+        if self.sources != sources:
+            reasons.append(u"source files changed")
+        for path, digest in sorted(self.inputs.items()):
+            if file_hash(path) != digest:
+                reasons.append(u"%s %s" % (path, u"changed" if os.path.exists(path) else u"is missing"))
+        return reasons
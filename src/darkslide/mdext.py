@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""Markdown extension highlighting code blocks while the document is parsed.
+
+Both indented blocks starting with the ``!lang`` line and fenced blocks with
+an info string are handled. The highlighted html is stashed so markdown leaves
+it alone, and :class:`~darkslide.macro.CodeHighlightingMacro` skips it as it is
+already highlighted. Blocks without a known language are left untouched.
+"""
+import re
+from xml.sax.saxutils import escape
+
+import pygments
+from markdown.extensions import Extension
+from markdown.preprocessors import Preprocessor
+from markdown.treeprocessors import Treeprocessor
+from pygments.formatters import HtmlFormatter
+from pygments.lexers import get_lexer_by_name
+from pygments.util import ClassNotFound
+
+from . import utils
+
+
+def highlight(code, lang, linenos=False):
+    """ Returns the highlighted html of the given code, or ``None`` if there's
+        no lexer for ``lang``.
+    """
+    if not lang:
+        return None
+    try:
+        lexer = get_lexer_by_name(lang, startinline=True)
+    except ClassNotFound:
+        return None
+    return pygments.highlight(code, lexer, HtmlFormatter(linenos=linenos, nobackground=True))
+
+
+class FencedCodePreprocessor(Preprocessor):
+    """Highlights ```` ``` ```` and ``~~~`` fenced blocks."""
+
+    fenced_re = re.compile(
+        r"""^(?P<fence>`{3,}|~{3,})[ ]*
+        \{?\.?(?P<lang>[\w#.+-]*)[^\n]*\n
+        (?P<code>.*?)(?<=\n)
+        (?P=fence)[ ]*$""",
+        re.MULTILINE | re.DOTALL | re.VERBOSE)
+
+    def __init__(self, md, linenos):
+        Preprocessor.__init__(self, md)
+        self.linenos = linenos
+
+    def run(self, lines):
+        text = '\n'.join(lines)
+        position = 0
+        while True:
+            match = self.fenced_re.search(text, position)
+            if not match:
+                break
+            html = highlight(match.group('code'), match.group('lang'), self.linenos)
+            if html is None:
+                html = u'<pre><code>%s</code></pre>' % escape(match.group('code'))
+            placeholder = self.md.htmlStash.store(html)
+            text = u'%s\n%s\n%s' % (text[:match.start()], placeholder, text[match.end():])
+            position = match.start() + len(placeholder) + 2
+        return text.split('\n')
+
+
+class CodeBlockTreeprocessor(Treeprocessor):
+    """Highlights indented code blocks, the language being given by a
+    ``!lang`` first line or by the class of the ``<code>`` element.
+    """
+
+    def __init__(self, md, linenos):
+        Treeprocessor.__init__(self, md)
+        self.linenos = linenos
+
+    def run(self, root):
+        for block in root.iter('pre'):
+            if len(block) != 1 or block[0].tag != 'code':
+                continue
+            code = utils.unescape(block[0].text or '')
+            lang = block[0].get('class', '')
+            if lang.startswith('language-'):
+                lang = lang[len('language-'):]
+            if code.startswith('!'):
+                first_line, _, code = code.partition('\n')
+                lang = first_line[1:].strip()
+            html = highlight(code, lang, self.linenos)
+            if html is None:
+                continue
+            tail = block.tail
+            block.clear()
+            block.tag = 'p'
+            block.tail = tail
+            block.text = self.md.htmlStash.store(html)
+
+
+class CodeHighlightExtension(Extension):
+    """Registers the darkslide code highlighting processors."""
+
+    def __init__(self, linenos=False):
+        Extension.__init__(self)
+        self.linenos = linenos
+
+    def extendMarkdown(self, md, *args):
+        md.preprocessors.register(FencedCodePreprocessor(md, self.linenos), 'darkslide_fenced_code', 26)
+        md.treeprocessors.register(CodeBlockTreeprocessor(md, self.linenos), 'darkslide_code', 30)
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""Conservative minifiers for the stylesheets, scripts and html of the
+presentations: comments and insignificant whitespace are removed, nothing is
+renamed or rewritten. Strings, regular expression literals and the contents
+of ``<pre>``, ``<textarea>``, ``<script>`` and ``<style>`` elements are left
+alone.
+"""
+import re
+
+from . import utils
+
+_css_token_re = re.compile(r'''("(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*')|(/\*.*?\*/)''', re.DOTALL)
+_css_space_re = re.compile(r'\s*([{};,>])\s*|(:)\s+')
+_js_string_re = re.compile(r'''"(?:\\.|[^"\\\n])*"|'(?:\\.|[^'\\\n])*'|`(?:\\.|[^`\\])*`''', re.DOTALL)
+_js_comment_re = re.compile(r'/\*.*?\*/|//[^\n]*', re.DOTALL)
+_js_regex_re = re.compile(r'/(?:\\.|\[(?:\\.|[^\]\\\n])*\]|[^/\\\n\[])+/[a-z]*')
+_js_code_re = re.compile(r'''[^"'`/]+''')
+# a / after one of these starts a regular expression, not a division
+_js_regex_prefixes = tuple('(,=:[!&|?{};+-*%<>~^\n') + ('return', 'typeof')
+_html_protected_re = re.compile(r'(<(pre|textarea|script|style)\b.*?</\2\s*>)', re.DOTALL | re.IGNORECASE)
+_html_comment_re = re.compile(r'<!--(?!\[if).*?-->', re.DOTALL)
+_html_space_re = re.compile(r'\s+')
+
+
+def minify_css(text):
+    """ Removes the comments and insignificant whitespace of a stylesheet.
+    """
+    chunks = []
+    position = 0
+    for match in _css_token_re.finditer(text):
+        chunks.append(_minify_css_code(text[position:match.start()]))
+        if match.group(1):
+            chunks.append(match.group(1))
+        position = match.end()
+    chunks.append(_minify_css_code(text[position:]))
+    return ''.join(chunks).strip()
+
+
+def _minify_css_code(code):
+    code = _css_space_re.sub(lambda match: match.group(1) or match.group(2), ' '.join(code.split()))
+    return code.replace(';}', '}')
+
+
+def minify_js(text):
+    """ Removes the comments, indentation and blank lines of a script. Line
+        breaks are kept, so automatic semicolon insertion is unaffected.
+    """
+    chunks = []
+    code = []
+    position = 0
+    length = len(text)
+
+    def flush():
+        if code:
+            chunks.append(re.sub(r'\s*\n\s*', '\n', re.sub(r'[ \t]+', ' ', ''.join(code))))
+            del code[:]
+
+    while position < length:
+        char = text[position]
+        match = None
+        if char in '"\'`':
+            match = _js_string_re.match(text, position)
+        elif char == '/':
+            match = _js_comment_re.match(text, position)
+            if match:
+                # keep a line break in place of multiline comments
+                code.append('\n' if '\n' in match.group() or match.group().startswith('//') else ' ')
+                position = match.end()
+                continue
+            previous = ''.join(chunks[-1:] + code).rstrip(' \t')
+            if not previous.strip() or previous.endswith(_js_regex_prefixes):
+                match = _js_regex_re.match(text, position)
+        else:
+            match = _js_code_re.match(text, position)
+            code.append(match.group())
+            position = match.end()
+            continue
+        if match:
+            flush()
+            chunks.append(match.group())
+            position = match.end()
+        else:
+            code.append(char)
+            position += 1
+    flush()
+    return ''.join(chunks).strip()
+
+
+def minify_html(html):
+    """ Removes the comments and collapses the whitespace of an html document,
+        leaving preformatted and script elements alone.
+    """
+    chunks = []
+    position = 0
+    for match in _html_protected_re.finditer(html):
+        chunks.append(_minify_html_text(html[position:match.start()]))
+        chunks.append(match.group(1))
+        position = match.end()
+    chunks.append(_minify_html_text(html[position:]))
+    return ''.join(chunks).strip()
+
+
+def _minify_html_text(text):
+    text = _html_comment_re.sub('', text)
+    return _html_space_re.sub(lambda match: '\n' if '\n' in match.group() else ' ', text)
+
+
+def minify_file(path, encoding):
+    """ Returns a ``(contents, original_size)`` tuple for a css or js file, the
+        contents being minified.
+    """
+    text = utils.read_text(path, encoding)
+    minifier = minify_css if path.endswith('.css') else minify_js
+    return minifier(text), len(text)
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""Compact objects holding the slides and table of contents of a presentation.
+
+They also support the mapping protocol (``slide['title']``), so templates and
+code written against the former plain dicts keep working.
+"""
+import os
+import sys
+
+from six import binary_type
+
+
+class Record(object):
+    """Base class giving dict-like access to the slots of its subclasses."""
+
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        return hasattr(self, key)
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+
+class Slide(Record):
+    """A single slide. Values set by macros under names that aren't slots are
+    kept in :attr:`extra`.
+    """
+
+    __slots__ = ('header', 'content', 'classes', 'level', 'title', 'number', 'presenter_notes', 'footer',
+                 'source_path', '_source', 'dependencies', 'embedded', 'copied', 'extra')
+
+    def __init__(self, header=None, content=None, classes=(), level=None, title=None, source_path=None,
+                 presenter_notes=None, footer=None):
+        self.header = header
+        self.content = content
+        self.classes = list(classes)
+        self.level = level
+        self.title = title
+        self.number = None
+        self.presenter_notes = presenter_notes
+        self.footer = footer
+        self.source_path = source_path
+        self._source = None
+        self.dependencies = set()
+        self.embedded = {}
+        self.copied = {}
+        self.extra = {}
+
+    def __getattr__(self, name):
+        # only called for names that aren't set slots
+        if name == 'extra' or name.startswith('__'):
+            raise AttributeError(name)
+        try:
+            return self.extra[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __setitem__(self, key, value):
+        if key in self.__slots__ or key == 'source':
+            setattr(self, key, value)
+        else:
+            self.extra[key] = value
+
+    def as_dict(self):
+        """ Returns the data of the slide as a dict of plain values (eg: to be
+            serialized as JSON).
+        """
+        return {
+            'number': self.number,
+            'title': self.title,
+            'level': self.level,
+            'classes': list(self.classes),
+            'header': self.header,
+            'content': self.content,
+            'presenter_notes': self.presenter_notes,
+            'footer': self.footer,
+            'source': self.source.get('rel_path'),
+        }
+
+    def fragment_key(self):
+        """ Returns a hashable key of everything a slide renders from.
+        """
+        return (self.header, self.content, tuple(self.classes), self.level, self.title, self.number,
+                self.presenter_notes, self.footer, self.source_path, tuple(sorted(self.extra.items())))
+
+    @property
+    def source(self):
+        """ The ``rel_path`` and ``abs_path`` of the source file (empty if the
+            slide has no source).
+        """
+        if self._source is None:
+            path = self.source_path
+            if not path:
+                self._source = {}
+            else:
+                if isinstance(path, binary_type):
+                    path = path.decode(sys.getfilesystemencoding(), 'ignore')
+                self._source = {'rel_path': path, 'abs_path': os.path.abspath(path)}
+        return self._source
+
+    @source.setter
+    def source(self, value):
+        self._source = value
+
+
+class TocEntry(Record):
+    """An entry of the table of contents, with its nested entries."""
+
+    __slots__ = ('title', 'number', 'level', 'sub')
+
+    def __init__(self, title, number, level):
+        self.title = title
+        self.number = number
+        self.level = level
+        self.sub = []
+
+
+class Deck(Record):
+    """State of a build: numbering, footer, table of contents, source files,
+    files read (besides the slides ones), assets embedded in the stylesheets
+    (or copied next to the presentation) and size report, and the parsed sources and rendered slides to keep for
+    the next builds. Each build has its own, so builds can run concurrently."""
+
+    __slots__ = ('num_slides', 'footer', 'toc_entries', '_toc', 'sources', 'dependencies', 'embedded', 'copied',
+                 'report', 'slide_cache', 'fragments')
+
+    def __init__(self):
+        self.num_slides = 0
+        self.footer = None
+        self.toc_entries = []
+        self._toc = None
+        self.sources = []
+        self.dependencies = set()
+        self.embedded = {}
+        self.copied = {}
+        self.report = None
+        self.slide_cache = {}
+        self.fragments = None
+
+    def add_toc_entry(self, title, level, number):
+        self.toc_entries.append(TocEntry(title, number, level))
+        self._toc = None
+
+    @property
+    def toc(self):
+        """ The table of contents as a tree of :class:`TocEntry`, built once.
+        """
+        if self._toc is None:
+            toc = []
+            stack = [toc]
+            for entry in self.toc_entries:
+                entry.sub = []
+                while entry.level < len(stack):
+                    stack.pop()
+                while entry.level > len(stack):
+                    stack.append(stack[-1][-1].sub)
+                stack[-1].append(entry)
+            self._toc = toc
+        return self._toc
@@ -1,11 +1,12 @@
 # -*- coding: utf-8 -*-
-import re
+import os
 
 SUPPORTED_FORMATS = {
     'markdown': ['.mdown', '.markdown', '.markdn', '.md', '.mdn', '.mdwn'],
     'restructuredtext': ['.rst', '.rest'],
     'textile': ['.textile'],
 }
+SUPPORTED_EXTENSIONS = tuple(ext for exts in SUPPORTED_FORMATS.values() for ext in exts)
 
 
 class Parser(object):
@@ -15,23 +16,14 @@ class Parser(object):
        The Parser currently supports both Markdown and restructuredText
        syntaxes.
     """
-    RST_REPLACEMENTS = [
-        (r'<div.*?>', r'', re.UNICODE),
-        (r'</div>', r'', re.UNICODE),
-        (r'<p class="system-message-\w+">.*?</p>', r'', re.UNICODE),
-        (r'Document or section may not begin with a transition\.',
-            r'', re.UNICODE),
-        (r'<h(\d+?).*?>', r'<h\1>', re.DOTALL | re.UNICODE),
-        (r'<hr.*?>\n', r'<hr />\n', re.DOTALL | re.UNICODE),
-        (r'<a class=\"toc-backref\" href=\"#id[0-9]+\">(.+)<\/a>', r'\1', re.UNICODE),
-    ]
-
-    md_extensions = ''
-
-    def __init__(self, extension, encoding='utf8', md_extensions=''):
+    md_extensions = ()
+
+    def __init__(self, extension, encoding='utf8', md_extensions='', linenos='inline'):
         """Configures this parser.
         """
         self.encoding = encoding
+        self.dependencies = []
+        self.linenos = False if linenos == 'no' else linenos
         self.format = None
 
         for supp_format, supp_extensions in SUPPORTED_FORMATS.items():
@@ -44,10 +36,13 @@ class Parser(object):
 
         if md_extensions:
             exts = (value.strip() for value in md_extensions.split(','))
-            self.md_extensions = filter(None, exts)
+            self.md_extensions = [ext for ext in exts if ext]
 
-    def parse(self, text):
+    def parse(self, text, source=None):
         """Parses and renders a text as HTML regarding current format.
+
+           The paths of the other files read while parsing ``source`` (eg: RST
+           includes) are stored in ``dependencies``.
         """
         if self.format == 'markdown':
             try:
@@ -58,20 +53,20 @@ class Parser(object):
             if text.startswith(u'\ufeff'):  # check for unicode BOM
                 text = text[1:]
 
-            return markdown.markdown(text, extensions=self.md_extensions)
+            from .mdext import CodeHighlightExtension
+
+            extensions = [CodeHighlightExtension(self.linenos)]
+            extensions.extend(self.md_extensions)
+            return markdown.markdown(text, extensions=extensions)
         elif self.format == 'restructuredtext':
             try:
-                from .rst import html_body
+                from .rst import html_parts
             except ImportError:
                 raise RuntimeError(u"Looks like docutils are not installed")
 
-            html = html_body(text, input_encoding=self.encoding)
-
-            # RST generates pretty much markup to be removed in our case
-            for (pattern, replacement, mode) in self.RST_REPLACEMENTS:
-                html = re.sub(re.compile(pattern, mode), replacement, html, 0)
-
-            return html.strip()
+            parts = html_parts(text, source_path=source, input_encoding=self.encoding)
+            self.dependencies = [os.path.abspath(path) for path in parts['dependencies']]
+            return parts['html_body'].strip()
         elif self.format == 'textile':
             try:
                 import textile
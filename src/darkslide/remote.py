@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import mimetypes
+import os
+import threading
+from multiprocessing.pool import ThreadPool
+
+from six.moves import http_client
+from six.moves.urllib.parse import urljoin
+from six.moves.urllib.parse import urlsplit
+
+try:
+    from os import replace
+except ImportError:
+    from os import rename as replace
+
+MAX_REDIRECTS = 5
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+
+
+def default_cache_dir():
+    """ Returns the directory where downloaded assets are cached by default.
+    """
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'darkslide')
+
+
+class ConnectionPool(object):
+    """ Keeps idle keep-alive HTTP connections around, per scheme and host, so
+        that consecutive requests to the same host reuse them.
+    """
+
+    def __init__(self, maxsize=4, timeout=10):
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self.idle = {}
+        self.lock = threading.Lock()
+
+    def connect(self, scheme, netloc):
+        with self.lock:
+            connections = self.idle.get((scheme, netloc))
+            if connections:
+                return connections.pop(), True
+        if scheme == 'https':
+            return http_client.HTTPSConnection(netloc, timeout=self.timeout), False
+        return http_client.HTTPConnection(netloc, timeout=self.timeout), False
+
+    def release(self, scheme, netloc, connection):
+        with self.lock:
+            connections = self.idle.setdefault((scheme, netloc), [])
+            if len(connections) < self.maxsize:
+                connections.append(connection)
+                return
+        connection.close()
+
+    def close(self):
+        """ Closes all the idle connections.
+        """
+        with self.lock:
+            idle, self.idle = self.idle, {}
+        for connections in idle.values():
+            for connection in connections:
+                connection.close()
+
+    def request(self, url, headers=None):
+        """ Performs a GET request and returns a ``(status, headers, body)``
+            tuple, header names being lowercased.
+        """
+        parts = urlsplit(url)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        connection, reused = self.connect(parts.scheme, parts.netloc)
+        try:
+            connection.request('GET', path, headers=headers or {})
+            response = connection.getresponse()
+        except (http_client.HTTPException, IOError):
+            connection.close()
+            if not reused:
+                raise
+            # stale keep-alive connection, try again with a fresh one
+            connection, _ = self.connect(parts.scheme, parts.netloc)
+            connection.request('GET', path, headers=headers or {})
+            response = connection.getresponse()
+        body = response.read()
+        response_headers = dict((name.lower(), value) for name, value in response.getheaders())
+        if response_headers.get('connection', '').lower() == 'close':
+            connection.close()
+        else:
+            self.release(parts.scheme, parts.netloc, connection)
+        return response.status, response_headers, body
+
+
+class RemoteFetcher(object):
+    """ Downloads remote assets concurrently into an on-disk cache.
+
+        Cached assets are revalidated with their ``ETag`` and ``Last-Modified``
+        headers, so repeated builds don't download them again. Each url is
+        fetched at most once until :meth:`close` is called, concurrent callers
+        waiting for the first download to finish. Builds sharing a fetcher
+        call :meth:`open` and :meth:`close`, the urls being kept until the
+        last one is done.
+    """
+
+    def __init__(self, cache_dir=None, workers=8, logger=None):
+        self.cache_dir = cache_dir or default_cache_dir()
+        self.workers = workers
+        self.logger = logger
+        self.pool = ConnectionPool()
+        self.fetched = {}
+        self.pending = {}
+        self.builds = 0
+        self.lock = threading.Lock()
+
+    def log(self, message, type='notice'):
+        if self.logger:
+            self.logger(message, type)
+
+    def open(self):
+        """ Starts a build using the fetcher.
+        """
+        with self.lock:
+            self.builds += 1
+
+    def close(self):
+        """ Ends a build. Once no build uses the fetcher, closes the pooled
+            connections and forgets the urls fetched so far (they will be
+            revalidated by the next build).
+        """
+        with self.lock:
+            self.builds = max(self.builds - 1, 0)
+            if self.builds:
+                return
+            self.fetched.clear()
+        self.pool.close()
+
+    def cache_path(self, url):
+        return os.path.join(self.cache_dir, hashlib.sha1(url.encode('utf-8')).hexdigest())
+
+    def read_cache(self, url):
+        path = self.cache_path(url)
+        try:
+            with open(path + '.json') as fh:
+                meta = json.load(fh)
+            with open(path, 'rb') as fh:
+                return meta, fh.read()
+        except (IOError, OSError, ValueError):
+            return None, None
+
+    def write_cache(self, url, meta, data):
+        path = self.cache_path(url)
+        try:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            for target, contents, mode in ((path, data, 'wb'), (path + '.json', json.dumps(meta), 'w')):
+                with open(target + '.tmp', mode) as fh:
+                    fh.write(contents)
+                replace(target + '.tmp', target)
+        except (IOError, OSError) as exc:
+            self.log(u"Failed to cache %s: %s" % (url, exc), 'warning')
+
+    def download(self, url):
+        meta, data = self.read_cache(url)
+        headers = {}
+        if meta:
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                headers['If-Modified-Since'] = meta['last_modified']
+
+        location = url
+        try:
+            for _ in range(MAX_REDIRECTS + 1):
+                status, response_headers, body = self.pool.request(location, headers)
+                if status not in REDIRECT_STATUSES or 'location' not in response_headers:
+                    break
+                location = urljoin(location, response_headers['location'])
+                # the validators are only meaningful for the url they were cached for
+                headers = {}
+        except Exception as exc:
+            if meta:
+                self.log(u"Failed to revalidate %s (%s), using cached copy" % (url, exc), 'warning')
+                return meta['mime_type'], data
+            self.log(u"Failed to download %s: %s" % (url, exc), 'warning')
+            return None
+
+        if status == 304 and meta:
+            self.log(u"Cached   %s" % url)
+            return meta['mime_type'], data
+        if status != 200:
+            self.log(u"Failed to download %s: HTTP %s" % (url, status), 'warning')
+            return None
+
+        mime_type = response_headers.get('content-type', '').split(';')[0].strip()
+        if not mime_type or mime_type == 'application/octet-stream':
+            mime_type = mimetypes.guess_type(urlsplit(url).path)[0] or mime_type
+        if not mime_type:
+            self.log(u"Failed to download %s: unknown content type" % url, 'warning')
+            return None
+        self.write_cache(url, {
+            'url': url,
+            'mime_type': mime_type,
+            'etag': response_headers.get('etag'),
+            'last_modified': response_headers.get('last-modified'),
+        }, body)
+        self.log(u"Fetched  %s (%d bytes)" % (url, len(body)))
+        return mime_type, body
+
+    def fetch(self, url):
+        """ Returns a ``(mime_type, data)`` tuple for the given url, or ``None``
+            if it couldn't be downloaded.
+        """
+        with self.lock:
+            if url in self.fetched:
+                return self.fetched[url]
+            pending = self.pending.get(url)
+            downloading = pending is None
+            if downloading:
+                pending = self.pending[url] = threading.Event()
+        if not downloading:
+            pending.wait()
+            with self.lock:
+                return self.fetched.get(url)
+        result = None
+        try:
+            result = self.download(url)
+        finally:
+            with self.lock:
+                self.fetched[url] = result
+                del self.pending[url]
+            pending.set()
+        return result
+
+    def prefetch(self, urls):
+        """ Downloads the given urls concurrently.
+        """
+        with self.lock:
+            urls = sorted(set(url for url in urls if url not in self.fetched))
+        if len(urls) > 1:
+            workers = ThreadPool(min(self.workers, len(urls)))
+            try:
+                workers.map(self.fetch, urls)
+            finally:
+                workers.close()
+                workers.join()
+        elif urls:
+            self.fetch(urls[0])
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""Breakdown of the size of a rendered presentation, checked against the size
+budgets given with ``--max-size`` and ``--max-asset-size``.
+"""
+import os
+import re
+
+from . import scanner
+from . import utils
+
+_tag_re = re.compile(r'<[^>]*>')
+
+
+class SizeReport(object):
+    """ Sizes in bytes of a rendered presentation and of what it is made of:
+        its slides, the assets embedded in the slides and stylesheets, the
+        highlighted code and the embedded theme and user files. The items are
+        ``(name, size)`` tuples.
+    """
+
+    def __init__(self, total):
+        self.total = total
+        self.slides = []
+        self.assets = []
+        self.files = []
+        self.code = []
+
+    @classmethod
+    def build(cls, html, context, css_assets=None):
+        """ Computes the report of a presentation from its html and template
+            context. ``css_assets`` maps the urls embedded in the stylesheets
+            to their size.
+        """
+        report = cls(utils.byte_size(html))
+        slides = context['slides']
+        for slide, fragment in zip(slides, context.get('rendered_slides') or [None] * len(slides)):
+            if not slide:
+                continue
+            title = utils.unescape(_tag_re.sub('', slide['title'] or '')).strip()
+            name = u'#%s %s' % (slide['number'], title) if title else u'#%s' % slide['number']
+            if fragment is None:
+                fragment = ''.join(slide[key] or '' for key in ('header', 'content', 'presenter_notes'))
+            report.slides.append((name, utils.byte_size(fragment)))
+            report.assets.extend(slide.get('embedded', {}).items())
+            report.code.extend((name, block.end - block.start)
+                               for block in scanner.find_code_blocks(slide['content'] or '')
+                               if block.code.startswith('<'))
+        report.assets.extend((css_assets or {}).items())
+        if context['embed']:
+            files = [('%s.css' % name, asset) for name, asset in sorted(context['css'].items())]
+            files.append(('slides.js', context['js']))
+            files.extend((os.path.basename(entry.get('path') or entry['path_url']), entry)
+                         for entry in context['user_css'] + context['user_js'])
+            report.files = [(name, utils.byte_size(entry['contents'])) for name, entry in files
+                            if entry['embeddable']]
+        return report
+
+    def lines(self, largest=3):
+        """ Returns the report as lines of text, listing the ``largest`` items
+            of each part.
+        """
+        lines = [u"Size report: %s" % utils.format_size(self.total)]
+        for label, unit, items in ((u"slides", u"slides", self.slides),
+                                   (u"embedded assets", u"files", self.assets),
+                                   (u"highlighted code", u"blocks", self.code),
+                                   (u"theme and user files", u"files", self.files)):
+            if not items:
+                continue
+            line = u"  %s: %s in %d %s" % (label, utils.format_size(sum(size for name, size in items)),
+                                           len(items), unit)
+            top = sorted(items, key=lambda item: -item[1])[:largest]
+            line += u", largest: " + u", ".join(u"%s (%s)" % (name, utils.format_size(size)) for name, size in top)
+            lines.append(line)
+        return lines
+
+    def check(self, max_size=None, max_asset_size=None):
+        """ Returns the messages describing the budgets that are exceeded.
+        """
+        errors = []
+        if max_size and self.total > max_size:
+            errors.append(u"presentation is %s, over the %s budget"
+                          % (utils.format_size(self.total), utils.format_size(max_size)))
+        if max_asset_size:
+            for name, size in self.assets + self.files:
+                if size > max_asset_size:
+                    errors.append(u"%s is %s, over the %s budget per asset"
+                                  % (name, utils.format_size(size), utils.format_size(max_asset_size)))
+        return errors
@@ -3,12 +3,24 @@ from docutils import core
 from docutils import nodes
 from docutils.parsers.rst import Directive
 from docutils.parsers.rst import directives
+from docutils.writers import html4css1
 from pygments import highlight
 from pygments.formatters import HtmlFormatter
 from pygments.lexers import TextLexer
 from pygments.lexers import get_lexer_by_name
 
 
+class SlideHtmlFormatter(HtmlFormatter):
+    """ Html formatter that leaves out the ``<div class="highlight">`` wrapper,
+        slides only get the ``<pre>`` block.
+    """
+
+    def _wrap_div(self, inner):
+        for item in inner:
+            yield item
+        yield 0, '\n'
+
+
 class Pygments(Directive):
     """ Source code syntax hightlighting for ReST syntax."""
     required_arguments = 1
@@ -32,7 +44,7 @@ class Pygments(Directive):
             args['linenos'] = 'table'
         if 'emphasize-lines' in self.options:
             args['hl_lines'] = self.options['emphasize-lines'].split(',')
-        formatter = HtmlFormatter(**args)
+        formatter = SlideHtmlFormatter(**args)
         parsed = highlight(u'\n'.join(self.content), lexer, formatter)
         return [nodes.raw('', parsed, format='html')]
 
@@ -41,6 +53,62 @@ directives.register_directive('sourcecode', Pygments)
 directives.register_directive('code-block', Pygments)
 
 
+class SlideTranslator(html4css1.HTMLTranslator):
+    """ Html translator emitting bare slide markup: no document, section or
+        topic wrappers, plain ``<hN>`` titles, ``<hr />`` transitions (the slide
+        separators) and no system messages.
+    """
+
+    def depart_document(self, node):
+        html4css1.HTMLTranslator.depart_document(self, node)
+        self.html_body[:] = self.body_pre_docinfo + self.docinfo + self.body
+
+    def visit_section(self, node):
+        self.section_level += 1
+
+    def depart_section(self, node):
+        self.section_level -= 1
+
+    def visit_topic(self, node):
+        pass
+
+    def depart_topic(self, node):
+        pass
+
+    def visit_title(self, node):
+        if isinstance(node.parent, nodes.document):
+            level = 1
+        elif isinstance(node.parent, nodes.section):
+            level = self.section_level + self.initial_header_level - 1
+        else:
+            return html4css1.HTMLTranslator.visit_title(self, node)
+        level = min(level, 6)
+        self.body.append('<h%d>' % level)
+        self.context.append('</h%d>\n' % level)
+        if isinstance(node.parent, nodes.document):
+            self.in_document_title = len(self.body)
+
+    def visit_transition(self, node):
+        self.body.append('<hr />\n')
+
+    def visit_system_message(self, node):
+        raise nodes.SkipNode
+
+
+class Writer(html4css1.Writer):
+    """ Docutils writer producing the html of the slides in one pass.
+    """
+
+    def __init__(self):
+        html4css1.Writer.__init__(self)
+        self.translator_class = SlideTranslator
+
+    def assemble_parts(self):
+        html4css1.Writer.assemble_parts(self)
+        # the files read while parsing (includes...)
+        self.parts['dependencies'] = list(self.document.settings.record_dependencies.list)
+
+
 def html_parts(input_string, source_path=None, destination_path=None,
                input_encoding='unicode', doctitle=1, initial_header_level=1):
     """
@@ -70,13 +138,15 @@ def html_parts(input_string, source_path=None, destination_path=None,
         'input_encoding': input_encoding,
         'doctitle_xform': doctitle,
         'initial_header_level': initial_header_level,
-        'report_level': 5
+        'report_level': 5,
+        # only the body is used, don't read the docutils stylesheet
+        'embed_stylesheet': False,
     }
 
     parts = core.publish_parts(
         source=input_string, source_path=source_path,
         destination_path=destination_path,
-        writer_name='html', settings_overrides=overrides)
+        writer=Writer(), settings_overrides=overrides)
     return parts
 
 
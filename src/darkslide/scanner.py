@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""Linear-time scanning of the tags of an html fragment, used by the macros to
+find images and code blocks.
+
+The rules follow the HTML tokenizer closely enough for slides: comments and the
+contents of ``<script>``, ``<style>`` and ``<textarea>`` elements are skipped,
+attribute values may be quoted or not and a tag left open at the end of the
+html is ignored. Every character is looked at a bounded number of times, so
+malformed html (unclosed tags, quotes or elements) can't make the scanning
+backtrack; ``html.parser`` isn't used as it is quadratic on some of these.
+
+Attribute values are returned as they are in the html (entities aren't
+decoded), with their offsets, so the macros can replace them in place.
+"""
+import re
+from collections import namedtuple
+
+Tag = namedtuple('Tag', 'name closing start end attrs spans')
+Tag.__doc__ = """A start or end tag: its lowercased ``name``, the ``start`` and
+``end`` offsets of the tag in the html, the ``attrs`` values by lowercased name
+and their ``(start, end)`` offsets in ``spans``."""
+
+CodeBlock = namedtuple('CodeBlock', 'start end lang code')
+CodeBlock.__doc__ = """A ``<pre>`` element: the ``start`` and ``end`` offsets of
+the whole element, the language given by the class of its ``<code>`` element
+or by a ``!lang`` first line (empty if none) and the (still escaped) code."""
+
+RAW_TEXT_ELEMENTS = ('script', 'style', 'textarea')
+
+_tag_open_re = re.compile(r'<(/?)([a-zA-Z][^\s/>]*)')
+_separator_re = re.compile(r'[\s/]*')
+_attr_name_re = re.compile(r'[^\s/>][^\s/>=]*')
+_equals_re = re.compile(r'\s*=\s*')
+_unquoted_value_re = re.compile(r'[^\s>]*')
+_raw_text_end_res = dict((name, re.compile(r'</%s[\s/>]' % name, re.IGNORECASE)) for name in RAW_TEXT_ELEMENTS)
+_lang_re = re.compile(r'!(\w+)', re.UNICODE)
+
+
+def iter_tags(html):
+    """ Yields the :class:`Tag` of the given html, in order.
+    """
+    position = 0
+    while True:
+        position = html.find('<', position)
+        if position < 0:
+            return
+        if html.startswith('<!--', position):
+            end = html.find('-->', position + 4)
+            if end < 0:
+                return
+            position = end + 3
+            continue
+        match = _tag_open_re.match(html, position)
+        if not match:
+            if html.startswith(('<!', '<?', '</'), position):
+                # doctype, processing instruction or bogus comment
+                end = html.find('>', position)
+                if end < 0:
+                    return
+                position = end + 1
+            else:
+                position += 1
+            continue
+        tag = _parse_tag(html, match)
+        if tag is None:
+            return
+        yield tag
+        position = tag.end
+        if tag.name in RAW_TEXT_ELEMENTS and not tag.closing:
+            end = _raw_text_end_res[tag.name].search(html, position)
+            if not end:
+                return
+            position = end.start()
+
+
+def _parse_tag(html, match):
+    """ Parses the attributes of the tag opened by ``match``. Returns ``None``
+        if the html ends before the tag does.
+    """
+    attrs = {}
+    spans = {}
+    length = len(html)
+    position = match.end()
+    while True:
+        position = _separator_re.match(html, position).end()
+        if position >= length:
+            return None
+        if html[position] == '>':
+            return Tag(match.group(2).lower(), bool(match.group(1)), match.start(), position + 1, attrs, spans)
+        name = _attr_name_re.match(html, position)
+        key = name.group().lower()
+        position = name.end()
+        equals = _equals_re.match(html, position)
+        if equals:
+            position = equals.end()
+            if position >= length:
+                return None
+            quote = html[position]
+            if quote in '"\'':
+                start = position + 1
+                end = html.find(quote, start)
+                if end < 0:
+                    return None
+                position = end + 1
+            else:
+                start = position
+                end = position = _unquoted_value_re.match(html, position).end()
+        else:
+            start = end = position
+        # the first of duplicate attributes wins, as in browsers
+        if key not in attrs:
+            attrs[key] = html[start:end]
+            spans[key] = start, end
+
+
+def find_images(html):
+    """ Yields the ``(url, start, end)`` of the images of the given html: the
+        ``src`` of ``<img>`` elements and the ``data`` of ``<object>`` elements
+        of type ``image/svg+xml``, with the offsets of the url in the html.
+    """
+    for tag in iter_tags(html):
+        if tag.closing:
+            continue
+        if tag.name == 'img':
+            key = 'src'
+        elif tag.name == 'object' and tag.attrs.get('type') == 'image/svg+xml':
+            key = 'data'
+        else:
+            continue
+        url = tag.attrs.get(key)
+        if url:
+            yield (url,) + tag.spans[key]
+
+
+def find_code_blocks(html):
+    """ Returns the :class:`CodeBlock` of the ``<pre>`` elements of the given
+        html. Unclosed ``<pre>`` elements are ignored.
+    """
+    blocks = []
+    pre = code = None
+    first = False
+    for tag in iter_tags(html):
+        if pre is None:
+            if tag.name == 'pre' and not tag.closing:
+                pre, code, first = tag, None, True
+            continue
+        if first:
+            first = False
+            if tag.name == 'code' and not tag.closing and not html[pre.end:tag.start].strip():
+                code = tag
+        if tag.name == 'pre' and tag.closing:
+            blocks.append(_code_block(html, pre, code, tag))
+            pre = None
+    return blocks
+
+
+def _code_block(html, pre, code_tag, end_tag):
+    if code_tag:
+        lang = code_tag.attrs.get('class', '')
+        start = code_tag.end
+    else:
+        lang = ''
+        start = pre.end
+    code = html[start:end_tag.start].strip()
+    if code.endswith('</code>'):
+        code = code[:-len('</code>')].rstrip()
+    match = _lang_re.match(code)
+    if match:
+        lang = lang or match.group(1)
+        code = code[match.end():].lstrip()
+    return CodeBlock(pre.start, end_tag.end, lang, code)
+
+
+def replace_spans(html, replacements):
+    """ Returns the html with the ``(start, end, text)`` replacements (sorted
+        and not overlapping) applied.
+    """
+    chunks = []
+    position = 0
+    for start, end, text in replacements:
+        chunks.append(html[position:start])
+        chunks.append(text)
+        position = end
+    chunks.append(html[position:])
+    return ''.join(chunks)
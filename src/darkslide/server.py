@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+"""Local HTTP service rendering presentations with a pool of warm workers.
+
+Endpoints:
+
+- ``POST /render``: renders a presentation. The request body is a JSON object
+  with either a ``source`` path (file, directory or ``.cfg``) or a ``files``
+  mapping of relative paths to source text (in which case ``source`` names the
+  entry point and defaults to the whole bundle), plus optional ``options``
+  matching the :class:`~darkslide.generator.Generator` keyword arguments.
+  Responds with the rendered html.
+- ``GET /metrics``: request latency and worker cache statistics, as JSON.
+"""
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from collections import deque
+from optparse import OptionParser
+
+from six.moves import BaseHTTPServer
+from six.moves import socketserver
+
+from . import __version__
+
+# options that make no sense (or are unsafe) for a rendering service
+RENDER_OPTIONS = (
+    'embed', 'encoding', 'extensions', 'linenos', 'maxtoclevel', 'minify', 'presenter_notes', 'relative',
+    'search_index', 'theme',
+)
+LATENCY_WINDOW = 1000
+
+
+class RenderError(Exception):
+    """Raised for invalid render requests."""
+
+
+def cache_stats():
+    """ Returns the hit/miss counters of the caches of the current process.
+    """
+    from . import generator
+
+    return dict(
+        (name, {'hits': cache.hits, 'misses': cache.misses, 'entries': len(cache.entries)})
+        for name, cache in (('theme_files', generator._theme_contents), ('minified_theme_files', generator._minified_contents),
+                            ('templates', generator._templates))
+    )
+
+
+def warm_up():
+    """ Worker initializer: imports the parsers and highlighters once so that
+        requests don't pay for it.
+    """
+    import markdown  # noqa
+    import pygments.lexers  # noqa
+
+    from . import generator  # noqa
+    from . import rst  # noqa
+
+
+def render(request):
+    """ Renders a request in a worker process and returns a
+        ``(html, pid, cache_stats)`` tuple.
+    """
+    from .generator import Generator
+    from .generator import render_files
+
+    options = request.get('options') or {}
+    unknown = set(options) - set(RENDER_OPTIONS)
+    if unknown:
+        raise RenderError(u"Unsupported options: %s" % ', '.join(sorted(unknown)))
+
+    files = request.get('files')
+    if files is None:
+        if not request.get('source'):
+            raise RenderError(u"Either source or files is required")
+        html = Generator(request['source'], **options).render()
+    else:
+        html = render_files(files, request.get('source') or '.', **options)
+    return html, os.getpid(), cache_stats()
+
+
+class Metrics(object):
+    """ Request counters and latency statistics of the service.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.requests = 0
+        self.errors = 0
+        self.rejected = 0
+        self.in_flight = 0
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.workers = {}
+
+    def record(self, latency, error=False, pid=None, caches=None):
+        with self.lock:
+            self.requests += 1
+            self.errors += bool(error)
+            self.latencies.append(latency)
+            if pid is not None:
+                self.workers[pid] = caches
+
+    def snapshot(self):
+        with self.lock:
+            latencies = sorted(self.latencies)
+            caches = {}
+            for worker_caches in self.workers.values():
+                for name, stats in worker_caches.items():
+                    totals = caches.setdefault(name, {'hits': 0, 'misses': 0, 'entries': 0})
+                    for key, value in stats.items():
+                        totals[key] += value
+
+            def percentile(ratio):
+                return latencies[min(len(latencies) - 1, int(len(latencies) * ratio))] if latencies else None
+
+            return {
+                'uptime': time.time() - self.started,
+                'requests': self.requests,
+                'errors': self.errors,
+                'rejected': self.rejected,
+                'in_flight': self.in_flight,
+                'latency': {
+                    'count': len(latencies),
+                    'mean': sum(latencies) / len(latencies) if latencies else None,
+                    'p50': percentile(0.5),
+                    'p95': percentile(0.95),
+                    'max': latencies[-1] if latencies else None,
+                },
+                'caches': caches,
+                'version': __version__,
+            }
+
+
+class RenderRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    server_version = 'darkslide/' + __version__
+
+    def send(self, status, body, content_type='application/json', headers=()):
+        if not isinstance(body, bytes):
+            body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for header in headers:
+            self.send_header(*header)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_json(self, status, message, headers=()):
+        self.send(status, json.dumps({'error': message}), headers=headers)
+
+    def do_GET(self):
+        if self.path == '/metrics':
+            self.send(200, json.dumps(self.server.metrics.snapshot(), sort_keys=True))
+        else:
+            self.send_error_json(404, u"Not found")
+
+    def do_POST(self):
+        if self.path != '/render':
+            return self.send_error_json(404, u"Not found")
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+            request = json.loads(self.rfile.read(length).decode('utf-8'))
+            if not isinstance(request, dict):
+                raise ValueError(u"expected a JSON object")
+        except ValueError as exc:
+            return self.send_error_json(400, u"Invalid request: %s" % exc)
+
+        metrics = self.server.metrics
+        if not self.server.slots.acquire(False):
+            with metrics.lock:
+                metrics.rejected += 1
+            return self.send_error_json(503, u"Too many requests", headers=[('Retry-After', '1')])
+        with metrics.lock:
+            metrics.in_flight += 1
+        start = time.time()
+        try:
+            html, pid, caches = self.server.pool.apply(render, (request,))
+        except (RenderError, IOError, ValueError) as exc:
+            metrics.record(time.time() - start, error=True)
+            self.send_error_json(400, u"%s" % exc)
+        except Exception as exc:
+            metrics.record(time.time() - start, error=True)
+            self.send_error_json(500, u"%s: %s" % (type(exc).__name__, exc))
+        else:
+            metrics.record(time.time() - start, pid=pid, caches=caches)
+            self.send(200, html, 'text/html; charset=utf-8')
+        finally:
+            with metrics.lock:
+                metrics.in_flight -= 1
+            self.server.slots.release()
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPServer.BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+class RenderServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """ Threaded HTTP server handing the rendering over to a pool of worker
+        processes. At most ``max_requests`` requests are accepted at once, the
+        others are rejected with a 503.
+    """
+    daemon_threads = True
+
+    def __init__(self, address, workers=None, max_requests=None, verbose=False):
+        BaseHTTPServer.HTTPServer.__init__(self, address, RenderRequestHandler)
+        workers = workers or multiprocessing.cpu_count()
+        self.pool = multiprocessing.Pool(workers, warm_up)
+        self.slots = threading.BoundedSemaphore(max_requests or workers * 2)
+        self.metrics = Metrics()
+        self.verbose = verbose
+
+    def server_close(self):
+        BaseHTTPServer.HTTPServer.server_close(self)
+        self.pool.terminate()
+        self.pool.join()
+
+
+def main(args=None):
+    """ Entry point of ``darkslide serve-api``.
+    """
+    parser = OptionParser(
+        usage="%prog serve-api [options]",
+        description="Serves presentation rendering over HTTP (POST /render, GET /metrics).",
+        version="%prog " + __version__)
+    parser.add_option("--host", dest="host", default="127.0.0.1", help="Address to listen on. Default: 127.0.0.1.")
+    parser.add_option("--port", dest="port", type="int", default=8765, help="Port to listen on. Default: 8765.")
+    parser.add_option("--workers", dest="workers", type="int", default=None,
+                      help="Number of worker processes. Default: number of CPUs.")
+    parser.add_option("--max-requests", dest="max_requests", type="int", default=None,
+                      help="Maximum number of requests handled at once. Default: twice the number of workers.")
+    parser.add_option("-q", "--quiet", action="store_false", dest="verbose", default=True,
+                      help="Don't log requests.")
+    options, _ = parser.parse_args(args)
+
+    server = RenderServer((options.host, options.port), options.workers, options.max_requests, options.verbose)
+    sys.stdout.write("Serving on http://%s:%s\n" % server.server_address[:2])
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
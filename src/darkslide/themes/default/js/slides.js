@@ -15,6 +15,8 @@ function main() {
     var spaces = /\s+/, a1 = [''];
     var tocOpened = false;
     var helpOpened = false;
+    var searchOpened = false;
+    var searchTerms = null;
     var overviewActive = false;
     var modifierKeyDown = false;
     var scale = 1;
@@ -225,6 +227,9 @@ function main() {
         if (helpOpened) {
             showHelp();
         }
+        if (searchOpened) {
+            showSearch();
+        }
         var toc = document.getElementById('toc');
         if (toc) {
             toc.style.marginLeft = tocOpened ? '-' + (toc.clientWidth + 20) + 'px' : '0px';
@@ -237,6 +242,9 @@ function main() {
         if (tocOpened) {
             showToc();
         }
+        if (searchOpened) {
+            showSearch();
+        }
 
         var help = document.getElementById('help');
 
@@ -246,6 +254,92 @@ function main() {
         }
     };
 
+    var showSearch = function () {
+        var search = document.getElementById('search');
+        if (!search) {
+            return;
+        }
+        if (tocOpened) {
+            showToc();
+        }
+        if (helpOpened) {
+            showHelp();
+        }
+
+        search.style.marginLeft = searchOpened ? '-' + (search.clientWidth + 20) + 'px' : '0px';
+        searchOpened = !searchOpened;
+
+        var input = document.getElementById('search-query');
+        if (searchOpened) {
+            input.focus();
+        } else {
+            input.blur();
+        }
+    };
+
+    // Returns the slide numbers matching all the words of the query, each
+    // word being looked up as a prefix in the sorted term list.
+    var searchSlides = function (query) {
+        if (searchTerms === null) {
+            searchTerms = Object.keys(searchIndex.terms).sort();
+        }
+        var words = query.toLowerCase().match(/[\p{L}\p{N}_]{2,}/gu);
+        if (!words) {
+            return [];
+        }
+        var matches = null;
+        for (var i = 0; i < words.length; i++) {
+            var word = words[i];
+            var lo = 0, hi = searchTerms.length;
+            while (lo < hi) {
+                var mid = (lo + hi) >> 1;
+                if (searchTerms[mid] < word) lo = mid + 1; else hi = mid;
+            }
+            var found = {};
+            for (var j = lo; j < searchTerms.length && searchTerms[j].lastIndexOf(word, 0) === 0; j++) {
+                var numbers = searchIndex.terms[searchTerms[j]];
+                for (var k = 0; k < numbers.length; k++) {
+                    if (matches === null || matches[numbers[k]]) found[numbers[k]] = true;
+                }
+            }
+            matches = found;
+        }
+        return Object.keys(matches).map(Number).sort(function (a, b) { return a - b; });
+    };
+
+    var updateSearchResults = function () {
+        var results = document.getElementById('search-results');
+        var numbers = searchSlides(document.getElementById('search-query').value);
+        while (results.rows.length) {
+            results.deleteRow(0);
+        }
+        for (var i = 0; i < numbers.length; i++) {
+            var row = results.insertRow(-1);
+            var title = row.appendChild(document.createElement('th'));
+            var number = row.appendChild(document.createElement('td'));
+            title.innerHTML = '<a href="#slide:' + numbers[i] + '"></a>';
+            title.firstChild.textContent = searchIndex.titles[numbers[i]] || '';
+            number.innerHTML = '<a href="#slide:' + numbers[i] + '">' + numbers[i] + '</a>';
+        }
+        return numbers;
+    };
+
+    var handleSearchKeyDown = function (event) {
+        event.stopPropagation();
+        switch (event.keyCode) {
+            case 13: // Enter
+                var numbers = updateSearchResults();
+                if (numbers.length) {
+                    currentSlideNo = numbers[0];
+                    updateSlideClasses(true);
+                }
+                break;
+            case 27: // ESC
+                showSearch();
+                break;
+        }
+    };
+
     var showPresenterView = function () {
         if (isPresenterView) {
             return;
@@ -460,6 +554,12 @@ function main() {
             case 84: // t
                 showToc();
                 break;
+            case 191: // /
+                if (document.getElementById('search')) {
+                    event.preventDefault();
+                    showSearch();
+                }
+                break;
         }
     };
 
@@ -504,6 +604,22 @@ function main() {
         }
     };
 
+    var addSearchListeners = function () {
+        var input = document.getElementById('search-query');
+        if (input) {
+            input.addEventListener('keydown', handleSearchKeyDown);
+            input.addEventListener('input', updateSearchResults);
+            document.getElementById('search-results').addEventListener('click', function (e) {
+                var link = e.target.closest('a');
+                if (link) {
+                    currentSlideNo = Number(link.attributes['href'].value.replace('#slide:', ''));
+                    updateSlideClasses(true);
+                    e.preventDefault();
+                }
+            }, true);
+        }
+    };
+
     var addRemoteWindowControls = function () {
         window.addEventListener("message", function (e) {
             if (e.data.indexOf("slide#") != -1) {
@@ -589,6 +705,7 @@ function main() {
         // add support for finger events (filter it by property detection?)
         addTouchListeners();
         addTocLinksListeners();
+        addSearchListeners();
         addSlideClickListeners();
         addRemoteWindowControls();
     })();
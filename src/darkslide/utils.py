@@ -1,12 +1,130 @@
 # -*- coding: utf-8 -*-
 import base64
+import codecs
+import fnmatch
 import mimetypes
 import os
+import re
+import threading
+
+try:
+    from os import scandir
+except ImportError:
+    from scandir import scandir  # noqa: F401
+
+try:
+    from html import unescape
+except ImportError:
+    from six.moves.html_parser import HTMLParser
+    unescape = HTMLParser().unescape
 
 # add woff2 font type: not here by default...
 mimetypes.add_type('font/woff2', '.woff2')
 
 
+class FileCache(object):
+    """ Caches values computed from files, keyed by path, mtime and size.
+
+        Instances are meant to be module-level so that all the generators of
+        a process share them (eg: in watch mode or when building many decks).
+    """
+
+    def __init__(self, loader):
+        self.loader = loader
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, path, *args):
+        """ Returns ``loader(path, *args)``, computing it again only if the file
+            changed since the last call.
+        """
+        stat = os.stat(path)
+        signature = stat.st_mtime, stat.st_size
+        key = (path,) + args
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] == signature:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        value = self.loader(path, *args)
+        with self.lock:
+            self.entries[key] = signature, value
+        return value
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.hits = self.misses = 0
+
+
+def match_globs(path, patterns):
+    """ Tells if a relative path matches one of the glob patterns. Patterns
+        without a ``/`` may also match the name of the file or directory.
+    """
+    path = path.replace(os.sep, '/')
+    name = path.rsplit('/', 1)[-1]
+    return any(fnmatch.fnmatch(path, pattern) or ('/' not in pattern and fnmatch.fnmatch(name, pattern))
+               for pattern in patterns)
+
+
+def read_text(path, encoding):
+    with codecs.open(path, encoding=encoding) as fh:
+        return fh.read()
+
+
+SIZE_UNITS = ('B', 'KiB', 'MiB', 'GiB')
+_size_re = re.compile(r'^\s*(\d+(?:\.\d*)?)\s*([kmg]?)(?:i?b)?\s*$', re.IGNORECASE)
+
+
+def parse_size(value):
+    """ Returns the number of bytes of a size such as ``300M``, ``1.5 GB`` or
+        ``512k`` (units are powers of 1024), ``None`` for an empty value.
+    """
+    if value is None or value == '' or isinstance(value, int):
+        return value or None
+    match = _size_re.match(str(value))
+    if not match:
+        raise ValueError(u"Invalid size %r: expected a number of bytes with an optional K, M or G unit" % value)
+    return int(float(match.group(1)) * 1024 ** ' kmg'.index(match.group(2).lower() or ' '))
+
+
+BOOLEAN_VALUES = {'1': True, 'yes': True, 'true': True, 'on': True,
+                  '0': False, 'no': False, 'false': False, 'off': False}
+
+
+def parse_bool(value):
+    """ Returns the boolean of a configuration value such as ``yes`` or
+        ``off`` (as ``RawConfigParser.getboolean`` reads them).
+    """
+    if isinstance(value, bool):
+        return value
+    try:
+        return BOOLEAN_VALUES[str(value).strip().lower()]
+    except KeyError:
+        raise ValueError(u"Invalid boolean %r: expected one of %s" % (value, ', '.join(sorted(BOOLEAN_VALUES))))
+
+
+def format_size(size):
+    """ Returns a human readable size, eg: ``1.5 MiB``.
+    """
+    for unit in SIZE_UNITS[:-1]:
+        if size < 1024:
+            break
+        size /= 1024.0
+    else:
+        unit = SIZE_UNITS[-1]
+    return u'%d B' % size if unit == 'B' else u'%.1f %s' % (size, unit)
+
+
+def byte_size(text):
+    """ Returns the size of a text once written, in utf-8.
+    """
+    return len(text.encode('utf-8'))
+
+
 def get_path_url(path, relative=False):
     """ Returns an absolute or relative path url given a path
     """
@@ -16,16 +134,38 @@ def get_path_url(path, relative=False):
         return os.path.relpath(path, relative)
 
 
-def encode_data_from_url(url, source_path):
+def is_remote(url):
+    return url.startswith(('http://', 'https://'))
+
+
+def local_path(url, base_dir):
+    """ Returns the absolute path of the file an url relative to ``base_dir``
+        points to, or ``None`` for remote and data urls.
+    """
+    if not url or is_remote(url) or url.startswith('data:'):
+        return None
+    if url.startswith('file://'):
+        url = url[len('file://'):]
+    return os.path.abspath(os.path.join(base_dir, url))
+
+
+def encode_data(mime_type, data):
+    return u"data:%s;base64,%s" % (mime_type, base64.b64encode(data).decode())
+
+
+def encode_data_from_url(url, source_path, fetcher=None, fs=None):
     if not url or url.startswith('data:') or url.startswith('file://'):
         return False
 
-    if url.startswith('http://') or url.startswith('https://'):
-        return False
+    if is_remote(url):
+        fetched = fetcher and fetcher.fetch(url)
+        if not fetched:
+            return False
+        return encode_data(*fetched)
 
     real_path = url if os.path.isabs(url) else os.path.join(source_path, url)
 
-    if not os.path.exists(real_path):
+    if not (fs or os.path).exists(real_path):
         return False
 
     mime_type, encoding = mimetypes.guess_type(real_path)
@@ -34,10 +174,34 @@ def encode_data_from_url(url, source_path):
         return False
 
     try:
-        with open(real_path, 'rb') as image_file:
-            image_contents = image_file.read()
-            encoded_image = base64.b64encode(image_contents)
+        if fs:
+            image_contents = fs.read_bytes(real_path)
+        else:
+            with open(real_path, 'rb') as image_file:
+                image_contents = image_file.read()
     except IOError:
         return False
 
-    return u"data:%s;base64,%s" % (mime_type, encoded_image.decode())
+    return encode_data(mime_type, image_contents)
+
+
+def build_search_index(slides, presenter_notes=True,
+                       _tag_re=re.compile(r'<[^>]*>'), _word_re=re.compile(r'\w\w+', re.UNICODE)):
+    """ Builds an inverted index for the given slides: maps every lowercased
+        word found in the titles, contents and (optionally) presenter notes to
+        the sorted list of slide numbers it appears in.
+    """
+    fields = ('title', 'content', 'presenter_notes') if presenter_notes else ('title', 'content')
+    terms = {}
+    titles = {}
+    for slide in slides:
+        if not slide:
+            continue
+        number = slide['number']
+        titles[number] = unescape(_tag_re.sub('', slide.get('title') or ''))
+        text = ' '.join(slide.get(field) or '' for field in fields)
+        for word in set(_word_re.findall(unescape(_tag_re.sub(' ', text)).lower())):
+            terms.setdefault(word, []).append(number)
+    for numbers in terms.values():
+        numbers.sort()
+    return {'terms': terms, 'titles': titles}
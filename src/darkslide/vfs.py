@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""File access used by the generator for presentation sources and assets.
+
+The theme is always read from disk; everything else goes through one of these,
+so presentations can be rendered from in-memory files without touching the
+filesystem.
+"""
+import codecs
+import os
+
+from six import text_type
+
+from .utils import scandir
+
+
+class OSFileSystem(object):
+    """Reads files from disk."""
+
+    exists = staticmethod(os.path.exists)
+    isdir = staticmethod(os.path.isdir)
+
+    def listdir(self, path):
+        return sorted(os.listdir(path))
+
+    def entries(self, path):
+        """ Returns the sorted ``(name, is_dir)`` of the entries of a directory
+            (types come from the directory listing, without a stat per entry).
+        """
+        return sorted((entry.name, entry.is_dir()) for entry in scandir(path))
+
+    def read_bytes(self, path):
+        with open(path, 'rb') as fh:
+            return fh.read()
+
+    def read_text(self, path, encoding):
+        with codecs.open(path, encoding=encoding) as fh:
+            return fh.read()
+
+
+class MemoryFileSystem(object):
+    """Serves files from a ``{path: contents}`` mapping, contents being text
+    (sources, stylesheets) or bytes (images and other assets). Directories are
+    implied by the paths.
+    """
+
+    def __init__(self, files):
+        self.files = dict((self.normpath(path), contents) for path, contents in files.items())
+        self.dirs = set()
+        for path in self.files:
+            while path:
+                path = os.path.dirname(path)
+                self.dirs.add(path or '.')
+
+    @staticmethod
+    def normpath(path):
+        return os.path.normpath(path).lstrip(os.sep) or '.'
+
+    def exists(self, path):
+        path = self.normpath(path)
+        return path in self.files or path in self.dirs
+
+    def isdir(self, path):
+        return self.normpath(path) in self.dirs
+
+    def listdir(self, path):
+        path = self.normpath(path)
+        prefix = '' if path == '.' else path + os.sep
+        return sorted(set(
+            entry[len(prefix):].split(os.sep, 1)[0]
+            for entry in self.files if entry.startswith(prefix)
+        ))
+
+    def entries(self, path):
+        return [(name, self.isdir(os.path.join(path, name))) for name in self.listdir(path)]
+
+    def read_bytes(self, path):
+        try:
+            contents = self.files[self.normpath(path)]
+        except KeyError:
+            raise IOError(u"No such file: %s" % path)
+        return contents.encode('utf-8') if isinstance(contents, text_type) else contents
+
+    def read_text(self, path, encoding):
+        try:
+            contents = self.files[self.normpath(path)]
+        except KeyError:
+            raise IOError(u"No such file: %s" % path)
+        return contents if isinstance(contents, text_type) else contents.decode(encoding)
@@ -1,20 +1,52 @@
+import os
 import sys
 import time
 
+from .parser import SUPPORTED_EXTENSIONS
+from .utils import scandir
+
 try:
     from watchdog.observers import Observer
-    from watchdog.events import FileSystemEventHandler, DirModifiedEvent
+    from watchdog.events import FileSystemEventHandler
 except ImportError:
-    print('Error: The watchdog module must be installed to use the -w option')
-    print('Exiting...')
-    sys.exit(1)
+    # only the native backend needs it
+    Observer = None
+    FileSystemEventHandler = object
+
+# builds open and close the files they read: only changes may trigger one
+CHANGE_EVENTS = ('modified', 'created', 'deleted', 'moved')
+WATCH_BACKENDS = ('native', 'poll')
+
+
+def watch(watch_dir, generate_func, dependencies_func=None):
+    """ Watches ``watch_dir`` and the files returned by ``dependencies_func``
+        (the files read by the last build), calling ``generate_func`` with the
+        set of changed paths when one of them changes or when a source file is
+        added to or removed from ``watch_dir``.
+    """
+    watch_decks([WatchedDeck(watch_dir, generate_func, dependencies_func)])
 
 
-def watch(watch_dir, generate_func):
-    event_handler = LandslideEventHandler(generate_func)
+def watch_decks(decks, backend='native'):
+    """ Watches several presentations (:class:`WatchedDeck`) with a single
+        observer, regenerating only the ones affected by a change. The
+        ``poll`` backend uses a :class:`StatPoller` instead of watchdog.
+    """
+    if backend not in WATCH_BACKENDS:
+        raise ValueError(u"Invalid watch backend %s, expected one of: %s" % (backend, ', '.join(WATCH_BACKENDS)))
+    if backend == 'poll':
+        return StatPoller(LandslideEventHandler(decks=decks)).run()
+    if Observer is None:
+        print('Error: The watchdog module must be installed to use the -w option (or use --watch-backend=poll)')
+        print('Exiting...')
+        sys.exit(1)
+
     observer = Observer()
+    event_handler = LandslideEventHandler(observer=observer, decks=decks)
 
-    observer.schedule(event_handler, path=watch_dir, recursive=True)
+    for watch_dir in event_handler.watch_dirs():
+        observer.schedule(event_handler, path=watch_dir, recursive=True)
+    event_handler.schedule_dependencies()
     observer.start()
 
     try:
@@ -26,12 +58,202 @@ def watch(watch_dir, generate_func):
     observer.join()
 
 
+def in_dir(path, directory):
+    return bool(directory) and (path + os.sep).startswith(directory + os.sep)
+
+
+def stat_signature(path):
+    """ Returns the ``(mtime, size, inode)`` of a file, ``None`` if it doesn't
+        exist.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime, stat.st_size, stat.st_ino
+
+
+class WatchedDeck(object):
+    """A presentation being watched: the directory of its sources, the function
+    regenerating it and the one returning the files its last build read.
+    """
+
+    def __init__(self, watch_dir, generate_func, dependencies_func=None):
+        self.watch_dir = watch_dir and os.path.abspath(watch_dir)
+        self.generate_func = generate_func
+        self.dependencies_func = dependencies_func or set
+
+    def changed(self, paths, event_type):
+        """ Returns the paths (from the ones of a filesystem event) the deck
+            must be regenerated for.
+        """
+        changed = paths & set(self.dependencies_func())
+        if not changed and event_type in ('created', 'deleted', 'moved'):
+            # new or removed slides
+            changed = set(path for path in paths if path.endswith(SUPPORTED_EXTENSIONS) and in_dir(path, self.watch_dir))
+        return changed
+
+
 class LandslideEventHandler(FileSystemEventHandler):
-    def __init__(self, generate_func):
+    def __init__(self, generate_func=None, watch_dir=None, observer=None, dependencies_func=None, decks=()):
         super(LandslideEventHandler, self).__init__()
 
-        self.generate_func = generate_func
+        self.decks = list(decks)
+        if generate_func:
+            self.decks.append(WatchedDeck(watch_dir, generate_func, dependencies_func))
+        self.observer = observer
+        self.watched_dirs = set()
+
+    def watch_dirs(self):
+        """ The source directories of the decks, leaving out the ones inside
+            another (directories are watched recursively).
+        """
+        watch_dirs = []
+        for directory in sorted(set(deck.watch_dir for deck in self.decks if deck.watch_dir)):
+            if not any(in_dir(directory, watch_dir) for watch_dir in watch_dirs):
+                watch_dirs.append(directory)
+        return watch_dirs
+
+    def dependencies(self):
+        """ The files read by the last build of any of the decks.
+        """
+        return set().union(*(deck.dependencies_func() for deck in self.decks))
+
+    def schedule_dependencies(self):
+        """ Also watches the directories of dependencies outside of the watched
+            directories (eg: images or stylesheets from elsewhere).
+        """
+        watch_dirs = self.watch_dirs()
+        for path in self.dependencies():
+            directory = os.path.dirname(path)
+            if directory in self.watched_dirs or any(in_dir(directory, watch_dir) for watch_dir in watch_dirs):
+                continue
+            if os.path.isdir(directory):
+                self.observer.schedule(self, path=directory, recursive=False)
+                self.watched_dirs.add(directory)
+
+    def dispatch_changes(self, changes):
+        """ Regenerates (once) each deck affected by the given ``(paths,
+            event_type)`` changes. Returns whether any deck was regenerated.
+        """
+        generated = False
+        for deck in self.decks:
+            changed = set()
+            for paths, event_type in changes:
+                changed |= deck.changed(paths, event_type)
+            if changed:
+                deck.generate_func(changed)
+                generated = True
+        if generated and self.observer:
+            self.schedule_dependencies()
+        return generated
+
+    def on_any_event(self, event):
+        if event.is_directory or event.event_type not in CHANGE_EVENTS:
+            return
+        paths = set(os.path.abspath(path) for path in (event.src_path, getattr(event, 'dest_path', None)) if path)
+        self.dispatch_changes([(paths, event.event_type)])
+
+
+class StatPoller(object):
+    """Polls for the changes of the decks of an event handler, for filesystems
+    where native events are unreliable (eg: NFS or bind mounts).
+
+    It keeps an index of the signature (mtime, size, inode) of the files the
+    decks depend on, and of the directories of their sources. Each poll
+    stats these files and directories, and only lists again (with
+    ``scandir``) the directories whose signature changed, looking for added
+    or removed source files. Hidden directories are left out. The polling
+    interval grows while nothing changes, up to ``max_interval``.
+    """
+
+    def __init__(self, handler, min_interval=0.25, max_interval=2.0, backoff=1.5):
+        self.handler = handler
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.interval = min_interval
+        self.files = dict((path, stat_signature(path)) for path in handler.dependencies())
+        self.dirs = {}
+        for watch_dir in handler.watch_dirs():
+            self.scan_dir(watch_dir)
+
+    def run(self):
+        try:
+            while True:
+                time.sleep(self.interval)
+                self.step()
+        except KeyboardInterrupt:
+            pass
+
+    def step(self):
+        """ Polls once, regenerating the affected decks, and adjusts the
+            polling interval. Returns the changes found.
+        """
+        changes = self.poll()
+        if changes and self.handler.dispatch_changes(changes):
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.interval * self.backoff, self.max_interval)
+        return changes
+
+    def poll(self):
+        """ Returns the changes since the previous poll, as ``(paths,
+            event_type)`` tuples.
+        """
+        changes = {'created': set(), 'deleted': set(), 'modified': set()}
+        files = {}
+        for path in self.handler.dependencies():
+            signature = files[path] = stat_signature(path)
+            if path not in self.files:
+                # a new dependency, read by the last build
+                continue
+            previous = self.files[path]
+            if signature != previous:
+                changes['deleted' if signature is None else 'created' if previous is None else 'modified'].add(path)
+        self.files = files
+        for directory in list(self.dirs):
+            if directory not in self.dirs:
+                continue
+            signature = stat_signature(directory)
+            if signature is None:
+                self.drop_dir(directory, changes)
+            elif signature != self.dirs[directory][0]:
+                self.scan_dir(directory, changes)
+        return [(paths, event_type) for event_type, paths in sorted(changes.items()) if paths]
+
+    def scan_dir(self, directory, changes=None):
+        """ Lists a directory and its new subdirectories, recording the source
+            files added or removed since the previous listing in ``changes``.
+        """
+        signature = stat_signature(directory)
+        try:
+            entries = list(scandir(directory))
+        except OSError:
+            return self.drop_dir(directory, changes)
+        sources = set()
+        subdirs = set()
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                if not entry.name.startswith('.'):
+                    subdirs.add(entry.path)
+            elif entry.name.endswith(SUPPORTED_EXTENSIONS):
+                sources.add(entry.path)
+        previous_sources, previous_subdirs = self.dirs.get(directory, (None, set(), set()))[1:]
+        self.dirs[directory] = signature, sources, subdirs
+        if changes is not None:
+            changes['created'].update(sources - previous_sources)
+            changes['deleted'].update(previous_sources - sources)
+        for subdir in previous_subdirs - subdirs:
+            self.drop_dir(subdir, changes)
+        for subdir in subdirs - previous_subdirs:
+            self.scan_dir(subdir, changes)
 
-    def on_modified(self, event):
-        if isinstance(event, DirModifiedEvent):
-            self.generate_func()
+    def drop_dir(self, directory, changes=None):
+        """ Forgets a directory that went away, and its subdirectories.
+        """
+        signature, sources, subdirs = self.dirs.pop(directory, (None, set(), set()))
+        if changes is not None:
+            changes['deleted'].update(sources)
+        for subdir in subdirs:
+            self.drop_dir(subdir, changes)
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""Cost of guessing the language of the code blocks (``--guess-lang``) on a
+large deck: rendering it with the language of its code blocks given, then
+guessed with a cold and a warm cache of the guesses, and pygments' own
+``guess_lexer`` (every lexer, whole blocks) for comparison. Not collected by pytest, run it with::
+
+    python tests/bench_guess_lang.py [slides]
+"""
+import sys
+import time
+
+from pygments.lexers import guess_lexer
+
+from darkslide import macro
+from darkslide import scanner
+from darkslide.generator import render_string
+from darkslide.parser import Parser
+
+SNIPPETS = [
+    "def fetch(url, retries=3):\n    for attempt in range(retries):\n        try:\n"
+    "            return urlopen(url).read()\n        except IOError as exc:\n            log(exc)\n",
+    "function debounce(fn, wait) {\n  var timer = null;\n  return function () {\n"
+    "    clearTimeout(timer);\n    timer = setTimeout(fn, wait);\n  };\n}\n",
+    "#!/bin/bash\nfor file in *.md; do\n  darkslide \"$file\" -d \"${file%.md}.html\"\ndone\n",
+    "SELECT slides.title, COUNT(*) AS views\nFROM slides JOIN views ON views.slide_id = slides.id\n"
+    "GROUP BY slides.title ORDER BY views DESC;\n",
+]
+LANGS = ['python', 'javascript', 'bash', 'sql']
+CANDIDATES = ','.join(LANGS)
+
+
+def make_deck(slides, explicit=False):
+    chunks = []
+    for number in range(slides):
+        # a block found on many slides (the guess is cached) and one unique
+        # to the slide
+        code = SNIPPETS[number % len(SNIPPETS)]
+        unique = code.replace('\n', ' ' * (number % 97 + 1) + '\n', 1)
+        if explicit:
+            code, unique = ('!%s\n%s' % (LANGS[number % len(LANGS)], block) for block in (code, unique))
+        chunks.append('# Slide %d\n\n%s\n\nand\n\n%s' % (number, indent(code), indent(unique)))
+    return '\n\n---\n\n'.join(chunks)
+
+
+def indent(code):
+    return '\n'.join('    ' + line for line in code.splitlines())
+
+
+def timed(label, function, *args, **kwargs):
+    """ Prints and returns the best time of 3 runs of a function. """
+    elapsed = []
+    for _ in range(3):
+        started = time.time()
+        function(*args, **kwargs)
+        elapsed.append(time.time() - started)
+    print('%-36s %8.3fs' % (label, min(elapsed)))
+    return min(elapsed)
+
+
+def guess_all(blocks, cold):
+    for code in blocks:
+        if cold:
+            macro._guesses.clear()
+        macro.guess_lang(code, LANGS)
+
+
+def main(slides=1000):
+    text = make_deck(slides)
+    blocks = [block.code for block in scanner.find_code_blocks(Parser('.md').parse(text))]
+    print('%d slides, %d code blocks, candidates: %s' % (slides, len(blocks), CANDIDATES))
+    # loads the lexers and the template
+    render_string(make_deck(len(LANGS), explicit=True))
+    given = timed('render, languages given', render_string, make_deck(slides, explicit=True), linenos='no')
+    guessed = timed('render, languages guessed', render_string, text, linenos='no', guess_lang=CANDIDATES)
+    print('rendering overhead: %.1f%%' % (100.0 * (guessed - given) / given))
+    cold = timed('guessing only, no cache', guess_all, blocks, True)
+    warm = timed('guessing only, cached', guess_all, blocks, False)
+    print('per block: %.3fms, %.3fms cached' % (1000.0 * cold / len(blocks), 1000.0 * warm / len(blocks)))
+    sample = blocks[:50]
+    elapsed = timed('pygments guess_lexer (%d blocks)' % len(sample), lambda: [guess_lexer(code) for code in sample])
+    print('pygments guess_lexer per block: %.3fms' % (1000.0 * elapsed / len(sample)))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
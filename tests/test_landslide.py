@@ -1,14 +1,38 @@
 # -*- coding: utf-8 -*-
 import base64
 import codecs
+import io
+import json
 import os
+import random
 import re
-
+import shutil
+import struct
+import threading
+import time
+import zipfile
+from multiprocessing.pool import ThreadPool
+
+import pytest
 from pytest import raises
-
+from six.moves import BaseHTTPServer
+from six.moves import socketserver
+from six.moves.urllib.error import HTTPError
+from six.moves.urllib.request import urlopen
+
+from darkslide import critical
+from darkslide import generator
+from darkslide import images
 from darkslide import macro
+from darkslide import minify
+from darkslide import scanner
+from darkslide import utils
 from darkslide.generator import Generator
+from darkslide.model import Deck
+from darkslide.model import Slide
 from darkslide.parser import Parser
+from darkslide.remote import RemoteFetcher
+from darkslide.server import RenderServer
 
 DATA_DIR = os.path.join(os.path.dirname(__file__), 'test-data')
 
@@ -37,6 +61,35 @@ def test_add_user_assets():
     assert g.user_js[0]['contents'] == "alert('foo');"
 
 
+def test_theme_asset_cache(tmpdir):
+    theme_dir = tmpdir.mkdir('theme')
+    theme_dir.mkdir('css').join('theme.css').write('body {color: red;}')
+    g = Generator(os.path.join(DATA_DIR, 'test.md'), theme=str(theme_dir))
+    css = g.get_css()
+    assert css['theme']['contents'] == 'body {color: red;}'
+    assert css['base']['path_url'].endswith(os.path.join('default', 'css', 'base.css'))
+
+    hits = generator._theme_contents.hits
+    g = Generator(os.path.join(DATA_DIR, 'test.md'), theme=str(theme_dir))
+    assert g.get_css()['theme']['contents'] == 'body {color: red;}'
+    assert generator._theme_contents.hits == hits + len(generator.THEME_CSS)
+
+    theme_css = theme_dir.join('css', 'theme.css')
+    mtime = theme_css.mtime()
+    theme_css.write('body {color: tan;}')
+    os.utime(str(theme_css), (mtime + 10, mtime + 10))
+    assert g.get_css()['theme']['contents'] == 'body {color: tan;}'
+
+    # removed overrides fall back to the default theme, new ones get picked up
+    css_dir_mtime = theme_dir.join('css').mtime()
+    theme_css.remove()
+    os.utime(str(theme_dir.join('css')), (css_dir_mtime, css_dir_mtime))
+    assert g.get_css()['theme']['path_url'].endswith(os.path.join('default', 'css', 'theme.css'))
+    theme_dir.join('css', 'base.css').write('body {margin: 0;}')
+    os.utime(str(theme_dir.join('css')), (mtime + 20, mtime + 20))
+    assert g.get_css()['base']['contents'] == 'body {margin: 0;}'
+
+
 def test_get_toc():
     base_dir = os.path.join(DATA_DIR, 'test.md')
     g = Generator(base_dir, logger=logtest)
@@ -57,6 +110,25 @@ def test_get_toc():
     assert len(toc[2]['sub']) == 0
 
 
+def test_slide_model():
+    slide = Slide('<h1>A</h1>', '<p>a</p>', ['slide-content'], 1, 'A', 'deck/a.md')
+    assert not hasattr(slide, '__dict__')
+    assert slide['title'] == slide.title == 'A'
+    assert slide.source == {'rel_path': 'deck/a.md', 'abs_path': os.path.abspath('deck/a.md')}
+    slide['custom'] = 'value'
+    assert slide.custom == slide['custom'] == slide.extra['custom'] == 'value'
+    assert slide.get('missing') is None
+    raises(KeyError, lambda: slide['missing'])
+
+    deck = Deck()
+    deck.add_toc_entry('A', 1, 1)
+    toc = deck.toc
+    assert deck.toc is toc
+    deck.add_toc_entry('A.1', 2, 2)
+    assert deck.toc is not toc
+    assert deck.toc[0]['sub'][0].title == 'A.1'
+
+
 def test_get_slide_vars():
     g = Generator(os.path.join(DATA_DIR, 'test.md'))
     svars = g.get_slide_vars("<h1>heading</h1>\n<p>foo</p>\n<p>bar</p>\n", '')
@@ -118,6 +190,482 @@ def test_get_template_vars():
     assert svars['head_title'] == 'slide1'
 
 
+def test_minify():
+    assert minify.minify_css("a :hover , b > c {\n  color : red ; /* x */\n  content: ' a  ;b' ;\n}") == \
+        "a :hover,b>c{color :red;content:' a  ;b'}"
+    assert minify.minify_js("var a = b / c; // x\n  var r = /[/*]/g, s = 'x // y'; /* c\n */ f()") == \
+        "var a = b / c;\nvar r = /[/*]/g, s = 'x // y';\nf()"
+    assert minify.minify_html("<p>a   b</p>\n\n  <!-- c -->\n<pre>  x\n\n y</pre>") == "<p>a b</p>\n<pre>  x\n\n y</pre>"
+
+    hits = generator._minified_contents.hits
+    g = Generator(os.path.join(DATA_DIR, 'test.md'), embed=True, minify=True)
+    html = g.render()
+    assert len(html) < len(Generator(os.path.join(DATA_DIR, 'test.md'), embed=True).render())
+    assert '<!-- slide source' not in html
+    assert len(re.findall('<pre><span', html)) == 3
+    Generator(os.path.join(DATA_DIR, 'test.md'), embed=True, minify=True).render()
+    assert generator._minified_contents.hits > hits
+
+
+def test_size_report():
+    assert utils.parse_size('300M') == 300 * 1024 ** 2
+    assert utils.parse_size('1.5 GB') == 3 * 1024 ** 3 // 2
+    assert utils.parse_size('512') == 512
+    assert utils.parse_size(None) is None
+    raises(ValueError, utils.parse_size, '12 parsecs')
+    assert utils.format_size(512) == '512 B'
+    assert utils.format_size(1536) == '1.5 KiB'
+
+    messages = []
+
+    def logger(message, type='notice'):
+        messages.append((type, message))
+
+    source = os.path.join(DATA_DIR, 'test.md')
+    g = Generator(source, embed=True, size_report=True, max_size='10M', logger=logger, verbose=True)
+    html = g.render()
+    report = g.deck.report
+    assert report.total == len(html.encode('utf-8'))
+    assert report.slides[0][0] == '#1 Title Slide'
+    assert [name for name, size in report.assets] == ['img.png']
+    assert len(report.code) == 3
+    assert 'slides.js' in dict(report.files)
+    assert ('notice', 'Size report: %s' % utils.format_size(report.total)) in messages
+    assert not any(type == 'warning' for type, message in messages)
+
+    with raises(RuntimeError) as exc:
+        Generator(source, embed=True, max_size=1000, max_asset_size='1k').render()
+    assert 'over the 1000 B budget' in str(exc.value)
+    assert 'img.png is' in str(exc.value)
+
+    del messages[:]
+    Generator(source, embed=True, max_asset_size='1k', size_budget='warn', logger=logger, verbose=True).render()
+    assert ('warning', 'Size budget exceeded: theme.css is %s, over the 1.0 KiB budget per asset'
+            % utils.format_size(len(Generator(source).get_css()['theme']['contents']))) in messages
+    raises(ValueError, Generator, source, size_budget='explode')
+
+
+def test_lazy_images(tmpdir):
+    exif = b'Exif\x00\x00MM\x00\x2a\x00\x00\x00\x08\x00\x01\x01\x12\x00\x03\x00\x00\x00\x01\x00\x06\x00\x00'
+    jpeg = (b'\xff\xd8\xff\xe1' + struct.pack('>H', len(exif) + 2) + exif +
+            b'\xff\xc0\x00\x11\x08\x00\x20\x00\x40' + b'\x00' * 10)
+    assert images.read_size(io.BytesIO(jpeg)) == (32, 64)
+    assert images.read_size(io.BytesIO(b'GIF89a\x05\x00\x03\x00')) == (5, 3)
+    assert images.read_size(io.BytesIO(b'<svg viewBox="0 0 200 100" height="50">')) == (100, 50)
+    assert images.read_size(io.BytesIO(b'<svg width="100%" height="100%">')) is None
+    assert images.read_size(io.BytesIO(b'\xff\xd8\xff')) is None
+
+    shutil.copy(os.path.join(DATA_DIR, 'img.png'), str(tmpdir))
+    tmpdir.join('slides.md').write('\n\n---\n\n'.join(
+        '# Slide %d\n\n![img](img.png)' % number for number in range(3)))
+    g = Generator(str(tmpdir.join('slides.md')), lazy_images=1)
+    html = g.render()
+    assert html.count('width="1" height="1"') == 3
+    assert html.count('<img loading="lazy" decoding="async"') == 0
+    assert html.count(' width="1" height="1" loading="lazy" decoding="async" />') == 2
+    # the slides are kept as they were processed
+    assert 'loading' not in g.fetch_contents(g.source, g.work_dir)[2].content
+    assert 'height="1"' not in Generator(str(tmpdir.join('slides.md'))).render()
+    assert 'loading' not in Generator(str(tmpdir.join('slides.md')), lazy_images=1, embed=True).render()
+    # the sizes are read once, until the files change
+    misses = images._sizes.misses
+    Generator(str(tmpdir.join('slides.md')), lazy_images=0).render()
+    assert images._sizes.misses == misses
+
+    assert images.defer_loading('<img src="a.png" loading="eager"/>') == \
+        '<img src="a.png" loading="eager" decoding="async"/>'
+
+
+def test_manifest(tmpdir):
+    tmpdir.join('slides').mkdir()
+    tmpdir.join('slides', '1.md').write('# One')
+    tmpdir.join('style.css').write('.a {}')
+    tmpdir.join('deck.cfg').write('[darkslide]\nsource = slides\ncss = style.css\n')
+    destination = str(tmpdir.join('deck.html'))
+    messages = []
+
+    def build(**kwargs):
+        g = Generator(str(tmpdir.join('deck.cfg')), destination_file=destination, verbose=True,
+                      logger=lambda message, type='notice': messages.append(message), **kwargs)
+        del messages[:]
+        g.write_and_log()
+        return g
+
+    build()
+    assert os.path.exists(destination + '.manifest.json')
+    g = build()
+    assert messages[-1] == 'Up to date: %s' % destination
+    assert g.manifest_changes() == []
+    assert build(force=True).num_slides == 1
+    assert messages[-1] == 'Generated file: %s' % destination
+
+    tmpdir.join('style.css').write('.b {}')
+    assert g.manifest_changes() == ['%s changed' % tmpdir.join('style.css')]
+    tmpdir.join('slides', '2.md').write('# Two')
+    assert 'source files changed' in g.manifest_changes()
+    assert Generator(str(tmpdir.join('deck.cfg')), destination_file=destination, embed=True).manifest_changes()[0] == \
+        'option embed changed'
+    assert build().num_slides == 2
+    assert g.manifest_changes() == []
+    tmpdir.join('deck.cfg').write('[darkslide]\nsource = slides/1.md\n')
+    assert '%s changed' % tmpdir.join('deck.cfg') in g.manifest_changes()
+
+
+def test_embed_max_bytes(tmpdir):
+    shutil.copy(os.path.join(DATA_DIR, 'img.png'), str(tmpdir))
+    tmpdir.join('big image.png').write_binary(b'\x89PNG' + b'x' * 5000)
+    tmpdir.join('font.woff2').write_binary(b'w' * 5000)
+    tmpdir.join('style.css').write("@font-face { font-family: 'A'; src: url('font.woff2'); }")
+    tmpdir.join('slides.md').write('# One\n\n![small](img.png)\n\n![big](big%20image.png)')
+    tmpdir.join('deck.cfg').write('[darkslide]\nsource = slides.md\ncss = style.css\nembed = true\n'
+                                  'embed-max-bytes = 4k\ndestination = %s\n' % tmpdir.join('deck.html'))
+    messages = []
+    g = Generator(str(tmpdir.join('deck.cfg')), verbose=True,
+                  logger=lambda message, type='notice': messages.append(message))
+    html = g.render()
+    assert 'src="data:image/png;base64,' in html
+    images = re.findall(r'src="(deck-assets/[0-9a-f]{12}-big%20image.png)"', html)
+    assert len(images) == 1
+    assert tmpdir.join(utils.unescape(images[0]).replace('%20', ' ')).read_binary() == b'\x89PNG' + b'x' * 5000
+    assert re.search(r"url\('deck-assets/[0-9a-f]{12}-font.woff2'\)", html)
+    assert 'Embedded 1 assets of at most 4.0 KiB, copied 2 larger ones to %s' % tmpdir.join('deck-assets') in messages
+    assert '  big%20image.png (4.9 KiB)' in messages
+    assert g.render() == html
+    assert 'deck-assets' not in Generator(str(tmpdir.join('slides.md')), embed=True).render()
+
+
+def test_variants(tmpdir):
+    shutil.copy(os.path.join(DATA_DIR, 'img.png'), str(tmpdir))
+    tmpdir.join('slides.md').write('# One\n\n.footer: ![f](img.png)\n\n![img](img.png)\n\n.notes: ![n](img.png)\n\n'
+                                   '    !python\n    x = 1\n\n# Presenter Notes\n\nsecret\n\n---\n\n# Two')
+    tmpdir.join('deck.cfg').write('[darkslide]\nsource = slides.md\ndestination = %s\n'
+                                  '[variants]\nembedded = destination=%s embed=yes\n'
+                                  'public = destination=%s presenter_notes=off lazy-images=1\n'
+                                  % tuple(tmpdir.join(name) for name in ('deck.html', 'embedded.html', 'public.html')))
+    messages = []
+    g = Generator(str(tmpdir.join('deck.cfg')), verbose=True,
+                  logger=lambda message, type='notice': messages.append(message))
+    g.write_and_log()
+    assert len([message for message in messages if message.startswith('Adding')]) == 1
+    for name, kwargs in (('deck.html', {}), ('embedded.html', {'embed': True}),
+                         ('public.html', {'presenter_notes': False, 'lazy_images': 1})):
+        expected = Generator(str(tmpdir.join('slides.md')), destination_file=str(tmpdir.join(name)), **kwargs).render()
+        assert tmpdir.join(name).read() == expected
+    assert 'secret' not in tmpdir.join('public.html').read()
+    assert 'data:image/png;base64' in tmpdir.join('embedded.html').read()
+    assert g.manifest_changes() == []
+    tmpdir.join('public.html').remove()
+    assert g.manifest_changes() == ['%s is missing' % tmpdir.join('public.html')]
+
+    with raises(RuntimeError):
+        Generator('deck.cfg', files={'deck.cfg': '[darkslide]\nsource = s.md\n[variants]\na = embed=yes\n', 's.md': ''})
+    with raises(ValueError):
+        Generator(str(tmpdir.join('slides.md')), variants=[{'destination_file': 'a.html', 'linenos': 'no'}])
+
+
+def test_critical_css(tmpdir):
+    shutil.copy(os.path.join(DATA_DIR, 'img.png'), str(tmpdir))
+    tmpdir.join('slides.md').write('# One\n\n![img](img.png)\n\n---\n\n# Two\n\n![two](two.png)\n\n| a |\n|---|\n| b |')
+    tmpdir.join('style.css').write(
+        "@font-face { font-family: 'Sans'; src: url('font.woff2') format('woff2'), url(font.eot); }\n"
+        "/* comment */ .slide h1, td.unused { background: url(img.png); }\n"
+        "@media print { .slide { color: #123456; } }\n@media (max-width: 100px) { section:hover { margin: 0 } }\n"
+        ".missing { color: red; } .slide:not(.missing) > [data-a='{']::before { content: '}' }")
+    tmpdir.join('deck.cfg').write('[darkslide]\nsource = slides.md\ncss = style.css\ncritical_css = true\n')
+    html = Generator(str(tmpdir.join('deck.cfg')), extensions='tables').render()
+    style = re.search(r'<style type="text/css">\s*(.*?)\s*</style>', html, re.DOTALL).group(1)
+    assert ".slide h1{background:url(file://%s)}" % tmpdir.join('img.png') in style
+    assert "@media (max-width:100px){section:hover{margin:0}}" in style
+    assert ".slide:not(.missing)>[data-a='{']::before{content:'}'}" in style
+    assert 'td.unused' not in style and '.missing{' not in style and '#123456' not in style
+    assert 'font-face' not in style and '@media screen,projection{' in style
+    assert '<link rel="preload" as="font" href="file://%s" type="font/woff2" crossorigin>' % tmpdir.join(
+        'font.woff2') in html
+    assert '<link rel="preload" as="image" href="file://%s">' % tmpdir.join('img.png') in html
+    assert 'two.png">' not in html
+    assert html.count('onload="this.onload=null;this.rel=\'stylesheet\'"') == 4
+
+    assert 'rel="preload"' not in Generator(str(tmpdir.join('deck.cfg')), embed=True).render()
+    assert critical.selector_tokens('ul li > a.b#c:hover:not(.d)') == set(['ul', 'li', 'a', '.b', '#c'])
+
+
+def test_bundle(tmpdir):
+    shutil.copy(os.path.join(DATA_DIR, 'img.png'), str(tmpdir))
+    tmpdir.join('slides.md').write('# Title\n\n![img](img.png)')
+    tmpdir.join('style.css').write(".a {background: url('img.png?v=1');}")
+    tmpdir.join('deck.cfg').write('[darkslide]\nsource = slides.md\ncss = style.css\n')
+    archive = str(tmpdir.join('deck.zip'))
+    Generator(str(tmpdir.join('deck.cfg')), bundle=archive, embed=True).execute()
+
+    with zipfile.ZipFile(archive) as bundle:
+        manifest = json.loads(bundle.read('manifest.json').decode('utf-8'))
+        html = bundle.read('index.html').decode('utf-8')
+        image = [name for name, entry in manifest['assets'].items() if entry['name'] == 'img.png']
+        css = [name for name, entry in manifest['assets'].items() if entry['name'] == 'style.css']
+        assert len(image) == len(css) == 1
+        assert sorted(bundle.namelist()) == sorted(list(manifest['assets']) + ['index.html', 'manifest.json'])
+        assert bundle.getinfo(image[0]).compress_type == zipfile.ZIP_STORED
+        assert 'file://' not in html
+        assert 'data:image' not in html
+        assert 'src="%s"' % image[0] in html
+        assert 'href="%s"' % css[0] in html
+        assert "url('%s?v=1')" % image[0].split('/')[-1] in bundle.read(css[0]).decode('utf-8')
+
+
+def test_search_index():
+    g = Generator(os.path.join(DATA_DIR, 'test.md'), search_index=True)
+    svars = g.get_template_vars([
+        {'title': "Hello <em>World</em>", 'level': 1, 'content': '<p>Foo &amp; bar</p>'},
+        {'title': "Second", 'level': 1, 'content': '<p>bar baz</p>', 'presenter_notes': '<p>secret</p>'},
+    ])
+    index = json.loads(svars['search_index'])
+    assert index['titles'] == {'1': 'Hello World', '2': 'Second'}
+    assert index['terms']['bar'] == [1, 2]
+    assert index['terms']['foo'] == [1]
+    assert index['terms']['secret'] == [2]
+    assert 'em' not in index['terms']
+    assert Generator(os.path.join(DATA_DIR, 'test.md')).get_template_vars([])['search_index'] is None
+
+    g = Generator(os.path.join(DATA_DIR, 'test.md'), search_index=True, presenter_notes=False)
+    svars = g.get_template_vars([
+        {'title': "&lt;!-- &lt;script&gt;", 'level': 1, 'content': '<p>foo</p>', 'presenter_notes': '<p>secret</p>'},
+    ])
+    assert 'secret' not in json.loads(svars['search_index'])['terms']
+    assert json.loads(svars['search_index'])['titles'] == {'1': '<!-- <script>'}
+    assert not re.search('[<>&]', svars['search_index'])
+
+
+def test_dependencies_rebuild(tmpdir):
+    deck = tmpdir.mkdir('deck')
+    deck.join('1.md').write('# One\n\n![img](img.png)')
+    deck.join('2.rst').write('Two\n===\n\n.. include:: ../shared.rst\n')
+    deck.join('img.png').write('')
+    tmpdir.join('shared.rst').write('Shared text')
+    messages = []
+    g = Generator(str(deck), destination_file=str(tmpdir.join('out.html')), verbose=True,
+                  logger=lambda message, type='notice': messages.append(message))
+    html = g.render()
+    assert 'Shared text' in html
+    assert set(str(path) for path in (deck.join('1.md'), deck.join('2.rst'), deck.join('img.png'),
+                                      tmpdir.join('shared.rst'))) <= g.dependencies
+    assert g.template_file in g.dependencies
+
+    tmpdir.join('shared.rst').write('Updated text')
+    del messages[:]
+    html = g.render(set([str(tmpdir.join('shared.rst'))]))
+    assert 'Updated text' in html
+    assert u"Reusing  %r" % str(deck.join('1.md')) in messages
+    assert not any(message.startswith(u"Reusing  %r" % str(deck.join('2.rst'))) for message in messages)
+    assert html.count('class="slide ') == 2
+
+
+def test_watcher_follows_dependencies(tmpdir):
+    events = pytest.importorskip('watchdog.events')
+    from darkslide.watcher import LandslideEventHandler
+
+    image = str(tmpdir.join('img.png'))
+    calls = []
+    handler = LandslideEventHandler(calls.append, str(tmpdir.mkdir('deck')), None, lambda: set([image]))
+    handler.dispatch(events.FileModifiedEvent(str(tmpdir.join('out.html'))))
+    handler.dispatch(events.FileModifiedEvent(str(tmpdir.join('deck', 'notes.txt'))))
+    assert calls == []
+    handler.dispatch(events.FileModifiedEvent(image))
+    handler.dispatch(events.FileCreatedEvent(str(tmpdir.join('deck', 'new.md'))))
+    assert calls == [set([image]), set([str(tmpdir.join('deck', 'new.md'))])]
+
+
+def test_watcher_routes_events_to_decks(tmpdir):
+    events = pytest.importorskip('watchdog.events')
+    from darkslide.watcher import LandslideEventHandler
+    from darkslide.watcher import WatchedDeck
+
+    calls = []
+    shared = str(tmpdir.join('shared.css'))
+    decks = [WatchedDeck(str(tmpdir.mkdir(name)), lambda changed, name=name: calls.append((name, changed)),
+                         lambda name=name: set([shared, str(tmpdir.join(name, 'slides.md'))]))
+             for name in ('a', 'b')]
+    decks.append(WatchedDeck(str(tmpdir.join('a', 'nested')), lambda changed: calls.append(('nested', changed))))
+    handler = LandslideEventHandler(decks=decks)
+    assert handler.watch_dirs() == [str(tmpdir.join('a')), str(tmpdir.join('b'))]
+
+    handler.dispatch(events.FileOpenedEvent(str(tmpdir.join('a', 'slides.md'))))
+    assert calls == []
+    handler.dispatch(events.FileModifiedEvent(str(tmpdir.join('a', 'slides.md'))))
+    assert calls == [('a', set([str(tmpdir.join('a', 'slides.md'))]))]
+    del calls[:]
+    handler.dispatch(events.FileModifiedEvent(shared))
+    assert calls == [('a', set([shared])), ('b', set([shared]))]
+    del calls[:]
+    handler.dispatch(events.FileCreatedEvent(str(tmpdir.join('a', 'nested', 'new.rst'))))
+    assert [name for name, changed in calls] == ['a', 'nested']
+
+
+def test_stat_poller(tmpdir):
+    from darkslide.watcher import LandslideEventHandler
+    from darkslide.watcher import StatPoller
+    from darkslide.watcher import WatchedDeck
+
+    deck = tmpdir.mkdir('deck')
+    slides = deck.join('a.md')
+    slides.write('# A')
+    image = tmpdir.join('img.png')
+    image.write('png')
+    calls = []
+    handler = LandslideEventHandler(decks=[WatchedDeck(str(deck), calls.append, lambda: set([str(slides), str(image)]))])
+    poller = StatPoller(handler, min_interval=0.1, max_interval=0.4, backoff=2)
+
+    assert poller.step() == []
+    assert poller.interval == 0.2
+    image.write('bigger png')
+    assert poller.step() == [(set([str(image)]), 'modified')]
+    assert calls == [set([str(image)])]
+    assert poller.interval == 0.1
+
+    deck.join('notes.txt').write('not a source')
+    deck.mkdir('more').join('b.rst').write('B\n=')
+    deck.mkdir('.git').join('c.md').write('# C')
+    assert poller.step() == [(set([str(deck.join('more', 'b.rst'))]), 'created')]
+    slides.remove()
+    assert poller.step() == [(set([str(slides)]), 'deleted')]
+    deck.join('more').remove()
+    assert poller.step() == [(set([str(deck.join('more', 'b.rst'))]), 'deleted')]
+    assert len(calls) == 4
+    for _ in range(3):
+        assert poller.step() == []
+    assert poller.interval == 0.4
+
+
+def test_execute_all_checks_destinations(tmpdir):
+    for name in ('a', 'b'):
+        tmpdir.join(name + '.md').write('# %s' % name)
+    generators = [Generator(str(tmpdir.join(name + '.md')), destination_file=str(tmpdir.join('out.html')))
+                  for name in ('a', 'b')]
+    raises(IOError, generator.execute_all, generators)
+    assert not tmpdir.join('out.html').check()
+    generators[1].destination_file = str(tmpdir.join('b.html'))
+    generator.execute_all(generators)
+    assert '<h1>a</h1>' in tmpdir.join('out.html').read()
+    assert '<h1>b</h1>' in tmpdir.join('b.html').read()
+
+
+def test_concurrent_renders(tmpdir):
+    generators = []
+    for number, linenos in enumerate(('inline', 'table', 'no')):
+        deck = tmpdir.mkdir('deck%d' % number)
+        deck.join('1.md').write('# Deck %d\n\n.footer: footer %d\n\n---\n\n## Code\n\n    !python\n'
+                                '    print(%d)\n' % (number, number, number))
+        slides = ['## Slide %d.%d\n\ntext' % (number, slide) for slide in range(10 * (number + 1))]
+        deck.join('2.md').write('\n\n---\n\n'.join(slides))
+        generators.append(Generator(str(deck), linenos=linenos, search_index=number == 1))
+    expected = [g.render() for g in generators]
+    assert 'footer 0' in expected[0] and 'footer 0' not in expected[1]
+    assert [g.num_slides for g in generators] == [12, 22, 32]
+
+    def render(number):
+        g = generators[number % len(generators)]
+        return g.render(set() if number % 5 == 0 else None), g.num_slides
+
+    workers = ThreadPool(8)
+    try:
+        results = workers.map(render, range(60))
+    finally:
+        workers.close()
+        workers.join()
+    for number, (html, num_slides) in enumerate(results):
+        assert html == expected[number % len(generators)]
+        assert num_slides == generators[number % len(generators)].num_slides
+    assert generators[2].macros[0].options['linenos'] == 'no'
+
+
+def test_slide_fragment_cache(tmpdir):
+    tmpdir.join('a.md').write('# One\n\n---\n\n# Two')
+    tmpdir.join('b.md').write('# Three')
+    messages = []
+    g = Generator(str(tmpdir), verbose=True, logger=lambda message, type='notice': messages.append(message))
+    html = g.render()
+    assert u"Rendered 3 slides (0 reused)" in messages
+    tmpdir.join('b.md').write('# Four')
+    assert g.render(set([str(tmpdir.join('b.md'))])).replace('Four', 'Three') == html
+    assert u"Rendered 3 slides (2 reused)" in messages
+
+    theme = tmpdir.mkdir('theme')
+    theme.join('base.html').write('{% for slide in slides %}[{{ slide.title }}]{% endfor %}')
+    assert Generator(str(tmpdir.join('a.md')), theme=str(theme)).render() == '[One][Two]'
+
+
+def test_source_discovery(tmpdir):
+    for path in ('.git/a.md', 'node_modules/pkg/b.md', 'drafts/c.md', 'slides/1.md', 'slides/2.rst', 'slides/3.md',
+                 'slides/img.png', 'slides/.#1.md', 'slides/notes.txt'):
+        tmpdir.join(path).ensure().write('%s\n%s' % (path, '=' * len(path)) if path.endswith('.rst') else '# ' + path)
+    config = tmpdir.join('deck.cfg')
+    config.write('[darkslide]\nsource = .\ninclude = *.md\n  slides/*.rst\nexclude = node_modules drafts\n  3.md\n')
+    g = Generator(str(config))
+    assert [os.path.relpath(path, str(tmpdir)) for path in g.discover_sources(str(tmpdir))] == [
+        os.path.join('slides', '1.md'), os.path.join('slides', '2.rst')]
+    assert [slide['title'] for slide in g.fetch_contents(g.source, g.work_dir)] == ['slides/1.md', 'slides/2.rst']
+
+    files = dict((path, u'# %s' % path) for path in ('deck/a.md', 'deck/sub/b.md', 'deck/c.txt', 'deck/.d.md'))
+    g = Generator('deck', files=files, exclude=['sub'])
+    assert g.fs.entries('deck') == [('.d.md', False), ('a.md', False), ('c.txt', False), ('sub', True)]
+    assert list(g.discover_sources('deck')) == [os.path.join('deck', 'a.md')]
+
+
+def test_iter_slides_streams(tmpdir):
+    for name in ('a', 'b', 'c'):
+        tmpdir.join('%s.md' % name).write('# %s1\n\n.notes: n\n\n---\n\n## %s2\n\ntext' % (name, name))
+    messages = []
+    g = Generator(str(tmpdir), logger=lambda message, type='notice': messages.append(message), verbose=True)
+    slides = g.iter_slides()
+    first = next(slides)
+    assert first.as_dict() == {
+        'number': 1, 'title': 'a1', 'level': 1, 'classes': ['slide-title'], 'header': '<h1>a1</h1>',
+        'content': '', 'presenter_notes': '<p>n</p>', 'footer': None, 'source': str(tmpdir.join('a.md'))}
+    assert [message for message in messages if message.startswith('Adding')] == [
+        "Adding   %r (markdown)" % str(tmpdir.join('a.md'))]
+    assert [slide.number for slide in slides] == [2, 3, 4, 5, 6]
+    assert g.slide_cache == {}
+    assert [entry.title for entry in g.toc] == ['a1', 'b1', 'c1']
+
+    destination = tmpdir.join('out', 'slides.ndjson')
+    tmpdir.join('out').ensure(dir=True)
+    Generator(str(tmpdir), output_format='ndjson', destination_file=str(destination)).execute()
+    lines = destination.read().splitlines()
+    assert [json.loads(line)['title'] for line in lines] == ['a1', 'a2', 'b1', 'b2', 'c1', 'c2']
+    assert Generator(str(tmpdir), output_format='ndjson').destination_file == 'presentation.ndjson'
+    raises(ValueError, Generator, str(tmpdir), output_format='pdf')
+
+
+def test_render_from_memory(tmpdir):
+    with open(os.path.join(DATA_DIR, 'img.png'), 'rb') as fh:
+        image = fh.read()
+    files = {
+        'deck/presentation.cfg': u'[darkslide]\nsource = slides\ncss = style.css\n',
+        'deck/style.css': u'.custom {color: red;}',
+        'deck/slides/1.md': u'# One\n\n![img](img.png)',
+        'deck/slides/2.rst': u'Two\n===\n\nțară',
+        'deck/slides/img.png': image,
+        'deck/slides/ignored.txt': u'nope',
+    }
+    cwd = os.getcwd()
+    tmpdir.mkdir('theme').mkdir('css').join('base.css').write('.from-cwd {}')
+    with tmpdir.as_cwd():
+        html = generator.render_files(files, 'deck/presentation.cfg', embed=True)
+        assert os.getcwd() == str(tmpdir)
+        assert tmpdir.listdir() == [tmpdir.join('theme')]
+    assert os.getcwd() == cwd
+    assert '<h1>One</h1>' in html
+    assert u'țară' in html
+    assert '.custom {color: red;}' in html
+    assert '.from-cwd' not in html
+    assert 'src="data:image/png;base64,%s"' % base64.b64encode(image).decode() in html
+    raises(IOError, generator.render_files, files, 'deck/missing.md')
+
+    html = generator.render_string(u'Title\n=====\n\n---------\n\nNext\n====', 'restructuredtext')
+    assert '<h1>Title</h1>' in html
+    assert '<h1>Next</h1>' in html
+    raises(NotImplementedError, generator.render_string, u'', 'txt')
+
+
 def test_process_macros():
     g = Generator(os.path.join(DATA_DIR, 'test.md'))
     # Notes
@@ -196,15 +744,81 @@ echo $bar;
 
 
 def test_macro_parsing_code_blocks():
-    m = macro.CodeHighlightingMacro(logtest)
-    blocks = m.macro_re.findall(SAMPLE_HTML)
+    blocks = scanner.find_code_blocks(SAMPLE_HTML)
     assert len(blocks) == 3
-    assert blocks[0][2] == 'python'
-    assert blocks[0][3].startswith('def foo():')
-    assert blocks[1][2] == 'php'
-    assert blocks[1][3].startswith('<?php')
-    assert blocks[2][2] == 'xml'
-    assert blocks[2][3].startswith('<foo>')
+    assert blocks[0].lang == 'python'
+    assert blocks[0].code.startswith('def foo():')
+    assert blocks[1].lang == 'php'
+    assert blocks[1].code.startswith('<?php')
+    assert blocks[2].lang == 'xml'
+    assert blocks[2].code.startswith('<foo>')
+    assert SAMPLE_HTML[blocks[0].start:blocks[0].end].startswith('<pre ')
+    assert SAMPLE_HTML[blocks[0].start:blocks[0].end].endswith('</pre>')
+
+
+def test_scanner_tags():
+    html = ('<!-- <img src="no.png"> --><p class=a title=\'x > y\'>text</p>'
+            '<script>var s = "<img src=no.png>";</script>'
+            '<IMG SRC="a.png" src="b.png"/><object type="image/svg+xml" data=c.svg></object>'
+            '<img alt="img.png" src="img.png"><img src="d.png')
+    tags = list(scanner.iter_tags(html))
+    assert [(tag.name, tag.closing) for tag in tags] == [
+        ('p', False), ('p', True), ('script', False), ('script', True), ('img', False),
+        ('object', False), ('object', True), ('img', False)]
+    assert tags[0].attrs == {'class': 'a', 'title': 'x > y'}
+    images = list(scanner.find_images(html))
+    assert [url for url, start, end in images] == ['a.png', 'c.svg', 'img.png']
+    assert all(html[start:end] == url for url, start, end in images)
+    assert scanner.replace_spans(html, [(start, end, 'x/' + url) for url, start, end in images]).endswith(
+        '<img alt="img.png" src="x/img.png"><img src="d.png')
+    assert scanner.find_code_blocks('<pre>\n!python\nfoo</pre><pre><code class="sh">bar\n</code> </pre><pre>') == [
+        scanner.CodeBlock(0, 23, 'python', 'foo'), scanner.CodeBlock(23, 63, 'sh', 'bar')]
+
+
+PATHOLOGICAL_HTML = [
+    '<pre>' * 20000,
+    '<pre><code>' + 'a <b> ' * 20000,
+    '<pre><code>!x\n' * 10000,
+    '<img ' * 20000,
+    '<img ' + 'a="b" ' * 20000 + 'src="x.png">',
+    '<img ' + 'a="b ' * 20000,
+    '<img a="' * 20000,
+    '<object data="a" ' * 20000,
+    '<' * 100000,
+    '</' * 50000,
+    '<!' * 50000,
+    '<!--' + '-' * 100000,
+    '<script>' + '<img src="x">' * 10000,
+]
+
+
+@pytest.mark.parametrize('html', PATHOLOGICAL_HTML, ids=lambda html: repr(html[:12]))
+def test_macros_scan_in_linear_time(html):
+    started = time.time()
+    macro.CodeHighlightingMacro(logtest).process(html)
+    macro.EmbedImagesMacro.remote_urls(html)
+    macro.FixImagePathsMacro(logtest, False, options={'relative': False}).process(html, 'slides.md')
+    assert time.time() - started < 5
+
+
+def test_scanner_fuzz():
+    rng = random.Random(42)
+    fragments = ['<', '>', '/', '=', '"', "'", ' ', '\n', '!', '-', 'pre', 'code', 'img', 'src', 'object',
+                 'data', 'script', '<pre>', '</pre>', '<code class="py">', '</code>', '<img src="a.png">',
+                 '<!--', '-->', 'x', '&lt;', '!python\n']
+    for _ in range(300):
+        html = ''.join(rng.choice(fragments) for _ in range(rng.randint(0, 200)))
+        for tag in scanner.iter_tags(html):
+            assert html[tag.start] == '<' and html[tag.end - 1] == '>'
+            assert all(html[start:end] == tag.attrs[key] for key, (start, end) in tag.spans.items())
+        for url, start, end in scanner.find_images(html):
+            assert html[start:end] == url
+        position = 0
+        for block in scanner.find_code_blocks(html):
+            assert position <= block.start < block.end
+            assert html[block.start:block.end].lower().endswith('</pre>')
+            position = block.end
+        macro.FixImagePathsMacro(logtest, False, options={'relative': False}).process(html, 'slides.md')
 
 
 def test_macro_descape():
@@ -237,6 +851,22 @@ def test_macro_process_rst_code_blocks():
     assert hl[1][0] == u'has_code'
 
 
+def test_guess_lang():
+    messages = []
+    m = macro.CodeHighlightingMacro(lambda message, type='notice': messages.append(message),
+                                    options={'guess_lang': ['python', 'bash', 'sql']})
+    html, classes = m.process('<pre><code>!nosuchlang\nx</code></pre>\n<pre><code>import os\nprint(os.sep)</code></pre>\n'
+                              '<pre><code>SELECT a FROM t;</code></pre>\n<pre><code>???</code></pre>')
+    assert messages == ['Unknown pygment lexer "nosuchlang", skipping',
+                        "Couldn't guess the language of a code block, skipping"]
+    assert html.count('<div class="highlight">') == 2
+    assert '<span class="kn">import</span>' in html and '<span class="k">SELECT</span>' in html
+    assert macro.guess_lang('import os\n' + '(' * 10000, ['bash', 'python']) == 'python'
+    assert macro.CodeHighlightingMacro(logtest).process('<pre><code>import os</code></pre>')[0] == \
+        '<pre><code>import os</code></pre>'
+    raises(ValueError, Generator, os.path.join(DATA_DIR, 'test.md'), guess_lang='python, nosuchlang')
+
+
 def test_embed_images_macro_process():
     base_dir = os.path.join(DATA_DIR, 'test.md')
     m = macro.EmbedImagesMacro(logtest, True)
@@ -248,6 +878,121 @@ def test_embed_images_macro_process():
     assert base64.b64decode(match.group(1))
 
 
+@pytest.fixture
+def http_server():
+    with open(os.path.join(DATA_DIR, 'img.png'), 'rb') as fh:
+        image = fh.read()
+    requests = []
+
+    class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            requests.append((self.path, self.headers.get('If-None-Match')))
+            if self.path != '/img.png':
+                self.send_response(404)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+            elif self.headers.get('If-None-Match') == '"v1"':
+                self.send_response(304)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+            else:
+                self.send_response(200)
+                self.send_header('Content-Type', 'image/png')
+                self.send_header('Content-Length', str(len(image)))
+                self.send_header('ETag', '"v1"')
+                self.end_headers()
+                self.wfile.write(image)
+
+        def log_message(self, *args):
+            pass
+
+    class Server(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+        daemon_threads = True
+
+    server = Server(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    server.requests = requests
+    server.url = 'http://127.0.0.1:%s' % server.server_address[1]
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_embed_remote_images(http_server, tmpdir):
+    source = tmpdir.join('slides.md')
+    source.write('# Remote\n\n![ok](%(url)s/img.png)\n![missing](%(url)s/missing.png)\n\n---\n\n'
+                 '# Again\n\n![ok](%(url)s/img.png)\n' % {'url': http_server.url})
+    cache_dir = str(tmpdir.join('cache'))
+    messages = []
+
+    def logger(message, type='notice'):
+        messages.append((type, message))
+
+    html = Generator(str(source), embed=True, cache_dir=cache_dir, logger=logger).render()
+    assert html.count('src="data:image/png;base64,') == 2
+    assert 'src="%s/missing.png"' % http_server.url in html
+    assert ('warning', 'Failed to embed image "%s/missing.png"' % http_server.url) in messages
+    assert sorted(http_server.requests) == [('/img.png', None), ('/missing.png', None)]
+
+    del http_server.requests[:]
+    html = Generator(str(source), embed=True, cache_dir=cache_dir, logger=logger).render()
+    assert html.count('src="data:image/png;base64,') == 2
+    assert sorted(http_server.requests) == [('/img.png', '"v1"'), ('/missing.png', None)]
+
+
+def test_remote_fetcher_downloads_once(http_server, tmpdir):
+    fetcher = RemoteFetcher(str(tmpdir))
+    workers = ThreadPool(4)
+    try:
+        results = workers.map(fetcher.fetch, ['%s/img.png' % http_server.url] * 8)
+    finally:
+        workers.close()
+        workers.join()
+        fetcher.close()
+    assert all(result and result[0] == 'image/png' for result in results)
+    assert http_server.requests == [('/img.png', None)]
+
+
+def test_serve_api():
+    server = RenderServer(('127.0.0.1', 0), workers=1, max_requests=2)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    url = 'http://127.0.0.1:%s' % server.server_address[1]
+
+    def post(request):
+        try:
+            response = urlopen(url + '/render', json.dumps(request).encode('utf-8'))
+            return response.getcode(), response.read().decode('utf-8')
+        except HTTPError as exc:
+            return exc.code, json.loads(exc.read().decode('utf-8'))['error']
+
+    try:
+        status, html = post({'files': {'slides/a.md': '# Hello\n\nfoo'}, 'options': {'embed': True}})
+        assert status == 200
+        assert '<h1>Hello</h1>' in html
+        status, html = post({'source': os.path.join(DATA_DIR, 'test.md')})
+        assert status == 200
+        assert '<pre><span' in html
+        assert post({'source': os.path.join(DATA_DIR, 'test.md'), 'options': {'watch': True}}) == (
+            400, 'Unsupported options: watch')
+        assert post({'files': {'a.md': '# Nope'}, 'source': 'b.md'}) == (
+            400, 'Source file/directory b.md does not exist')
+
+        metrics = json.loads(urlopen(url + '/metrics').read().decode('utf-8'))
+        assert metrics['requests'] == 4
+        assert metrics['errors'] == 2
+        assert metrics['latency']['count'] == 4
+        assert metrics['caches']['templates']['hits'] >= 1
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
 def test_fix_image_paths_macro_process():
     base_dir = os.path.join(DATA_DIR, 'test.md')
     m = macro.FixImagePathsMacro(logtest, False, options={"relative": False})
@@ -278,6 +1023,54 @@ def test_parser__init__():
     raises(NotImplementedError, Parser, '.txt')
 
 
+def test_parser_markdown_code_highlighting():
+    html = Parser('.md', linenos='no').parse(u"""Code:
+
+    !python
+    x = '<a>'
+
+```javascript
+var y;
+```
+
+    plain
+""")
+    assert html.count('<div class="highlight">') == 2
+    assert '<span class="s1">&#39;&lt;a&gt;&#39;</span>' in html
+    assert '<span class="kd">var</span>' in html
+    assert '<pre><code>plain\n</code></pre>' in html
+    highlighted = html[:html.index('<pre><code>plain')]
+    assert macro.CodeHighlightingMacro(logtest).process(highlighted) == (highlighted, [u'has_code'])
+
+
+def test_parser_rst_markup():
+    html = Parser('.rst').parse(u"""Title
+=====
+
+.. contents::
+   :local:
+
+Section
+-------
+
+Text
+
+Other
+-----
+
+----
+
+.. code-block:: python
+
+    x = 1
+""")
+    assert '<div' not in html
+    assert '<h1>Section</h1>' in html
+    assert 'toc-backref' not in html
+    assert '<hr />\n' in html
+    assert '<pre><span></span><span class="n">x</span>' in html
+
+
 class WarningMessage(Exception):
     pass
 